@@ -13,6 +13,13 @@ from scipy.stats import gamma
 import numpy as np
 import seaborn as sns
 import pystan
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../mobility'))
+from epidemic_data import read_epidemic_data, country_data, epidemic_starts
+from delay_kernels import death_kernels
+from draw_store import write_draws, read_draws
+from summary_table import read_summary, summary_column
+from approximate import vb_algorithms, fit_vb
+from stan_models import compiled_model, sampling_profiles, sampling_settings, write_sampling_settings, output_pars, warm_start, write_adaptation
 
 import pdb
 
@@ -28,6 +35,11 @@ parser.add_argument('--stan_model', nargs=1, type= str, default=sys.stdin, help
 parser.add_argument('--days_to_simulate', nargs=1, type= int, default=sys.stdin, help = 'Number of days to model.')
 parser.add_argument('--end_date', nargs=1, type= str, default=sys.stdin, help = 'Up to which date to include data.')
 parser.add_argument('--outdir', nargs=1, type= str, default=sys.stdin, help = 'Path to outdir.')
+parser.add_argument('--profile', nargs=1, type= str, default=['production'], choices=[*sampling_profiles], help = 'Sampling profile (iterations, chains, thinning and control settings).')
+parser.add_argument('--n_jobs', nargs=1, type= int, default=[None], help = 'Max number of cores to use (one per chain, or shared out as threads per chain with --backend cmdstan). Default all available.')
+parser.add_argument('--outputs', nargs=1, type= str, default=[None], help = 'Variables to keep in the fit, summary and saved draws (csv), e.g. alpha,mu,phi,prediction,E_deaths,Rt. Default all.')
+parser.add_argument('--warm_start', nargs=1, type= str, default=[None], help = 'Outdir of an earlier fit of the same countries to initialize the chains from, with a shorter warmup.')
+parser.add_argument('--backend', nargs=1, type= str, default=['nuts'], choices=['nuts', 'cmdstan']+vb_algorithms, help = 'Inference: nuts (MCMC), cmdstan (MCMC with CmdStan, several threads per chain for reduce_sum models, e.g. base_reduce_sum.stan) or approximate ADVI (meanfield or fullrank) with as many draws as the sampling profile.')
 
 ###FUNCTIONS###
 
@@ -42,17 +54,6 @@ def conv_gamma_params(mean,std):
 
         return shape,scale
 
-def infection_to_death():
-        '''Simulate the time from infection to death: Infection --> Onset --> Death'''
-        #In R
-        #x1 = rgammaAlt(5e6,mean1,cv1) # infection-to-onset ----> do all people who are infected get to onset?
-        #x2 = rgammaAlt(5e6,mean2,cv2) # onset-to-death
-        #From https://cran.r-project.org/web/packages/EnvStats/EnvStats.pdf
-        #Infection to death: sum of ito and otd
-        itd_shape, itd_scale = conv_gamma_params((5.1+18.8), (0.45))
-        itd = gamma(a=itd_shape, scale = itd_scale) #a=shape
-        return itd
-
 def serial_interval_distribution():
         '''Models the the time between when a person gets infected and when
         they subsequently infect another other people
@@ -89,12 +90,10 @@ def read_and_format_data(datadir, countries, N2, end_date):
         '''Read in and format all data needed for the model
         '''
 
-        #Get epidemic data
-        epidemic_data = pd.read_csv(datadir+'ecdc_20200419.csv')
-        #Convert to datetime
-        epidemic_data['dateRep'] = pd.to_datetime(epidemic_data['dateRep'], format='%d/%m/%Y')
-        #Select all data up to end_date
-        epidemic_data = epidemic_data[epidemic_data['dateRep']<=end_date]
+        #Get epidemic data, grouped and sorted per country
+        epidemic_data = read_epidemic_data(datadir+'ecdc_20200419.csv')
+        #Get the days with at least 10 deaths and 30 days before, using all data up to end_date
+        death_indices, start_rows = epidemic_starts(epidemic_data, countries, end_date)
         ## get CFR
         cfr_by_country = pd.read_csv(datadir+"weighted_fatality.csv")
         #SI
@@ -129,8 +128,8 @@ def read_and_format_data(datadir, countries, N2, end_date):
                     'y':[] #index cases
                     }
 
-        #Infection to death distribution
-        itd = infection_to_death()
+        #Fatality rate per country, for the infection to death kernel
+        cfrs = []
         #Covariate names
         covariate_names = ['schools_universities', 'self_isolating_if_ill','public_events', 'any_intervention', 'lockdown', 'social_distancing_encouraged']
         #Get data by country
@@ -138,24 +137,16 @@ def read_and_format_data(datadir, countries, N2, end_date):
                 country = countries[c]
                 #Get fatality rate
                 cfr = cfr_by_country[cfr_by_country['Region, subregion, country or area *']==country]['weighted_fatality'].values[0]
+                cfrs.append(cfr)
 
-                #Get country epidemic data
-                country_epidemic_data = epidemic_data[epidemic_data['countriesAndTerritories']==country]
-                #Sort on date
-                country_epidemic_data = country_epidemic_data.sort_values(by='dateRep')
-                #Reset index
-                country_epidemic_data = country_epidemic_data.reset_index()
                 #Get all dates with at least 10 deaths
-                cum_deaths = country_epidemic_data['deaths'].cumsum()
-                death_index = cum_deaths[cum_deaths>=10].index[0]
+                death_index = death_indices[c]
                 di30 = death_index-30
 
                 #Add epidemic start to stan data
                 stan_data['EpidemicStart'].append(death_index+1-di30) #30 days before 10 deaths
-                #Get part of country_epidemic_data 30 days before day with at least 10 deaths
-                country_epidemic_data = country_epidemic_data.loc[di30:]
-		#Reset index
-                country_epidemic_data = country_epidemic_data.reset_index()
+                #Get country epidemic data from 30 days before day with at least 10 deaths, sorted on date
+                country_epidemic_data = country_data(epidemic_data, country, end_date, start_rows[c])
                 #Save dates
                 dates_by_country[country] = country_epidemic_data['dateRep']
                 #Save deaths
@@ -181,31 +172,6 @@ def read_and_format_data(datadir, countries, N2, end_date):
                     pdb.set_trace()
 
 
-                #Get hazard rates for all days in country data
-                h = np.zeros(N2) #N2 = N+forecast
-                f = np.cumsum(itd.pdf(np.arange(1,len(h)+1,0.5))) #Cumulative probability to die for each day
-                for i in range(1,len(h)):
-                    #for each day t, the death prob is the area btw [t-0.5, t+0.5]
-                    #divided by the survival fraction (1-the previous death fraction), (fatality ratio*death prob at t-0.5)
-                    #This will be the percent increase compared to the previous end interval
-                    h[i] = (cfr*(f[i*2+1]-f[i*2-1]))/(1-cfr*f[i*2-1])
-
-                #The number of deaths today is the sum of the past infections weighted by their probability of death,
-                #where the probability of death depends on the number of days since infection.
-                s = np.zeros(N2)
-                s[0] = 1
-                for i in range(1,len(s)):
-                    #h is the percent increase in death
-                    #s is thus the relative survival fraction
-                    #The cumulative survival fraction will be the previous
-                    #times the survival probability
-                    #These will be used to track how large a fraction is left after each day
-                    #In the end all of this will amount to the adjusted death fraction
-                    s[i] = s[i-1]*(1-h[i-1]) #Survival fraction
-
-                #Multiplying s and h yields fraction dead of fraction survived
-                f = s*h #This will be fed to the Stan Model
-                stan_data['f'][:,c]=f
 
                 #Number of cases
                 cases = np.zeros(N2)
@@ -227,6 +193,9 @@ def read_and_format_data(datadir, countries, N2, end_date):
                     cov_i[N:N2]=cov_i[N-1]
                     stan_data[name][:,c] = cov_i
 
+        #Infection to death kernel f = s*h for all countries at once
+        stan_data['f'] = death_kernels(cfrs, N2)
+
         #Rename covariates to match stan model
         for i in range(len(covariate_names)):
             stan_data['covariate'+str(i+1)] = stan_data.pop(covariate_names[i])
@@ -235,25 +204,42 @@ def read_and_format_data(datadir, countries, N2, end_date):
 
 
 
-def simulate(stan_data, stan_model, outdir):
+def simulate(stan_data, stan_model, outdir, profile, n_jobs, outputs, warm_start_dir=None, backend='nuts'):
         '''Simulate using stan: Efficient MCMC exploration according to Bayesian posterior distribution
         for parameter estimation.
+        profile = name of the sampling profile
+        n_jobs = max number of cores to use
+        outputs = the variables to keep, all if None
+        warm_start_dir = outdir of an earlier fit to warm start from, None for random inits
+        backend = nuts, cmdstan (nuts with threads per chain, for reduce_sum models) or an approximate vb algorithm (same output layout)
         '''
 
-        sm =  pystan.StanModel(file=stan_model)
         #fit = sm.sampling(data=stan_data, iter=40, warmup=20,chains=2) #n_jobs = number of parallel processes - number of chains
-        fit = sm.sampling(data=stan_data,iter=4000,warmup=2000,chains=8,thin=4, control={'adapt_delta': 0.98, 'max_treedepth': 10})
-        s = fit.summary()
+        settings = sampling_settings(profile, {'adapt_delta': 0.98, 'max_treedepth': 10}, n_jobs, outputs)
+        if warm_start_dir is not None:
+            settings = warm_start(settings, profile, warm_start_dir, stan_model, stan_data['M'])
+        if backend == 'cmdstan':
+            #Optional dependency, only needed for this backend
+            from cmdstan_runner import chain_threads, simulate_cmdstan
+            settings['n_jobs'], settings['threads_per_chain'] = chain_threads(settings['chains'], n_jobs)
+        write_sampling_settings(profile, settings, outdir, warm_start_dir, backend)
+        if backend == 'cmdstan':
+            return simulate_cmdstan(stan_data, stan_model, outdir, settings)
+        sm = compiled_model(stan_model)
+        if backend != 'nuts':
+            #Approximate posterior with as many draws as the sampling profile
+            draws = settings['chains']*(settings['iter']-settings['warmup'])//settings['thin']
+            return fit_vb(sm, stan_data, outdir, backend, draws, settings['pars'])
+        fit = sm.sampling(data=stan_data, **settings)
+        write_adaptation(fit, stan_model, outdir)
+        s = fit.summary(pars=settings['pars'])
         summary = pd.DataFrame(s['summary'], columns=s['summary_colnames'], index=s['summary_rownames'])
         summary.to_csv(outdir+'summary.csv')
 
-        #Save fit
-        out = fit.extract()
-        for key in [*out.keys()]:
-            fit_param = out[key]
-            np.save(outdir+key+'.npy', fit_param)
+        #Save fit - each parameter as np array (draws x dims)
+        write_draws(fit, outdir, settings['pars'])
 
-        return out
+        return fit
 
 def visualize_results(outdir, countries, covariate_names, dates_by_country, deaths_by_country, cases_by_country):
     '''Visualize results
@@ -266,16 +252,13 @@ def visualize_results(outdir, countries, covariate_names, dates_by_country, deat
 
     subdir='without_log/'
     #Read in data
-    summary = pd.read_csv(outdir+subdir+'summary.csv')
-    cases = np.load(outdir+subdir+'prediction.npy', allow_pickle=True)
-    deaths = np.load(outdir+subdir+'E_deaths.npy', allow_pickle=True)
-    Rt =  np.load(outdir+subdir+'Rt.npy', allow_pickle=True)
-    alphas = np.load(outdir+subdir+'alpha.npy', allow_pickle=True)
+    summary = read_summary(outdir+subdir)
+    alphas = read_draws(outdir+subdir, 'alpha')
     days = np.arange(0,75)
 
     #Plot rhat
     fig, ax = plt.subplots(figsize=(6, 4))
-    ax.hist(summary['Rhat'])
+    ax.hist(summary_column(summary, 'Rhat'))
     ax.set_ylabel('Count')
     ax.set_xlabel("Rhat")
     fig.savefig(subdir+'plots/rhat.png', format='png')
@@ -283,8 +266,8 @@ def visualize_results(outdir, countries, covariate_names, dates_by_country, deat
 
     #Plot alpha (Rt = R0*exp(-sum{alpha1-6}))
     fig, ax = plt.subplots(figsize=(4, 4))
-    alpha_means = np.mean(alphas[2000:,:],axis=0) #2000 warmup rounds
-    alpha_stds = np.std(alphas[2000:,:],axis=0)
+    alpha_means = np.mean(alphas,axis=0) #The saved draws contain no warmup
+    alpha_stds = np.std(alphas,axis=0)
     ax.barh(np.arange(6),1-np.exp(-alpha_means), xerr = 1-np.exp(-alpha_stds))
     ax.set_ylabel('Fractional reduction in R0')
     covariate_names.insert(0,'')
@@ -300,14 +283,14 @@ def visualize_results(outdir, countries, covariate_names, dates_by_country, deat
         end = len(dates)#End of data
         dates = np.array(dates,  dtype='datetime64[D]')
         #Plot cases (prediction)
-        country_cases = cases[:,:,i][2000:,:end]
+        country_cases = read_draws(outdir+subdir, 'prediction', country=i, days=slice(0,end))
         case_av =  np.average(country_cases,axis=0)
         case_std =  np.std(country_cases,axis=0)
         observed_country_cases = cases_by_country[country]
         plot_shade_ci(days[:end], dates, case_av, observed_country_cases, case_std,'Cases',subdir+'plots/'+country+'_cases.png')
 
         #Plot Deaths
-        country_deaths = deaths[:,:,i][2000:,:end]
+        country_deaths = read_draws(outdir+subdir, 'E_deaths', country=i, days=slice(0,end))
         #country_deaths = np.exp(country_deaths) #Necessary if neg_binomial_2_log_lpmf has been used in the stan model
         observed_country_deaths = deaths_by_country[country]
         death_av =  np.average(country_deaths,axis=0)
@@ -315,7 +298,7 @@ def visualize_results(outdir, countries, covariate_names, dates_by_country, deat
         plot_shade_ci(days[:end],dates,death_av,observed_country_deaths, death_std,'Deaths',subdir+'plots/'+country+'_deaths.png')
 
         #Plot R
-        country_Rt = Rt[:,:,i][2000:,:end]
+        country_Rt = read_draws(outdir+subdir, 'Rt', country=i, days=slice(0,end))
         Rt_av =  np.average(country_Rt,axis=0)
         Rt_std =  np.std(country_Rt,axis=0)
         plot_shade_ci(days[:end],dates,Rt_av,'', Rt_std,'Rt',subdir+'plots/'+country+'_Rt.png')
@@ -352,6 +335,6 @@ outdir = args.outdir[0]
 #Read data
 stan_data, covariate_names, dates_by_country, deaths_by_country, cases_by_country = read_and_format_data(datadir, countries, days_to_simulate, end_date)
 #Simulate
-out = simulate(stan_data, stan_model, outdir)
+fit = simulate(stan_data, stan_model, outdir, args.profile[0], args.n_jobs[0], output_pars(args.outputs[0]), args.warm_start[0], args.backend[0])
 #Visualize
 #visualize_results(outdir, countries, covariate_names, dates_by_country, deaths_by_country, cases_by_country)
@@ -0,0 +1,81 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import sys
+import os
+import pandas as pd
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from summary_table import read_summary
+
+import pdb
+
+
+
+#Arguments for argparse module:
+parser = argparse.ArgumentParser(description = '''Compare an approximate fit (e.g. ADVI) to a reference NUTS fit of the same data:
+the alpha intervals and the Rt bands per country.''')
+
+parser.add_argument('--reference', nargs=1, type= str, default=sys.stdin, help = 'Outdir of the reference (NUTS) fit.')
+parser.add_argument('--approximate', nargs=1, type= str, default=sys.stdin, help = 'Outdir of the approximate fit.')
+parser.add_argument('--countries', nargs=1, type= str, default=sys.stdin, help = 'Countries modeled (csv), in the order used when fitting.')
+parser.add_argument('--outdir', nargs=1, type= str, default=sys.stdin, help = 'Path to outdir.')
+
+def compare_alphas(reference, approximate, outdir):
+    '''Fractional reduction in R0 (1-exp(-alpha)) with 95 % intervals from both fits
+    '''
+    comparison = pd.DataFrame()
+    for fit_name, summary in [('reference', reference), ('approximate', approximate)]:
+        alpha = summary['alpha']
+        comparison['alpha'] = np.arange(1, len(alpha['mean'])+1)
+        for stat in ['mean', '2.5%', '97.5%']:
+            comparison[fit_name+' '+stat] = 1-np.exp(-alpha[stat])
+    comparison.to_csv(outdir+'alpha_comparison.csv', index=False)
+
+    #Plot the intervals next to each other
+    fig, ax = plt.subplots(figsize=(9/2.54, 9/2.54))
+    for fit_name, shift, color in [('reference', -0.15, 'k'), ('approximate', 0.15, 'tab:red')]:
+        x = comparison['alpha'].values+shift
+        ax.plot([x, x], [comparison[fit_name+' 2.5%'], comparison[fit_name+' 97.5%']], color=color)
+        ax.scatter(x, comparison[fit_name+' mean'], color=color, marker='_', label=fit_name)
+    ax.legend(frameon=False)
+    ax.set_ylim([0,1])
+    ax.set_ylabel('Fractional reduction in R0')
+    ax.set_xticks(comparison['alpha'].values)
+    ax.set_xticklabels(['retail and recreation', 'grocery and pharmacy', 'transit stations','workplace', 'residential'][:len(comparison)],rotation='vertical')
+    plt.tight_layout()
+    fig.savefig(outdir+'alpha_comparison.png', format='png', dpi=300)
+    plt.close()
+    return comparison
+
+def compare_Rt(reference, approximate, countries, outdir):
+    '''Per country: the largest and mean difference in the Rt means, the mean ratio of the
+    95 % band widths (approximate/reference) and the fraction of days where the approximate
+    mean lies within the reference 95 % band
+    '''
+    #Days x countries
+    reference_Rt, approximate_Rt = reference['Rt'], approximate['Rt']
+    difference = np.abs(approximate_Rt['mean']-reference_Rt['mean'])
+    width_ratio = (approximate_Rt['97.5%']-approximate_Rt['2.5%'])/(reference_Rt['97.5%']-reference_Rt['2.5%'])
+    within = (approximate_Rt['mean']>=reference_Rt['2.5%']) & (approximate_Rt['mean']<=reference_Rt['97.5%'])
+    comparison = pd.DataFrame({'Country':countries[:difference.shape[1]], 'max_difference':np.nanmax(difference, axis=0),
+                               'mean_difference':np.nanmean(difference, axis=0), 'width_ratio':np.nanmean(width_ratio, axis=0),
+                               'within_band':within.mean(axis=0)})
+    comparison.to_csv(outdir+'Rt_comparison.csv', index=False)
+    return comparison
+
+
+#####MAIN#####
+matplotlib.rcParams.update({'font.size': 9})
+args = parser.parse_args()
+countries = args.countries[0].split(',')
+outdir = args.outdir[0]
+os.makedirs(outdir, exist_ok=True)
+reference = read_summary(args.reference[0], ['alpha', 'Rt'])
+approximate = read_summary(args.approximate[0], ['alpha', 'Rt'])
+print(compare_alphas(reference, approximate, outdir).to_string(index=False))
+print(compare_Rt(reference, approximate, countries, outdir).to_string(index=False))
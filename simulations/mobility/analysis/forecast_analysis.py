@@ -13,6 +13,14 @@ from scipy.stats import gamma
 import numpy as np
 import seaborn as sns
 import pystan
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from epidemic_data import read_epidemic_data, country_data, epidemic_starts
+from stan_data_bundle import has_stan_data, read_stan_data, plot_data
+from summary_table import read_summary, summary_column
+from draw_store import has_draws
+from draw_statistics import draw_statistics, interval_quantiles, quantile_name, exceedance_name, predictive_exceedance
+from forecast_scores import write_scores
+from renewal import has_phi
 
 import pdb
 
@@ -26,17 +34,17 @@ parser.add_argument('--countries', nargs=1, type= str, default=sys.stdin, help =
 parser.add_argument('--days_to_simulate', nargs=1, type= int, default=sys.stdin, help = 'Number of days to simulate.')
 parser.add_argument('--end_date', nargs=1, type= str, default=sys.stdin, help = 'End date of data used to fit model.')
 parser.add_argument('--outdir', nargs=1, type= str, default=sys.stdin, help = 'Path to outdir.')
+parser.add_argument('--levels', nargs=1, type= str, default=[''], help = 'Central credible intervals to add from the draws of E_deaths (csv), e.g. 0.5,0.8,0.9,0.95.')
+parser.add_argument('--exceedance', nargs=1, type= str, default=[''], help = 'Death counts X to add P(deaths > X) for from the draws of E_deaths and phi, under the negative binomial posterior predictive (csv).')
 
 def read_and_format_data(datadir, countries, days_to_simulate, end_date):
         '''Read in and format all data needed for the model
         '''
 
-        #Get epidemic data
-        epidemic_data = pd.read_csv(datadir+'ecdc_20200419.csv')
-        #Convert to datetime
-        epidemic_data['dateRep'] = pd.to_datetime(epidemic_data['dateRep'], format='%d/%m/%Y')
-        #Select all data up to end_date
-        epidemic_data = epidemic_data[epidemic_data['dateRep']<=end_date]
+        #Get epidemic data, grouped and sorted per country
+        epidemic_data = read_epidemic_data(datadir+'ecdc_20200419.csv')
+        #Get the days with at least 10 deaths and 30 days before, using all data up to end_date
+        death_indices, start_rows = epidemic_starts(epidemic_data, countries, end_date)
         ## get CFR
         cfr_by_country = pd.read_csv(datadir+"weighted_fatality.csv")
         #SI
@@ -55,21 +63,11 @@ def read_and_format_data(datadir, countries, days_to_simulate, end_date):
         for c in range(len(countries)):
                 country = countries[c]
 
-                #Get country epidemic data
-                country_epidemic_data = epidemic_data[epidemic_data['countriesAndTerritories']==country]
-                #Sort on date
-                country_epidemic_data = country_epidemic_data.sort_values(by='dateRep')
-                #Reset index
-                country_epidemic_data = country_epidemic_data.reset_index()
-
                 #Get all dates with at least 10 deaths
-                cum_deaths = country_epidemic_data['deaths'].cumsum()
-                death_index = cum_deaths[cum_deaths>=10].index[0]
+                death_index = death_indices[c]
                 di30 = death_index-30
-                #Get part of country_epidemic_data 30 days before day with at least 10 deaths
-                country_epidemic_data = country_epidemic_data.loc[di30:]
-                #Reset index
-                country_epidemic_data = country_epidemic_data.reset_index()
+                #Get country epidemic data from 30 days before day with at least 10 deaths, sorted on date
+                country_epidemic_data = country_data(epidemic_data, country, end_date, start_rows[c])
 
                 print(country, len(country_epidemic_data))
                 #Check that foreacast is really a forecast
@@ -92,16 +90,46 @@ def read_and_format_data(datadir, countries, days_to_simulate, end_date):
 
         return stan_data
 
-def evaluate_forecast(outdir, countries, stan_data, days_to_simulate, end_date):
+def read_fitted_data(datadir, outdir, countries, end_date):
+        '''Get the data the model was fit on from the model output and add
+        the observed deaths and cases after the fitted period up to end_date,
+        on the row of their date (days missing in the ECDC data stay 0)
+        '''
+
+        stan_data = plot_data(*read_stan_data(outdir))
+        #Get epidemic data, grouped and sorted per country
+        epidemic_data = read_epidemic_data(datadir+'ecdc_20200419.csv')
+        for c in range(len(countries)):
+                country = countries[c]
+                N = int(stan_data['days_by_country'][c])
+                #Days after the last fitted date
+                country_epidemic_data = country_data(epidemic_data, country, end_date)
+                last_fitted = stan_data['dates_by_country'][N-1,c]
+                country_epidemic_data = country_epidemic_data[country_epidemic_data['dateRep']>pd.Timestamp(last_fitted)]
+                #Row of each date, within the modeled days
+                rows = N-1+(np.array(country_epidemic_data['dateRep'], dtype='datetime64[D]')-last_fitted).astype(int)
+                kept = rows < len(stan_data['deaths_by_country'])
+                stan_data['deaths_by_country'][rows[kept],c] = country_epidemic_data['deaths'].values[kept]
+                stan_data['cases_by_country'][rows[kept],c] = country_epidemic_data['cases'].values[kept]
+                stan_data['days_by_country'][c] = rows[kept].max()+1 if kept.any() else N
+                print(country, int(stan_data['days_by_country'][c]))
+
+        return stan_data
+
+def evaluate_forecast(outdir, countries, stan_data, days_to_simulate, end_date, levels=[], thresholds=[]):
     '''Evaluate forecast results per country in terms of the predicted (mean) vs the true number of deaths.
+    levels = central credible intervals to add from the draws (e.g. 0.9 -> Predicted 5, Predicted 95)
+    thresholds = death counts to add P(deaths > X) for from the draws, under the posterior predictive
+    (P(E_deaths > X) if phi was not saved)
+    The CRPS and log score of each observed day are written to outdir/scores.csv (forecast_scores.write_scores)
     '''
 
     #Read in data
-    summary = pd.read_csv(outdir+'summary.csv')
+    summary = read_summary(outdir)
     days = np.arange(0,days_to_simulate) #Days to simulate
     #Plot rhat
     fig, ax = plt.subplots(figsize=(6, 4))
-    ax.hist(summary['Rhat'])
+    ax.hist(summary_column(summary, 'Rhat'))
     ax.set_ylabel('Count')
     ax.set_xlabel("Rhat")
     fig.savefig(outdir+'plots/rhat.svg', format='svg')
@@ -115,7 +143,21 @@ def evaluate_forecast(outdir, countries, stan_data, days_to_simulate, end_date):
     death_week_97_5_forecast = []
     death_week_25_forecast = []
     death_week_75_forecast = []
+    death_week_50_forecast = [] #Median, for the weighted interval score
     death_week_observed = [] #Save observed deaths
+    #Intervals and exceedance probabilities from the draws
+    draw_columns = {}
+    if (levels or thresholds) and has_draws(outdir, 'E_deaths'):
+        quantiles = interval_quantiles(levels)
+        statistics = draw_statistics(outdir, 'E_deaths', quantiles)
+        draw_columns = {'Predicted '+quantile_name(quantile)[:-1]:statistics[quantile_name(quantile)] for quantile in quantiles}
+        #Exceedance of the deaths, with the observation noise, or else only of the expected deaths
+        if has_phi(outdir):
+            exceedance, column = predictive_exceedance(outdir, thresholds), 'P(deaths > {:g})'
+        else:
+            exceedance, column = draw_statistics(outdir, 'E_deaths', thresholds=thresholds), 'P(E_deaths > {:g})'
+        draw_columns.update({column.format(threshold):exceedance[exceedance_name(threshold)] for threshold in thresholds})
+    draw_values = {column:[] for column in draw_columns}
     forecast_dates = [] #Save forecast dates
     for i in range(1,len(countries)+1):
         country= countries[i-1]
@@ -124,20 +166,14 @@ def evaluate_forecast(outdir, countries, stan_data, days_to_simulate, end_date):
         observed_country_deaths = stan_data['deaths_by_country'][:,i-1]
         end = int(stan_data['days_by_country'][i-1])#End of data for country i
         #Extract modeled deaths
-        means = {'E_deaths':[]}
-        lower_bound = {'E_deaths':[]} #Estimated 2.5 %
-        higher_bound = {'E_deaths':[]} #Estimated 97.5 % - together 95 % CI
-        lower_bound25 = {'E_deaths':[]} #Estimated 25%
-        higher_bound75 = {'E_deaths':[]} #Estimated 55 % - together 75 % CI
-        #Get means and 95 % CI for cases (prediction), deaths and Rt for all time steps
+        #Get means and 95 % CI for deaths for all time steps
         var='E_deaths'
-        for j in range(1,days_to_simulate+1):
-            var_ij = summary[summary['Unnamed: 0']==var+'['+str(j)+','+str(i)+']']
-            means[var].append(var_ij['mean'].values[0])
-            lower_bound[var].append(var_ij['2.5%'].values[0])
-            higher_bound[var].append(var_ij['97.5%'].values[0])
-            lower_bound25[var].append(var_ij['25%'].values[0])
-            higher_bound75[var].append(var_ij['75%'].values[0])
+        means = {var:summary[var]['mean'][:days_to_simulate,i-1]}
+        lower_bound = {var:summary[var]['2.5%'][:days_to_simulate,i-1]} #Estimated 2.5 %
+        higher_bound = {var:summary[var]['97.5%'][:days_to_simulate,i-1]} #Estimated 97.5 % - together 95 % CI
+        lower_bound25 = {var:summary[var]['25%'][:days_to_simulate,i-1]} #Estimated 25%
+        higher_bound75 = {var:summary[var]['75%'][:days_to_simulate,i-1]} #Estimated 55 % - together 75 % CI
+        median = {var:summary[var]['50%'][:days_to_simulate,i-1]} #Estimated 50 %
 
         #Save deaths
         death_week_mean_forecast.extend(means['E_deaths'][:end])
@@ -145,7 +181,10 @@ def evaluate_forecast(outdir, countries, stan_data, days_to_simulate, end_date):
         death_week_97_5_forecast.extend(higher_bound['E_deaths'][:end])
         death_week_25_forecast.extend(lower_bound25['E_deaths'][:end])
         death_week_75_forecast.extend(higher_bound75['E_deaths'][:end])
+        death_week_50_forecast.extend(median['E_deaths'][:end])
         death_week_observed.extend(observed_country_deaths[:end])
+        for column in draw_columns:
+            draw_values[column].extend(draw_columns[column][:end,i-1])
         forecast_dates.extend(dates[:end])
         forecast_countries.extend([country]*len(means['E_deaths'][:end]))
 
@@ -157,9 +196,19 @@ def evaluate_forecast(outdir, countries, stan_data, days_to_simulate, end_date):
     result_df['Predicted 97.5'] = death_week_97_5_forecast
     result_df['Predicted 25'] = death_week_25_forecast
     result_df['Predicted 75'] = death_week_75_forecast
+    result_df['Predicted 50'] = death_week_50_forecast
+    for column in draw_values:
+        if column not in result_df.columns:
+            result_df[column] = draw_values[column]
     result_df['Observed deaths'] = death_week_observed
     result_df['End date'] = end_date
     result_df.to_csv(outdir+'forecast.csv')
+
+    #Score the observed deaths under the predictive distribution (CRPS and log score) if the draws are saved
+    if has_draws(outdir, 'E_deaths') and has_phi(outdir):
+        scores = write_scores(outdir, countries, stan_data['dates_by_country'], stan_data['deaths_by_country'],
+                              stan_data['days_by_country'], end_date-6)
+        print(scores[scores['Forecast']].groupby('Country')[['CRPS', 'Log score']].mean().to_string())
     return None
 
 
@@ -170,7 +219,12 @@ countries = args.countries[0].split(',')
 days_to_simulate=args.days_to_simulate[0] #Number of days to model. Increase for further forecast
 end_date = np.datetime64(args.end_date[0])+7 #Increase to one week ahead for obtaining forecast data
 outdir = args.outdir[0]
-#Read data
-stan_data = read_and_format_data(datadir, countries, days_to_simulate, end_date)
+#Read data - the data the model was fit on if saved with the model output
+if has_stan_data(outdir):
+    stan_data = read_fitted_data(datadir, outdir, countries, end_date)
+else:
+    stan_data = read_and_format_data(datadir, countries, days_to_simulate, end_date)
 #Format forecast data
-evaluate_forecast(outdir, countries, stan_data, days_to_simulate, end_date)
+levels = [float(level) for level in args.levels[0].split(',') if level]
+thresholds = [float(threshold) for threshold in args.exceedance[0].split(',') if threshold]
+evaluate_forecast(outdir, countries, stan_data, days_to_simulate, end_date, levels, thresholds)
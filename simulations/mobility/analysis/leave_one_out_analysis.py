@@ -13,6 +13,10 @@ from scipy.stats import pearsonr
 import numpy as np
 import seaborn as sns
 import pystan
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from epidemic_data import read_epidemic_data, country_data, epidemic_starts
+from stan_data_bundle import has_stan_data, read_stan_data, plot_data
+from run_cube import read_runs, combo_dirs, cube_variables
 
 import pdb
 
@@ -30,10 +34,10 @@ def read_and_format_data(datadir, country, days_to_simulate):
         '''Read in and format all data needed for the model
         '''
 
-        #Get epidemic data
-        epidemic_data = pd.read_csv(datadir+'ecdc_20200419.csv')
-        #Convert to datetime
-        epidemic_data['dateRep'] = pd.to_datetime(epidemic_data['dateRep'], format='%d/%m/%Y')
+        #Get epidemic data, grouped and sorted per country
+        epidemic_data = read_epidemic_data(datadir+'ecdc_20200419.csv')
+        #Get the days with at least 10 deaths and 30 days before
+        death_indices, start_rows = epidemic_starts(epidemic_data, [country])
 
         #Model data - to be used for plotting
         stan_data = {'dates_by_country':np.zeros(days_to_simulate, dtype='datetime64[D]'),
@@ -46,20 +50,11 @@ def read_and_format_data(datadir, country, days_to_simulate):
         #Covariate names
         covariate_names = ['retail','grocery','transit','work','residential']
         #Get data by country
-        #Get country epidemic data
-        country_epidemic_data = epidemic_data[epidemic_data['countriesAndTerritories']==country]
-        #Sort on date
-        country_epidemic_data = country_epidemic_data.sort_values(by='dateRep')
-        #Reset index
-        country_epidemic_data = country_epidemic_data.reset_index()
         #Get all dates with at least 10 deaths
-        cum_deaths = country_epidemic_data['deaths'].cumsum()
-        death_index = cum_deaths[cum_deaths>=10].index[0]
+        death_index = death_indices[0]
         di30 = death_index-30
-        #Get part of country_epidemic_data 30 days before day with at least 10 deaths
-        country_epidemic_data = country_epidemic_data.loc[di30:]
-        #Reset index
-        country_epidemic_data = country_epidemic_data.reset_index()
+        #Get country epidemic data from 30 days before day with at least 10 deaths, sorted on date
+        country_epidemic_data = country_data(epidemic_data, country, None, start_rows[0])
 
         print(country, len(country_epidemic_data))
         #Check that foreacast is really a forecast
@@ -81,101 +76,70 @@ def read_and_format_data(datadir, country, days_to_simulate):
 
         return stan_data
 
-def visualize_results(outdir, country_combos, country_data, all_countries, days_to_simulate):
+def read_fitted_data(outdir, country_combos):
+        '''Get the data per country from the stan_data bundles of the leave one out runs.
+        Returns None if any run lacks a bundle.
+        '''
+        country_data = {}
+        for i in range(len(country_combos)):
+                combo_dir = outdir+'COMBO'+str(i+1)+'/'
+                if not has_stan_data(combo_dir):
+                    return None
+                combo_data, info = read_stan_data(combo_dir)
+                combo_data = plot_data(combo_data, info)
+                for c in range(len(info['countries'])):
+                    country = info['countries'][c]
+                    if country in country_data:
+                        continue
+                    country_data[country] = {'dates_by_country':combo_data['dates_by_country'][:,c],
+                                            'deaths_by_country':combo_data['deaths_by_country'][:,c],
+                                            'cases_by_country':combo_data['cases_by_country'][:,c],
+                                            'days_by_country':int(combo_data['days_by_country'][c])}
+        return country_data
+
+def visualize_results(outdir, country_combos, country_data, days_to_simulate):
     '''Visualize results by reading in all information from all countries in all combinations
-    of the leave one out analysis.
+    of the leave one out analysis. The runs are read into one posterior cube (run_cube.read_runs).
     '''
-    #Get all data from all simulations for each country
-    country_means = {"Austria":np.zeros((3,10,country_data['Austria']['days_by_country'])), #Cases,Deaths,Rt for all combinations and all days  
-                     "Belgium":np.zeros((3,10,country_data['Belgium']['days_by_country'])),
-                     "Denmark":np.zeros((3,10,country_data['Denmark']['days_by_country'])),
-                     "France":np.zeros((3,10,country_data['France']['days_by_country'])),
-                     "Germany":np.zeros((3,10,country_data['Germany']['days_by_country'])),
-                     "Italy":np.zeros((3,10,country_data['Italy']['days_by_country'])),  
-                     "Norway":np.zeros((3,10,country_data['Norway']['days_by_country'])),         
-                     "Spain":np.zeros((3,10,country_data['Spain']['days_by_country'])), 
-                     "Sweden":np.zeros((3,10,country_data['Sweden']['days_by_country'])), 
-                     "Switzerland":np.zeros((3,10,country_data['Switzerland']['days_by_country'])), 
-                     "United_Kingdom":np.zeros((3,10,country_data['United_Kingdom']['days_by_country']))
-                    }
-    
-    alpha_per_combo = np.zeros((3,5,11)) #mean,2.5 and 97.5 values (95 % CI together)
-    #Loop through all country combos
-    fetched_combos = {"Austria":0,"Belgium":0,"Denmark":0,"France":0, #Keep track of index for each country
-                      "Germany":0,"Italy":0,"Norway":0,"Spain":0,
-                      "Sweden":0,"Switzerland":0,"United_Kingdom":0} 
-    missing_country_order =  {"Austria":[],"Belgium":[],"Denmark":[],"France":[], #Keep track of index for each country
-                              "Germany":[],"Italy":[],"Norway":[],"Spain":[],
-                              "Sweden":[],"Switzerland":[],"United_Kingdom":[]}
-    for i in range(len(country_combos)):
-        countries = country_combos.loc[i].values
-        for check in all_countries:
-            if check not in countries:
-                missing_country = check
-        if missing_country == "United_Kingdom":
-            missing_country = "United Kingdom"
-        summary = pd.read_csv(outdir+'COMBO'+str(i+1)+'/summary.csv')
-        #Get alphas
-        for a in range(5):
-            alpha = summary[summary['Unnamed: 0']=='alpha['+str(a+1)+']']
-            alpha_m = 1-np.exp(-alpha['mean'].values[0])
-            alpha_2_5 = 1-np.exp(-alpha['2.5%'].values[0])
-            alpha_97_5 = 1-np.exp(-alpha['97.5%'].values[0]) 
-            alpha_per_combo[0,a,i]=alpha_m #Save mean
-            alpha_per_combo[1,a,i]=alpha_2_5 #Save mean
-            alpha_per_combo[2,a,i]=alpha_97_5 #Save mean
-        #Loop through all countries in combo
-        for j in range(len(countries)):
-            country= countries[j]
-            data = country_data[country]
-            end_iter = data['days_by_country']
-            missing_country_order[country].append(missing_country) #Save missing country to see which was left out in the sim
-                
-            #Extract mean modeling results for country j
-            means = {'prediction':[],'E_deaths':[], 'Rt':[]}
-            for k in range(1,end_iter+1):
-                for var in ['prediction', 'E_deaths', 'Rt']:
-                    var_ij = summary[summary['Unnamed: 0']==var+'['+str(k)+','+str(j+1)+']']
-                    try:
-                        means[var].append(var_ij['mean'].values[0])
-                    except:
-                        pdb.set_trace()
-            #Save data to country means
-            country_means[country][0,fetched_combos[country],:]=means['prediction']
-            country_means[country][1,fetched_combos[country],:]=means['E_deaths']
-            country_means[country][2,fetched_combos[country],:]=means['Rt']
-            fetched_combos[country]+=1 #Increase location index in np array
-
-
+    #Get the means of all simulations: runs x cases,deaths,Rt x countries x days
+    run_countries = [[country for country in combo if isinstance(country, str)] for combo in country_combos.values]
+    cube, countries, runs, parameters = read_runs(combo_dirs(outdir, len(run_countries)), run_countries, cube_variables)
+    left_out = runs['left_out'].str.replace('_',' ').values #Left out country of each run
+    print(runs.to_string(index=False))
+
+    #mean,2.5 and 97.5 values (95 % CI together): stats x runs x alphas
+    alpha_per_combo = np.stack([1-np.exp(-parameters['alpha'][stat]) for stat in ['mean', '2.5%', '97.5%']])
     #Plot alphas - influence of each mobility parameter
     covariate_names = ['retail and recreation','grocery and pharmacy', 'transit stations','workplace','residential']
     alpha_colors =  {0:'tab:red',1:'tab:purple',2:'tab:pink', 3:'tab:olive', 4:'tab:cyan'}
     for i in range(5): #Loop through all mobility params
         fig, ax = plt.subplots(figsize=(4, 4))
-        for j in range(11):
-            lo_country = all_countries[i] #Left out country
-            ax.scatter(j+1,alpha_per_combo[0,i,j], marker="_", color = alpha_colors[i]) #plot mean
-            ax.plot([j+1]*2,alpha_per_combo[1:,i,j], color = alpha_colors[i]) #plot 2.5
-            ax.set_ylim([0,1])
-            ax.set_ylabel('Fractional reduction in R0')
-            ax.set_xticks(np.arange(1,12))
-            ax.set_xticklabels(['Austria','Belgium','Denmark','France','Germany','Italy','Norway','Spain','Sweden','Switzerland','United Kingdom'],rotation='vertical')
-            ax.set_title(covariate_names[i])
-            fig.tight_layout()
-            fig.savefig(outdir+'/plots/'+covariate_names[i]+'.svg', format='svg')
-            plt.close()
+        for j in range(len(runs)):
+            ax.scatter(j+1,alpha_per_combo[0,j,i], marker="_", color = alpha_colors[i]) #plot mean
+            ax.plot([j+1]*2,alpha_per_combo[1:,j,i], color = alpha_colors[i]) #plot 2.5
+        ax.set_ylim([0,1])
+        ax.set_ylabel('Fractional reduction in R0')
+        ax.set_xticks(np.arange(1,len(runs)+1))
+        ax.set_xticklabels(left_out,rotation='vertical')
+        ax.set_title(covariate_names[i])
+        fig.tight_layout()
+        fig.savefig(outdir+'/plots/'+covariate_names[i]+'.svg', format='svg')
+        plt.close()
 
 
     #plot per country
     days = np.arange(0,days_to_simulate) #Days to simulate
-    for country in country_means:
-        means = country_means[country]
+    for c in range(len(countries)):
+        country = countries[c]
         data = country_data[country]
         dates = data['dates_by_country']
         observed_country_deaths = data['deaths_by_country']
         observed_country_cases = data['cases_by_country']
         end = data['days_by_country']#End of data for country i
-        missing_order = missing_country_order[country] #Order of exclusion for LOO
+        #The runs that modeled the country
+        modeled = np.flatnonzero(~np.isnan(cube[:,0,c,0]))
+        means = np.moveaxis(cube[modeled,:,c,:end], 0, 1) #cases,deaths,Rt x runs x days
+        missing_order = left_out[modeled] #Order of exclusion for LOO
         #Plot cases
         #Per day
        
@@ -192,7 +156,7 @@ def visualize_results(outdir, country_combos, country_data, all_countries, days_
         #Correlations
         corr = np.corrcoef(means[2,:,:]) 
         plot_corr(corr, missing_order, outdir+'/plots/'+country+'_Rt_corr.svg', country) 
-        print(country+','+'Rt'+','+str(np.average(np.corrcoef(means[2,:,:]))-(10/100))) #10 of 100 will be self corr.
+        print(country+','+'Rt'+','+str(np.average(corr)-1/len(corr))) #The diagonal is self corr.
 
     return None
 
@@ -204,8 +168,8 @@ def plot_corr(corr, missing_order, outname, country):
 
     fig, ax = plt.subplots(figsize=(6/2.54, 6/2.54))
     im = ax.imshow(corr)
-    ax.set_xticks(np.arange(10))
-    ax.set_yticks(np.arange(10))
+    ax.set_xticks(np.arange(len(corr)))
+    ax.set_yticks(np.arange(len(corr)))
     ax.set_xticklabels(missing_order, rotation = 90)
     ax.set_yticklabels(missing_order)
     ax.set_title(country)
@@ -237,10 +201,10 @@ def plot_shade_ci(x,end,start_date,y, observed_y, ylabel, outname, missing_order
     if len(observed_y)>1:
         ax.bar(x[:end],observed_y[:end], alpha = 0.5)
     #Plot the mean for each LOO combo
-    for i in range(10): 
+    for i in range(len(y)): 
         missing_country = missing_order[i]
         #Plot so far
-        ax.plot(x[:end],y[i,:end], alpha=0.2, color = country_colors[missing_country],linewidth = 2.0, label = missing_country)
+        ax.plot(x[:end],y[i,:end], alpha=0.2, color = country_colors.get(missing_country),linewidth = 2.0, label = missing_country)
         #Plot predicted dates
         ax.plot(x[end-1:forecast],y[i,end-1:forecast], alpha=0.2, color='g', linewidth = 2.0)
    
@@ -265,14 +229,17 @@ days_to_simulate=args.days_to_simulate[0] #Number of days to model. Increase for
 outdir = args.outdir[0]
 #Set font size
 matplotlib.rcParams.update({'font.size': 8})
-#Get data per country
-country_data = {} #Save all data from all extracted country combinations
-all_countries = ["Austria", "Belgium", "Denmark", "France", "Germany", "Italy", "Norway", "Spain", "Sweden", "Switzerland", "United_Kingdom"]
-for country in all_countries:
-    #Read data
-    stan_data = read_and_format_data(datadir, country, days_to_simulate)
-    country_data[country]=stan_data
+#Get data per country - all countries of all combinations
+all_countries = list(dict.fromkeys(country for combo in country_combos.values for country in combo if isinstance(country, str)))
+#The data the models were fit on if saved with the model outputs
+country_data = read_fitted_data(outdir, country_combos)
+if country_data is None:
+    country_data = {} #Save all data from all extracted country combinations
+    for country in all_countries:
+        #Read data
+        stan_data = read_and_format_data(datadir, country, days_to_simulate)
+        country_data[country]=stan_data
 
 #Visualize
-visualize_results(outdir, country_combos, country_data, all_countries, days_to_simulate)
+visualize_results(outdir, country_combos, country_data, days_to_simulate)
 
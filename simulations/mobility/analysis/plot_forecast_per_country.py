@@ -12,6 +12,9 @@ import matplotlib.pyplot as plt
 from scipy.stats import pearsonr
 import numpy as np
 import seaborn as sns
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from figure_render import figure_job, render_figures
+from forecast_metrics import forecast_cube, forecast_skill, summarize_skill
 
 import pdb
 
@@ -24,10 +27,13 @@ parser.add_argument('--forecast_csv', nargs=1, type= str, default=sys.stdin, hel
 parser.add_argument('--countries', nargs=1, type= str, default=sys.stdin, help = 'Countries to model (csv).')
 parser.add_argument('--weeks_to_forecast', nargs=1, type= int, default=sys.stdin, help = 'Number of weeks to forecast (int).')
 parser.add_argument('--outdir', nargs=1, type= str, default=sys.stdin, help = 'Path to outdir.')
+parser.add_argument('--n_jobs', nargs=1, type= int, default=[None], help = 'Number of processes rendering the figures. Default all cores.')
+parser.add_argument('--force', action='store_true', help = 'Redraw all figures, also those with unchanged inputs.')
 
-def evaluate_forecast(forecast_df, countries, weeks_to_forecast, outdir):
+def evaluate_forecast(forecast_df, countries, weeks_to_forecast, outdir, n_jobs=None, force=False):
     '''Evaluate forecast results per country in terms of the icumulative predicted (mean) vs the true number of cumulative deaths.
     ,Country,Date,Predicted mean,Predicted 2.5,Predicted 97.5,Predicted 25,Predicted 75,Observed deaths, End date
+    The skill (forecast_metrics.forecast_skill) is written to outdir/forecast_skill.csv and per week to forecast_skill_per_week.csv
     '''
 
     xlabels = ['30 Mar','2 Apr', '5 Apr', '8 Apr', '11 Apr', '14 Apr', '17 Apr', '19 Apr']
@@ -35,63 +41,55 @@ def evaluate_forecast(forecast_df, countries, weeks_to_forecast, outdir):
              'Germany':[0,200,400,600],'Italy':[0,2500,5000],'Norway':[0,25,50],'Spain':[0,2500,5000],
              'Sweden':[0,250,500,750,1000,1250,1500],'Switzerland':[0,100,200],'United_Kingdom':[0,1000,2000]
              }
+    jobs = [] #Figures to render, only those with changed inputs are redrawn
+    #Forecasts per country x origin (end date) x day
+    cube, cube_countries, origins = forecast_cube(forecast_df, 7*weeks_to_forecast)
     for i in range(len(countries)):
         country = countries[i]
-        country_data = forecast_df[forecast_df['Country'] == country]
-        end_dates = country_data['End date'].unique() #Get unique end dates
-        #Store predictions
-        pred_mean = []
-        pred_2_5 = []
-        pred_97_5 = []
-        pred_25 = []
-        pred_75 = []
-        observed = []
-        for ed in end_dates:
-            country_ed_data = country_data[country_data['End date']==ed]
-            pred_mean.extend([*np.array(country_ed_data['Predicted mean'].values, dtype=float)[-7*weeks_to_forecast:]])
-            pred_2_5.extend([*np.array(country_ed_data['Predicted 2.5'].values, dtype=float)[-7*weeks_to_forecast:]])
-            pred_97_5.extend([*np.array(country_ed_data['Predicted 97.5'].values, dtype=float)[-7*weeks_to_forecast:]])
-            pred_25.extend([*np.array(country_ed_data['Predicted 25'].values, dtype=float)[-7*weeks_to_forecast:]])
-            pred_75.extend([*np.array(country_ed_data['Predicted 75'].values, dtype=float)[-7*weeks_to_forecast:]])
-            observed.extend([*np.array(country_ed_data['Observed deaths'].values, dtype=float)[-7*weeks_to_forecast:]])
-        #Get prediction indices
+        c = cube_countries.index(country)
+        #Store predictions, all end dates after each other
+        pred_mean, pred_2_5, pred_97_5, pred_25, pred_75, observed = [cube[column][c].ravel() for column in
+            ['Predicted mean', 'Predicted 2.5', 'Predicted 97.5', 'Predicted 25', 'Predicted 75', 'Observed deaths']]
         #Plot observed as hist and predicted as line
-        x = np.arange(0,len(pred_mean))
-        fig, ax = plt.subplots(figsize=(6/2.54, 4/2.54))
-        ax.bar(x,observed, alpha = 0.5)
-        ax.plot(x, pred_mean, alpha=1, color='g', label='One week forecast', linewidth = 1.0)
-        ax.fill_between(x, pred_2_5, pred_97_5, color='forestgreen', alpha=0.4)
-        ax.fill_between(x, pred_25, pred_75, color='forestgreen', alpha=0.6)
-        #Plot week separators
-        for w in np.arange(6.5,len(x)-1,7):
-            ax.axvline(w, linestyle='--', linewidth=1, c= 'k')
+        jobs.append(figure_job(outdir+country+'_forecast.svg', plot_country_forecast, observed, pred_mean,
+                    pred_2_5, pred_97_5, pred_25, pred_75, xlabels, country, outdir+country+'_forecast.svg'))
+    render_figures(jobs, n_jobs, force=force)
 
-        #Format
-        xticks=[0,2,5,8,11,14,17,20]
-        ax.set_ylabel('Deaths per day')
-        ax.set_xticks(xticks)
-        ax.set_xticklabels(xlabels,rotation='vertical')
-        ax.set_title(country)
-        #ax.set_yticks(yticks[country])
-        ax.spines['right'].set_visible(False)
-        ax.spines['top'].set_visible(False)
-        fig.tight_layout()
-        fig.savefig(outdir+country+'_forecast.svg', format = 'svg', dpi=300)
-        plt.close()
-
-        #Analysis of correspondence
-        av_er = [] #Average  error per week
-        av_abser = [] #Average absolute error per week
-        perc_er = [] #Average absolute percent error per week
-        for c in range(0,len(pred_mean), 7):
-            abs_er = np.absolute(np.array(pred_mean[c:c+7])-np.array(observed[c:c+7]))
-            er = np.array(pred_mean[c:c+7])-np.array(observed[c:c+7])
-            av_er.append(np.average(er))
-            av_abser.append(np.average(abs_er))
-            perc_er.append(np.sum(av_er[-1])/np.sum(observed[c:c+7]))
-        print(country, av_er[0], av_er[1], av_er[2], perc_er[0], perc_er[1], perc_er[2])
+    #Analysis of correspondence - per country, end date and day, and averaged per country and week
+    skill = forecast_skill(forecast_df[forecast_df['Country'].isin(countries)], 7*weeks_to_forecast)
+    skill.to_csv(outdir+'forecast_skill.csv', index=False)
+    weekly_skill = summarize_skill(skill)
+    weekly_skill.to_csv(outdir+'forecast_skill_per_week.csv')
+    print(weekly_skill.to_string())
     return None
 
+def plot_country_forecast(observed, pred_mean, pred_2_5, pred_97_5, pred_25, pred_75, xlabels, country, outname):
+    '''Plot the observed deaths per day as bars and the forecast mean with the 95 % and 50 % intervals
+    '''
+    #Get prediction indices
+    x = np.arange(0,len(pred_mean))
+    fig, ax = plt.subplots(figsize=(6/2.54, 4/2.54))
+    ax.bar(x,observed, alpha = 0.5)
+    ax.plot(x, pred_mean, alpha=1, color='g', label='One week forecast', linewidth = 1.0)
+    ax.fill_between(x, pred_2_5, pred_97_5, color='forestgreen', alpha=0.4)
+    ax.fill_between(x, pred_25, pred_75, color='forestgreen', alpha=0.6)
+    #Plot week separators
+    for w in np.arange(6.5,len(x)-1,7):
+        ax.axvline(w, linestyle='--', linewidth=1, c= 'k')
+
+    #Format
+    xticks=[0,2,5,8,11,14,17,20]
+    ax.set_ylabel('Deaths per day')
+    ax.set_xticks(xticks)
+    ax.set_xticklabels(xlabels,rotation='vertical')
+    ax.set_title(country)
+    #ax.set_yticks(yticks[country])
+    ax.spines['right'].set_visible(False)
+    ax.spines['top'].set_visible(False)
+    fig.tight_layout()
+    fig.savefig(outname, format = 'svg', dpi=300)
+    plt.close()
+
 
 #####MAIN#####
 args = parser.parse_args()
@@ -102,4 +100,4 @@ outdir = args.outdir[0]
 #Visualize
 #Set font size
 matplotlib.rcParams.update({'font.size': 8})
-evaluate_forecast(forecast_df, countries, weeks_to_forecast, outdir)
+evaluate_forecast(forecast_df, countries, weeks_to_forecast, outdir, args.n_jobs[0], args.force)
@@ -13,6 +13,13 @@ from matplotlib.patches import Rectangle
 from scipy.stats import gamma
 import numpy as np
 import seaborn as sns
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from epidemic_data import read_epidemic_data, country_data, epidemic_starts
+from mobility_data import model_columns, read_mobility_data, mobility_region_name, align_covariates
+from stan_data_bundle import has_stan_data, read_stan_data, plot_data
+from draw_store import read_draws
+from summary_table import read_summary, summary_column
+from figure_render import figure_job, render_figures
 
 
 import pdb
@@ -28,19 +35,19 @@ parser.add_argument('--days_to_simulate', nargs=1, type= int, default=sys.stdin,
 parser.add_argument('--end_date', nargs=1, type= str, default=sys.stdin, help = 'Up to which date to include data.')
 parser.add_argument('--short_dates', nargs=1, type= str, default=sys.stdin, help = 'Short date format for plotting (csv).')
 parser.add_argument('--outdir', nargs=1, type= str, default=sys.stdin, help = 'Path to outdir.')
+parser.add_argument('--n_jobs', nargs=1, type= int, default=[None], help = 'Number of processes rendering the figures. Default all cores.')
+parser.add_argument('--force', action='store_true', help = 'Redraw all figures, also those with unchanged inputs.')
 
 def read_and_format_data(datadir, countries, days_to_simulate, covariate_names):
         '''Read in and format all data needed for the model
         '''
 
-        #Get epidemic data
-        epidemic_data = pd.read_csv(datadir+'ecdc_20200429.csv')
-        #Convert to datetime
-        epidemic_data['dateRep'] = pd.to_datetime(epidemic_data['dateRep'], format='%d/%m/%Y')
+        #Get epidemic data, grouped and sorted per country
+        epidemic_data = read_epidemic_data(datadir+'ecdc_20200429.csv')
+        #Get the days with at least 10 deaths and 30 days before
+        death_indices, start_rows = epidemic_starts(epidemic_data, countries)
         #Mobility data
-        mobility_data = pd.read_csv(datadir+'Global_Mobility_Report.csv')
-        #Convert to datetime
-        mobility_data['date']=pd.to_datetime(mobility_data['date'], format='%Y/%m/%d')
+        mobility_data = read_mobility_data(datadir+'Global_Mobility_Report.csv', columns=model_columns)
         #Model data - to be used for plotting
         stan_data = {'dates_by_country':np.zeros((days_to_simulate,len(countries)), dtype='datetime64[D]'),
                     'deaths_by_country':np.zeros((days_to_simulate,len(countries))),
@@ -58,21 +65,11 @@ def read_and_format_data(datadir, countries, days_to_simulate, covariate_names):
         for c in range(len(countries)):
                 country = countries[c]
 
-                #Get country epidemic data
-                country_epidemic_data = epidemic_data[epidemic_data['countriesAndTerritories']==country]
-                #Sort on date
-                country_epidemic_data = country_epidemic_data.sort_values(by='dateRep')
-                #Reset index
-                country_epidemic_data = country_epidemic_data.reset_index()
-
                 #Get all dates with at least 10 deaths
-                cum_deaths = country_epidemic_data['deaths'].cumsum()
-                death_index = cum_deaths[cum_deaths>=10].index[0]
+                death_index = death_indices[c]
                 di30 = death_index-30
-                #Get part of country_epidemic_data 30 days before day with at least 10 deaths
-                country_epidemic_data = country_epidemic_data.loc[di30:]
-                #Reset index
-                country_epidemic_data = country_epidemic_data.reset_index()
+                #Get country epidemic data from 30 days before day with at least 10 deaths, sorted on date
+                country_epidemic_data = country_data(epidemic_data, country, None, start_rows[c])
 
                 print(country, len(country_epidemic_data))
                 #Check that foreacast is really a forecast
@@ -92,41 +89,21 @@ def read_and_format_data(datadir, countries, days_to_simulate, covariate_names):
                 #Save cases
                 stan_data['cases_by_country'][:N,c] = country_epidemic_data['cases']
 
-                #Covariates - assign the same shape as others (days_to_simulate)
-                #Mobility data from Google
-                country_cov_data = mobility_data[mobility_data['country_region']==country]
-                if country == 'United_Kingdom': #Different assignments for UK
-                    country_cov_data = mobility_data[mobility_data['country_region']=='United Kingdom']
-                #Get whole country - no subregion
-                country_cov_data =  country_cov_data[country_cov_data['sub_region_1'].isna()]
-                #Get matching dates
-                country_cov_data = country_cov_data[country_cov_data['date'].isin(country_epidemic_data['dateRep'])]
-                end_date = max(country_cov_data['date']) #Last date for mobility data
-                for name in covariate_names:
-                    country_epidemic_data.loc[country_epidemic_data.index,name] = 0 #Set all to 0
-                    for d in range(len(country_epidemic_data)): #loop through all country data
-                        row_d = country_epidemic_data.loc[d]
-                        date_d = row_d['dateRep'] #Extract date
-                        try:
-                            change_d = np.round(float(country_cov_data[country_cov_data['date']==date_d][name].values[0])/100, 2) #Match mobility change on date
-                            if not np.isnan(change_d):
-                                country_epidemic_data.loc[d,name] = change_d #Add to right date in country data
-                        except:
-                            continue #Date too far ahead
-
-
-                    #Add the latest available mobility data to all remaining days (including the forecast days)
-                    country_epidemic_data.loc[country_epidemic_data['dateRep']>=end_date, name]=change_d
-                    cov_i = np.zeros(days_to_simulate)
-                    cov_i[:N] = np.array(country_epidemic_data[name])
-                    #Add covariate info to forecast
-                    cov_i[N:days_to_simulate]=cov_i[N-1]
-                    stan_data[name][:,c] = cov_i
+        #Covariates - assign the same shape as others (days_to_simulate)
+        #Mobility data from Google, whole country - no subregion
+        country_mobility_data = mobility_data[mobility_data['sub_region_1'].isna()]
+        covariates = align_covariates(country_mobility_data, [mobility_region_name(country) for country in countries],
+                                    [stan_data['dates_by_country'][:int(stan_data['days_by_country'][c]),c] for c in range(len(countries))],
+                                    days_to_simulate, covariate_names)
+        for name in covariate_names:
+            stan_data[name] = covariates[name]
 
         return stan_data
 
-def visualize_results(outdir, countries, stan_data, days_to_simulate, short_dates):
+def visualize_results(outdir, countries, stan_data, days_to_simulate, short_dates, n_jobs=None, force=False):
     '''Visualize results
+    The figures are collected as jobs with the arrays they need (the country figures with those of that country)
+    and rendered in parallel (n_jobs processes), only those with changed inputs unless force
     '''
     #params = ['mu', 'alpha', 'kappa', 'y', 'phi', 'tau', 'convolution', 'prediction',
     #'E_deaths', 'Rt', 'lp0', 'lp1', 'convolution0', 'prediction0', 'E_deaths0', 'lp__']
@@ -138,48 +115,28 @@ def visualize_results(outdir, countries, stan_data, days_to_simulate, short_date
     #For models fit using MCMC, also included in the summary are the
     #Monte Carlo standard error (se_mean), the effective sample size (n_eff),
     #and the R-hat statistic (Rhat).
-    summary = pd.read_csv(outdir+'summary.csv')
+    summary = read_summary(outdir)
     #cases = np.load(outdir+'prediction.npy', allow_pickle=True)
     #deaths = np.load(outdir+'E_deaths.npy', allow_pickle=True)
     #Rt =  np.load(outdir+'Rt.npy', allow_pickle=True)
-    alphas = np.load(outdir+'alpha.npy', allow_pickle=True)
-    phi = np.load(outdir+'phi.npy', allow_pickle=True)
+    alphas = read_draws(outdir, 'alpha')
+    phi = read_draws(outdir, 'phi')
     days = np.arange(0,days_to_simulate) #Days to simulate
+    jobs = [] #Figures to render
     #Plot rhat
-    fig, ax = plt.subplots(figsize=(6, 4))
-    ax.hist(summary['Rhat'])
-    ax.set_ylabel('Count')
-    ax.set_xlabel("Rhat")
-    fig.savefig(outdir+'plots/rhat.png', format='png', dpi=300)
-    plt.close()
+    jobs.append(figure_job(outdir+'plots/rhat.png', plot_rhat, summary_column(summary, 'Rhat'), outdir+'plots/rhat.png'))
 
     #Plot values from each iteration as r function mcmc_parcoord
-    mcmc_parcoord(np.concatenate([alphas,np.expand_dims(phi,axis=1)], axis=1), covariate_names+['phi'], outdir)
+    jobs.append(figure_job(outdir+'plots/mcmc_parcoord.png', mcmc_parcoord, np.concatenate([alphas,np.expand_dims(phi,axis=1)], axis=1),
+                covariate_names+['phi'], outdir+'plots/mcmc_parcoord.png'))
 
     #Plot alpha (Rt = R0*-exp(sum{mob_change*alpha1-6}))
-    fig, ax = plt.subplots(figsize=(9/2.54, 9/2.54))
-    alpha_colors = {0:'tab:red',1:'tab:purple',2:'tab:pink', 3:'tab:olive', 4:'tab:cyan'}
-    for i in range(1,6):
-        alpha = summary[summary['Unnamed: 0']=='alpha['+str(i)+']']
-        alpha_m = 1-np.exp(-alpha['mean'].values[0])
-        alpha_2_5 = 1-np.exp(-alpha['2.5%'].values[0])
-        alpha_25 = 1-np.exp(-alpha['25%'].values[0])
-        alpha_75 = 1-np.exp(-alpha['75%'].values[0])
-        alpha_97_5 = 1-np.exp(-alpha['97.5%'].values[0])
-        ax.plot([i-0.25,i+0.25],[alpha_m,alpha_m],color = alpha_colors[i-1])
-        ax.plot([i]*2,[alpha_2_5,alpha_97_5],  marker = '_',color = alpha_colors[i-1])
-        rect = Rectangle((i-0.25,alpha_25),0.5,alpha_75-alpha_25,linewidth=1, color = alpha_colors[i-1], alpha = 0.3)
-        ax.add_patch(rect)
-    ax.set_ylim([0,1])
-    ax.set_ylabel('Fractional reduction in R0')
-    ax.set_xticks([1,2,3,4,5])
-    ax.set_xticklabels(['retail and recreation', 'grocery and pharmacy', 'transit stations','workplace', 'residential'],rotation='vertical')
-    plt.tight_layout()
-    fig.savefig(outdir+'plots/alphas.png', format='png', dpi=300)
-    plt.close()
-
-
+    jobs.append(figure_job(outdir+'plots/alphas.png', plot_alphas, summary['alpha'], outdir+'plots/alphas.png'))
 
+    #Plot marker explanation
+    jobs.append(figure_job(outdir+'plots/NPI_markers.png', plot_npi_markers, outdir+'plots/NPI_markers.png'))
+    jobs.append(figure_job(outdir+'plots/mobility_markers.png', plot_mobility_markers, outdir+'plots/mobility_markers.png'))
+    jobs.append(figure_job(outdir+'plots/foreacast_markers.png', plot_forecast_markers, outdir+'plots/foreacast_markers.png'))
 
     #plot per country
     #Read in intervention dates
@@ -203,43 +160,41 @@ def visualize_results(outdir, countries, stan_data, days_to_simulate, short_date
         print(country,country_grocery[end-1])
 
         #Extract modeling results
-        means = {'prediction':[],'E_deaths':[], 'Rt':[]}
-        lower_bound = {'prediction':[],'E_deaths':[], 'Rt':[]} #Estimated 2.5 %
-        higher_bound = {'prediction':[],'E_deaths':[], 'Rt':[]} #Estimated 97.5 % - together 95 % CI
-        lower_bound25 = {'prediction':[],'E_deaths':[], 'Rt':[]} #Estimated 25%
-        higher_bound75 = {'prediction':[],'E_deaths':[], 'Rt':[]} #Estimated 55 % - together 75 % CI
+        means = {} #Estimated mean
+        lower_bound = {} #Estimated 2.5 %
+        higher_bound = {} #Estimated 97.5 % - together 95 % CI
+        lower_bound25 = {} #Estimated 25%
+        higher_bound75 = {} #Estimated 55 % - together 75 % CI
         #Get means and 95 % CI for cases (prediction), deaths and Rt for all time steps
-        for j in range(1,days_to_simulate+1):
-            for var in ['prediction', 'E_deaths', 'Rt']:
-                var_ij = summary[summary['Unnamed: 0']==var+'['+str(j)+','+str(i)+']']
-                means[var].append(var_ij['mean'].values[0])
-                lower_bound[var].append(var_ij['2.5%'].values[0])
-                higher_bound[var].append(var_ij['97.5%'].values[0])
-                lower_bound25[var].append(var_ij['25%'].values[0])
-                higher_bound75[var].append(var_ij['75%'].values[0])
+        for var in ['prediction', 'E_deaths', 'Rt']:
+            means[var] = summary[var]['mean'][:days_to_simulate,i-1]
+            lower_bound[var] = summary[var]['2.5%'][:days_to_simulate,i-1]
+            higher_bound[var] = summary[var]['97.5%'][:days_to_simulate,i-1]
+            lower_bound25[var] = summary[var]['25%'][:days_to_simulate,i-1]
+            higher_bound75[var] = summary[var]['75%'][:days_to_simulate,i-1]
 
         #Plot cases
         #Per day
-        plot_shade_ci(days, end, dates[0], means['prediction'], observed_country_cases,lower_bound['prediction'],
+        jobs.append(figure_job(outdir+'plots/'+country+'_cases.png', plot_shade_ci, days, end, dates[0], means['prediction'], observed_country_cases,lower_bound['prediction'],
         higher_bound['prediction'], lower_bound25['prediction'], higher_bound75['prediction'], 'Cases per day',
-        outdir+'plots/'+country+'_cases.png',country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates)
+        outdir+'plots/'+country+'_cases.png',country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates))
         #Cumulative
-        plot_shade_ci(days, end, dates[0], np.cumsum(means['prediction']), np.cumsum(observed_country_cases),np.cumsum(lower_bound['prediction']),
+        jobs.append(figure_job(outdir+'plots/'+country+'_cumulative_cases.png', plot_shade_ci, days, end, dates[0], np.cumsum(means['prediction']), np.cumsum(observed_country_cases),np.cumsum(lower_bound['prediction']),
         np.cumsum(higher_bound['prediction']), np.cumsum(lower_bound25['prediction']), np.cumsum(higher_bound75['prediction']),
-        'Cumulative cases',outdir+'plots/'+country+'_cumulative_cases.png',country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates)
+        'Cumulative cases',outdir+'plots/'+country+'_cumulative_cases.png',country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates))
         #Plot Deaths
         #Per day
-        plot_shade_ci(days, end,dates[0],means['E_deaths'],observed_country_deaths, lower_bound['E_deaths'], higher_bound['E_deaths'],
+        jobs.append(figure_job(outdir+'plots/'+country+'_deaths.png', plot_shade_ci, days, end,dates[0],means['E_deaths'],observed_country_deaths, lower_bound['E_deaths'], higher_bound['E_deaths'],
         lower_bound25['E_deaths'], higher_bound75['E_deaths'], 'Deaths per day',
-        outdir+'plots/'+country+'_deaths.png',country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates)
+        outdir+'plots/'+country+'_deaths.png',country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates))
         #Cumulative
-        plot_shade_ci(days, end,dates[0],np.cumsum(means['E_deaths']),np.cumsum(observed_country_deaths), np.cumsum(lower_bound['E_deaths']), np.cumsum(higher_bound['E_deaths']),
+        jobs.append(figure_job(outdir+'plots/'+country+'_cumulative_deaths.png', plot_shade_ci, days, end,dates[0],np.cumsum(means['E_deaths']),np.cumsum(observed_country_deaths), np.cumsum(lower_bound['E_deaths']), np.cumsum(higher_bound['E_deaths']),
         np.cumsum(lower_bound25['E_deaths']), np.cumsum(higher_bound75['E_deaths']), 'Cumulative deaths',
-        outdir+'plots/'+country+'_cumulative_deaths.png',country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates)
+        outdir+'plots/'+country+'_cumulative_deaths.png',country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates))
         #Plot R
-        plot_shade_ci(days,end,dates[0],means['Rt'],'', lower_bound['Rt'], higher_bound['Rt'], lower_bound25['Rt'],
+        jobs.append(figure_job(outdir+'plots/'+country+'_Rt.png', plot_shade_ci, days,end,dates[0],means['Rt'],'', lower_bound['Rt'], higher_bound['Rt'], lower_bound25['Rt'],
         higher_bound75['Rt'],'Rt',outdir+'plots/'+country+'_Rt.png',country_npi,
-        country_retail, country_grocery, country_transit, country_work, country_residential, short_dates)
+        country_retail, country_grocery, country_transit, country_work, country_residential, short_dates))
 
         #Print R mean at beginning and end of model
         try:
@@ -248,21 +203,57 @@ def visualize_results(outdir, countries, stan_data, days_to_simulate, short_date
             pdb.set_trace()
     #Close outfile
     result_file.close()
+    #Render the figures that changed, with the time per figure
+    render_figures(jobs, n_jobs, outdir+'plots/render_timings.csv', force)
 
     return None
 
-def mcmc_parcoord(cat_array, xtick_labels, outdir):
+def plot_rhat(rhat, outname):
+    '''Plot a histogram of the Rhat of all variables
+    '''
+    fig, ax = plt.subplots(figsize=(6, 4))
+    ax.hist(rhat)
+    ax.set_ylabel('Count')
+    ax.set_xlabel("Rhat")
+    fig.savefig(outname, format='png', dpi=300)
+    plt.close()
+
+def plot_alphas(alpha, outname):
+    '''Plot the fractional reduction in R0 per mobility covariate (mean, 50 % and 95 % CI)
+    alpha = the summary statistics of alpha
+    '''
+    fig, ax = plt.subplots(figsize=(9/2.54, 9/2.54))
+    alpha_colors = {0:'tab:red',1:'tab:purple',2:'tab:pink', 3:'tab:olive', 4:'tab:cyan'}
+    for i in range(1,6):
+        alpha_m = 1-np.exp(-alpha['mean'][i-1])
+        alpha_2_5 = 1-np.exp(-alpha['2.5%'][i-1])
+        alpha_25 = 1-np.exp(-alpha['25%'][i-1])
+        alpha_75 = 1-np.exp(-alpha['75%'][i-1])
+        alpha_97_5 = 1-np.exp(-alpha['97.5%'][i-1])
+        ax.plot([i-0.25,i+0.25],[alpha_m,alpha_m],color = alpha_colors[i-1])
+        ax.plot([i]*2,[alpha_2_5,alpha_97_5],  marker = '_',color = alpha_colors[i-1])
+        rect = Rectangle((i-0.25,alpha_25),0.5,alpha_75-alpha_25,linewidth=1, color = alpha_colors[i-1], alpha = 0.3)
+        ax.add_patch(rect)
+    ax.set_ylim([0,1])
+    ax.set_ylabel('Fractional reduction in R0')
+    ax.set_xticks([1,2,3,4,5])
+    ax.set_xticklabels(['retail and recreation', 'grocery and pharmacy', 'transit stations','workplace', 'residential'],rotation='vertical')
+    plt.tight_layout()
+    fig.savefig(outname, format='png', dpi=300)
+    plt.close()
+
+def mcmc_parcoord(cat_array, xtick_labels, outname):
     '''Plot parameters for each iteration next to each other as in the R fucntion mcmc_parcoord
     '''
-    xtick_labels.insert(0,'')
+    xtick_labels = ['']+list(xtick_labels)
     fig, ax = plt.subplots(figsize=(8, 8))
-    for i in range(2000,cat_array.shape[0]): #loop through all iterations
+    for i in range(cat_array.shape[0]): #loop through all post-warmup draws of all chains
             ax.plot(np.arange(cat_array.shape[1]), cat_array[i,:], color = 'k', alpha = 0.1)
     ax.plot(np.arange(cat_array.shape[1]), np.median(cat_array, axis = 0), color = 'r', alpha = 1)
     ax.set_xticklabels(xtick_labels,rotation='vertical')
     ax.set_ylim([-5,20])
     plt.tight_layout()
-    fig.savefig(outdir+'plots/mcmc_parcoord.png', format = 'png')
+    fig.savefig(outname, format = 'png')
     plt.close()
 
 def plot_shade_ci(x,end,start_date,y, observed_y, lower_bound, higher_bound,lower_bound25, higher_bound75,ylabel,outname,country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates):
@@ -339,6 +330,58 @@ def plot_shade_ci(x,end,start_date,y, observed_y, lower_bound, higher_bound,lowe
     fig.savefig(outname.split('.png')[0]+'.png', format = 'png')
     plt.close()
 
+def plot_npi_markers(outname):
+    '''Plot the explanation of the NPI markers
+    '''
+    NPI = ['public_events', 'schools_universities',  'lockdown',
+        'social_distancing_encouraged', 'self_isolating_if_ill']
+    NPI_labels = {'schools_universities':'schools and universities',  'public_events': 'public events', 'lockdown': 'lockdown',
+        'social_distancing_encouraged':'social distancing encouraged', 'self_isolating_if_ill':'self isolating if ill'}
+    NPI_markers = {'schools_universities':'*',  'public_events': 'X', 'lockdown': 's',
+        'social_distancing_encouraged':'p', 'self_isolating_if_ill':'d'}
+    NPI_colors = {'schools_universities':'k',  'public_events': 'blueviolet', 'lockdown': 'mediumvioletred',
+        'social_distancing_encouraged':'maroon', 'self_isolating_if_ill':'darkolivegreen'}
+
+    fig, ax = plt.subplots(figsize=(6/2.54,2.25/2.54))
+    i=1
+    for npi in NPI:
+        ax.scatter(1,i,marker=NPI_markers[npi], color = NPI_colors[npi])
+        ax.text(1.001,i,NPI_labels[npi])
+        i+=1
+    ax.set_ylim([0,6])
+    ax.set_xlim([0.999,1.02])
+    ax.axis('off')
+    fig.savefig(outname, format = 'png')
+    plt.close()
+
+def plot_mobility_markers(outname):
+    '''Plot the explanation of the mobility line colors
+    '''
+    covariate_colors = {'retail and recreation':'tab:red','grocery and pharmacy':'tab:purple', 'transit stations':'tab:pink','workplace':'tab:olive','residential':'tab:cyan'}
+    fig, ax = plt.subplots(figsize=(6/2.54,2.25/2.54))
+    i=5
+    for cov in covariate_colors:
+        ax.plot([1,1.8],[i]*2, color = covariate_colors[cov], linewidth=4)
+        ax.text(2.001,i,cov)
+        i-=1
+    ax.set_xlim([0.999,3.5])
+    ax.axis('off')
+    fig.savefig(outname, format = 'png')
+    plt.close()
+
+def plot_forecast_markers(outname):
+    '''Plot the explanation of the simulation and forecast colors
+    '''
+    fig, ax = plt.subplots(figsize=(6/2.54,2.25/2.54))
+    ax.plot([1,1.8],[1.5]*2, color = 'b', linewidth=8)
+    ax.text(2.001,1.5,'Simulation')
+    ax.plot([1,1.8],[1.45]*2, color ='g', linewidth=8)
+    ax.text(2.001,1.45,'Forecast')
+    ax.set_xlim([0.999,3.02])
+    ax.set_ylim([1.42,1.52])
+    ax.axis('off')
+    fig.savefig(outname, format = 'png')
+    plt.close()
 
 
 #####MAIN#####
@@ -359,53 +402,11 @@ covariate_names = ['retail_and_recreation_percent_change_from_baseline',
 'workplaces_percent_change_from_baseline',
 'residential_percent_change_from_baseline']
 
-#Read data
-stan_data = read_and_format_data(datadir, countries, days_to_simulate, covariate_names)
+#Read data - the data the model was fit on if saved with the model output
+if has_stan_data(outdir):
+    stan_data = plot_data(*read_stan_data(outdir))
+else:
+    stan_data = read_and_format_data(datadir, countries, days_to_simulate, covariate_names)
 
 #Visualize
-visualize_results(outdir, countries, stan_data, days_to_simulate, short_dates)
-
-#Plot marker explanation
-#NPIs
-NPI = ['public_events', 'schools_universities',  'lockdown',
-    'social_distancing_encouraged', 'self_isolating_if_ill']
-NPI_labels = {'schools_universities':'schools and universities',  'public_events': 'public events', 'lockdown': 'lockdown',
-    'social_distancing_encouraged':'social distancing encouraged', 'self_isolating_if_ill':'self isolating if ill'}
-NPI_markers = {'schools_universities':'*',  'public_events': 'X', 'lockdown': 's',
-    'social_distancing_encouraged':'p', 'self_isolating_if_ill':'d'}
-NPI_colors = {'schools_universities':'k',  'public_events': 'blueviolet', 'lockdown': 'mediumvioletred',
-    'social_distancing_encouraged':'maroon', 'self_isolating_if_ill':'darkolivegreen'}
-
-fig, ax = plt.subplots(figsize=(6/2.54,2.25/2.54))
-i=1
-for npi in NPI:
-    ax.scatter(1,i,marker=NPI_markers[npi], color = NPI_colors[npi])
-    ax.text(1.001,i,NPI_labels[npi])
-    i+=1
-ax.set_ylim([0,6])
-ax.set_xlim([0.999,1.02])
-ax.axis('off')
-fig.savefig(outdir+'plots/NPI_markers.png', format = 'png')
-
-#Mobility
-covariate_colors = {'retail and recreation':'tab:red','grocery and pharmacy':'tab:purple', 'transit stations':'tab:pink','workplace':'tab:olive','residential':'tab:cyan'}
-fig, ax = plt.subplots(figsize=(6/2.54,2.25/2.54))
-i=5
-for cov in covariate_colors:
-    ax.plot([1,1.8],[i]*2, color = covariate_colors[cov], linewidth=4)
-    ax.text(2.001,i,cov)
-    i-=1
-ax.set_xlim([0.999,3.5])
-ax.axis('off')
-fig.savefig(outdir+'plots/mobility_markers.png', format = 'png')
-
-#Simulation and forecast
-fig, ax = plt.subplots(figsize=(6/2.54,2.25/2.54))
-ax.plot([1,1.8],[1.5]*2, color = 'b', linewidth=8)
-ax.text(2.001,1.5,'Simulation')
-ax.plot([1,1.8],[1.45]*2, color ='g', linewidth=8)
-ax.text(2.001,1.45,'Forecast')
-ax.set_xlim([0.999,3.02])
-ax.set_ylim([1.42,1.52])
-ax.axis('off')
-fig.savefig(outdir+'plots/foreacast_markers.png', format = 'png')
+visualize_results(outdir, countries, stan_data, days_to_simulate, short_dates, args.n_jobs[0], args.force)
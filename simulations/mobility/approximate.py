@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+'''Approximate inference (ADVI) written in the same layout as the NUTS fits:
+summary.csv and one .npy of draws per variable
+'''
+
+import re
+import numpy as np
+import pandas as pd
+from draw_store import write_draw_arrays
+
+#Variational families of pystan's StanModel.vb
+vb_algorithms = ['meanfield', 'fullrank']
+#Columns of summary.csv
+summary_columns = ['mean', 'se_mean', 'sd', '2.5%', '25%', '50%', '75%', '97.5%', 'n_eff', 'Rhat']
+
+def flat_name_index(flat_name):
+    '''Split e.g. E_deaths[3,2] into (E_deaths, (2,1)), indices from 0
+    '''
+    match = re.match(r'^([^\[]+)(?:\[([\d,]+)\])?$', flat_name)
+    if match.group(2) is None:
+        return match.group(1), ()
+    return match.group(1), tuple(int(i)-1 for i in match.group(2).split(','))
+
+def vb_draws(vb_result):
+    '''Get the draws of each variable (draws x dims) from the result of StanModel.vb
+    '''
+    columns = {}
+    for flat_name, values in zip(vb_result['sampler_param_names'], vb_result['sampler_params']):
+        name, index = flat_name_index(flat_name)
+        columns.setdefault(name, []).append((index, np.asarray(values)))
+    draws = {}
+    for name in columns:
+        shape = tuple(np.max([index for index, values in columns[name]], axis=0)+1) if columns[name][0][0] else ()
+        n_draws = len(columns[name][0][1])
+        draws[name] = np.zeros((n_draws,)+shape)
+        for index, values in columns[name]:
+            draws[name][(slice(None),)+index] = values
+    return draws
+
+def draws_summary(draws):
+    '''Summarize draws as in summary.csv (rows in stan order, e.g. Rt[1,1], Rt[2,1], ...).
+    se_mean, n_eff and Rhat are MCMC diagnostics and left empty.
+    '''
+    rows = []
+    names = []
+    for name in draws:
+        values = draws[name].reshape(len(draws[name]), -1, order='F')
+        stats = np.vstack([values.mean(axis=0), np.full(values.shape[1], np.nan), values.std(axis=0, ddof=1),
+                          np.percentile(values, [2.5, 25, 50, 75, 97.5], axis=0),
+                          np.full((2, values.shape[1]), np.nan)]).T
+        rows.append(stats)
+        if draws[name].ndim == 1:
+            names.append(name)
+        else:
+            indices = np.array(np.unravel_index(np.arange(values.shape[1]), draws[name].shape[1:], order='F')).T+1
+            names.extend([name+'['+','.join(map(str, index))+']' for index in indices])
+    return pd.DataFrame(np.vstack(rows), columns=summary_columns, index=names)
+
+def fit_vb(sm, stan_data, outdir, algorithm, draws, pars=None, iterations=10000):
+    '''Fit with ADVI (meanfield or fullrank) and write summary.csv and the draws as for a NUTS fit
+    draws = number of approximate posterior draws to write
+    pars = the variables to keep, all if None
+    '''
+    if algorithm not in vb_algorithms:
+        raise ValueError('Unknown vb algorithm '+str(algorithm)+', use one of '+', '.join(vb_algorithms))
+    vb_result = sm.vb(data=stan_data, algorithm=algorithm, output_samples=draws, iter=iterations, pars=pars)
+    approximate_draws = vb_draws(vb_result)
+    draws_summary(approximate_draws).to_csv(outdir+'summary.csv')
+    write_draw_arrays(approximate_draws, outdir)
+    return approximate_draws
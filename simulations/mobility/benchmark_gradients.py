@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import sys
+import os
+import time
+import numpy as np
+import pandas as pd
+from stan_models import compiled_model
+from stan_data_bundle import read_stan_data
+
+import pdb
+
+
+
+#Arguments for argparse module:
+parser = argparse.ArgumentParser(description = '''Benchmark the gradient evaluations per second of stan models
+on the same stan_data, e.g. mobility.stan before and after a change
+(git show <commit>:simulations/mobility/mobility.stan > mobility_before.stan).
+The log density and gradient of each model are compared to the first model at the same points.''')
+
+parser.add_argument('--stan_models', nargs=1, type= str, default=sys.stdin, help = 'Stan models to benchmark (csv), the first is the reference.')
+parser.add_argument('--stan_data', nargs=1, type= str, default=sys.stdin, help = 'Outdir with a stan_data bundle (mobility_model.py --prepare_only).')
+parser.add_argument('--evaluations', nargs=1, type= int, default=[1000], help = 'Number of gradient evaluations per model.')
+parser.add_argument('--points', nargs=1, type= int, default=[20], help = 'Number of points (unconstrained parameters) to evaluate at.')
+parser.add_argument('--outdir', nargs=1, type= str, default=sys.stdin, help = 'Path to outdir.')
+
+def benchmark_points(fit, n_points, seed=0):
+        '''Get n_points unconstrained parameter vectors around the initial values of a fit
+        '''
+        upars = np.asarray(fit.unconstrain_pars(fit.get_inits()[0]))
+        rng = np.random.RandomState(seed)
+        return upars[np.newaxis,:]+rng.normal(0, 0.1, size=(n_points, len(upars)))
+
+def gradient_rate(fit, points, evaluations):
+        '''Time evaluations of the gradient of the log density, cycling through the points
+        Returns the gradient evaluations per second, the log densities and gradients at the points
+        '''
+        log_prob = np.array([fit.log_prob(upars) for upars in points])
+        gradients = np.array([fit.grad_log_prob(upars) for upars in points])
+        start = time.perf_counter()
+        for e in range(evaluations):
+            fit.grad_log_prob(points[e%len(points)])
+        seconds = time.perf_counter()-start
+        return evaluations/seconds, log_prob, gradients
+
+def benchmark(stan_models, stan_data, evaluations, n_points):
+        '''Benchmark the gradient evaluations per second of each model
+        '''
+        results = []
+        for stan_model in stan_models:
+            sm = compiled_model(stan_model)
+            #A fit without sampling, only to evaluate the log density
+            fit = sm.sampling(data=stan_data, iter=1, warmup=0, chains=1, algorithm='Fixed_param', seed=42)
+            if not results:
+                points = benchmark_points(fit, n_points)
+                reference = None
+            rate, log_prob, gradients = gradient_rate(fit, points, evaluations)
+            if reference is None:
+                reference = (rate, log_prob, gradients)
+            results.append({'stan_model':stan_model, 'evaluations':evaluations, 'gradients_per_second':rate,
+                            'speedup':rate/reference[0],
+                            'max_log_prob_difference':np.max(np.abs(log_prob-reference[1])),
+                            'max_gradient_difference':np.max(np.abs(gradients-reference[2]))})
+        return pd.DataFrame(results)
+
+#####MAIN#####
+args = parser.parse_args()
+stan_models = args.stan_models[0].split(',')
+stan_data, info = read_stan_data(args.stan_data[0])
+outdir = args.outdir[0]
+os.makedirs(outdir, exist_ok=True)
+results = benchmark(stan_models, stan_data, args.evaluations[0], args.points[0])
+results.to_csv(outdir+'gradient_benchmark.csv', index=False)
+print(results.to_string(index=False))
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+'''Fits with CmdStan (through cmdstanpy) instead of pystan, for models partitioned with
+reduce_sum (mobility_reduce_sum.stan): the chains run in parallel with several threads each.
+The draws are streamed from the CmdStan csv files, each read once in chunks, into the same
+output layout as the pystan fits (summary.csv, adaptation.json and one .npy per variable).
+'''
+
+import os
+import json
+import numpy as np
+import pandas as pd
+import cmdstanpy
+from draw_store import open_variable, close_variable, write_layout
+from approximate import summary_columns
+from stan_models import available_cores, model_hash
+
+#cmdstanpy summary columns -> summary.csv columns
+summary_names = {'Mean':'mean', 'MCSE':'se_mean', 'StdDev':'sd', 'R_hat':'Rhat'}
+#Effective sample size columns of CmdStan stansummary, the first one present is n_eff
+#(newer versions report ESS_bulk and ESS_tail instead of N_Eff)
+ess_names = ['ESS_bulk', 'N_Eff', 'ESS_tail']
+#Rows of a csv file read at a time (all columns of the written variables)
+chunk_rows = 100
+
+def threaded_model(stan_file):
+    '''Get the cmdstanpy.CmdStanModel of stan_file built with threading (STAN_THREADS).
+    cmdstanpy only recompiles if the stan file is newer than the executable next to it.
+    '''
+    return cmdstanpy.CmdStanModel(stan_file=stan_file, cpp_options={'STAN_THREADS':True})
+
+def chain_threads(chains, n_jobs=None):
+    '''Get the number of chains to run in parallel and the threads per chain
+    so that the chains together use n_jobs cores (default all available)
+    '''
+    cores = n_jobs or available_cores()
+    parallel_chains = max(1, min(chains, cores))
+    return parallel_chains, max(1, cores//parallel_chains)
+
+def csv_columns(csv_file):
+    '''Get the column names of a CmdStan csv file (the first line that is not a comment)
+    '''
+    with open(csv_file) as fh:
+        for line in fh:
+            if not line.startswith('#'):
+                return line.strip().split(',')
+
+def csv_variables(columns):
+    '''Get the model variables in the columns (e.g. E_deaths from E_deaths.1.1), sampler diagnostics except lp__ left out
+    '''
+    names = []
+    for column in columns:
+        name = column.split('.')[0]
+        if name not in names and (not name.endswith('__') or name == 'lp__'):
+            names.append(name)
+    return names
+
+def csv_layout(columns, names):
+    '''Get the positions of the columns of each variable in names and its shape (from E_deaths.N2.M)
+    '''
+    layout = {}
+    for name in names:
+        positions = [c for c, column in enumerate(columns) if column.split('.')[0] == name]
+        indices = [[int(i) for i in columns[c].split('.')[1:]] for c in positions]
+        layout[name] = (positions, tuple(int(i) for i in np.max(indices, axis=0)) if indices[0] else ())
+    return layout
+
+def csv_rows(csv_file):
+    '''Count the draws in a CmdStan csv file (the lines after the header that are not comments)
+    '''
+    with open(csv_file) as fh:
+        return sum(1 for line in fh if not line.startswith('#'))-1
+
+def write_csv_draws(csv_files, outdir, pars=None, chain_draws=None):
+    '''Write the draws of each variable in the csv files to outdir/<name>.npy and draws.json as write_draws.
+    Each csv file is read once, chunk_rows rows at a time, and the columns of each chunk
+    are scattered into one memory map per variable (draw_store.open_variable), in chain order.
+    pars = the variables to write, all if None (lp__ is always written)
+    chain_draws = the number of draws in each csv file, counted if None
+    '''
+    columns = csv_columns(csv_files[0])
+    names = csv_variables(columns)
+    if pars is not None:
+        names = [name for name in names if name in pars or name == 'lp__']
+    layout = csv_layout(columns, names)
+    if chain_draws is None:
+        chain_draws = [csv_rows(csv_file) for csv_file in csv_files]
+    total = sum(chain_draws)
+    draws = {name:open_variable(outdir, name, (total,)+layout[name][1]) for name in names}
+    usecols = sorted(c for name in names for c in layout[name][0])
+    #Column of each variable in the chunks read with usecols
+    chunk_columns = {name:np.searchsorted(usecols, layout[name][0]) for name in names}
+    start = 0
+    for csv_file, n in zip(csv_files, chain_draws):
+        read = 0
+        for chunk in pd.read_csv(csv_file, comment='#', usecols=usecols, chunksize=chunk_rows):
+            values = chunk.values
+            rows = len(values)
+            if read+rows > n:
+                raise ValueError('More draws than expected in '+csv_file)
+            for name in names:
+                #Columns are in stan (column-major) order
+                draws[name][start+read:start+read+rows] = values[:, chunk_columns[name]].reshape((rows,)+layout[name][1], order='F')
+            read += rows
+            del values
+        if read != n:
+            raise ValueError('Expected '+str(n)+' draws in '+csv_file+', found '+str(read))
+        start += n
+    for name in names:
+        close_variable(outdir, name, draws.pop(name))
+    write_layout(outdir, {name:[total]+list(layout[name][1]) for name in names})
+
+def cmdstan_summary(fit, pars=None):
+    '''Get the summary of a cmdstanpy fit with the rows and columns of summary.csv
+    '''
+    summary = fit.summary(percentiles=(2.5, 25, 50, 75, 97.5))
+    ess = [name for name in ess_names if name in summary.columns][:1]
+    summary = summary.rename(columns={**summary_names, **{name:'n_eff' for name in ess}})
+    summary = summary.reindex(columns=summary_columns)
+    if pars is not None:
+        summary = summary[summary.index.str.split('[').str[0].isin(list(pars)+['lp__'])]
+    return summary
+
+def write_cmdstan_adaptation(fit, stan_file, outdir):
+    '''Record the adapted step size and inverse metric of each chain as write_adaptation
+    '''
+    stepsize = [float(chain_stepsize) for chain_stepsize in fit.step_size]
+    inv_metric = [np.asarray(chain_metric).tolist() for chain_metric in fit.metric]
+    with open(os.path.join(outdir, 'adaptation.json'), 'w') as fh:
+        json.dump({'model':model_hash(stan_file), 'stepsize':stepsize, 'inv_metric':inv_metric}, fh)
+
+def simulate_cmdstan(stan_data, stan_file, outdir, settings, grainsize=1, seed=None):
+    '''Sample with CmdStan using the settings of stan_models.sampling_settings (and warm_start),
+    with settings['n_jobs'] chains in parallel and settings['threads_per_chain'] threads each (chain_threads).
+    The csv files of the chains are written to outdir/cmdstan/.
+    grainsize = countries per partial sum of reduce_sum, 1 lets the scheduler choose
+    '''
+    model = threaded_model(stan_file)
+    control = settings['control']
+    metric = None
+    if 'inv_metric' in control:
+        metric = {'inv_metric':np.asarray(control['inv_metric']).tolist()}
+    csv_dir = os.path.join(outdir, 'cmdstan')
+    os.makedirs(csv_dir, exist_ok=True)
+    fit = model.sample(data={**stan_data, 'grainsize':grainsize}, chains=settings['chains'],
+                        parallel_chains=settings['n_jobs'], threads_per_chain=settings['threads_per_chain'],
+                        iter_warmup=settings['warmup'], iter_sampling=settings['iter']-settings['warmup'],
+                        thin=settings['thin'], adapt_delta=control.get('adapt_delta'),
+                        max_treedepth=control.get('max_treedepth'), step_size=control.get('stepsize'),
+                        metric=metric, inits=settings.get('init'), output_dir=csv_dir, seed=seed)
+    write_cmdstan_adaptation(fit, stan_file, outdir)
+    #The draws first, so that they are kept if the summary fails
+    #Saved draws per chain as counted by CmdStan (and cmdstanpy): ceil(sampling iterations/thin)
+    chain_draws = [-(-(settings['iter']-settings['warmup'])//settings['thin'])]*settings['chains']
+    write_csv_draws(fit.runset.csv_files, outdir, settings['pars'], chain_draws)
+    cmdstan_summary(fit, settings['pars']).to_csv(os.path.join(outdir, 'summary.csv'))
+    return fit
@@ -0,0 +1,26 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import sys
+from renewal import write_counterfactual, chunk_draws
+
+import pdb
+
+
+
+#Arguments for argparse module:
+parser = argparse.ArgumentParser(description = '''Compute the counterfactual without mobility changes (Rt = mu) from the saved draws of fits:
+prediction0, E_deaths0 and the log-probabilities for LOO lp0 (E_deaths) and lp1 (E_deaths0).
+They are added to the draws (<name>.npy, draws.json) and summary.csv of each fit.''')
+
+parser.add_argument('--outdir', nargs=1, type= str, default=sys.stdin, help = 'Outdirs of the fits (csv), each with the stan_data bundle and the draws of mu, alpha, y and phi.')
+parser.add_argument('--chunk_draws', nargs=1, type= int, default=[chunk_draws], help = 'Draws simulated at a time.')
+
+
+#####MAIN#####
+args = parser.parse_args()
+for outdir in args.outdir[0].split(','):
+    write_counterfactual(outdir, args.chunk_draws[0])
+    print('Counterfactual written to', outdir)
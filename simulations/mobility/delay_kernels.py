@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+'''Delay distributions fed to the stan models: the serial interval (SI)
+and the infection to death kernel f = s*h
+'''
+
+from functools import lru_cache
+import numpy as np
+from scipy.stats import gamma
+
+#Infection to death: sum of infection to onset and onset to death
+itd_mean = 5.1+18.8
+itd_cv = 0.45
+#Serial interval
+si_mean = 6.5
+si_cv = 0.62
+
+def conv_gamma_params(mean,std):
+    '''Returns converted shape and scale params
+    shape (α) = 1/std^2
+    scale (β) = mean/shape
+    '''
+    shape = 1/(std*std)
+    scale = mean/shape
+
+    return shape,scale
+
+def read_only(array):
+    '''Protect memoized arrays from being changed by the caller
+    '''
+    array.setflags(write=False)
+    return array
+
+@lru_cache(maxsize=32)
+def cumulative_itd(mean, cv, horizon):
+    '''Cumulative probability to die at each half day 1,1.5,...,horizon+0.5 after infection
+    '''
+    itd_shape, itd_scale = conv_gamma_params(mean, cv)
+    itd = gamma(a=itd_shape, scale = itd_scale) #a=shape
+    return read_only(np.cumsum(itd.pdf(np.arange(1,horizon+1,0.5))))
+
+@lru_cache(maxsize=32)
+def serial_interval_distribution(horizon, mean=si_mean, cv=si_cv):
+    '''Models the the time between when a person gets infected and when
+    they subsequently infect another other people, for days 1..horizon
+    '''
+    serial_shape, serial_scale = conv_gamma_params(mean, cv)
+    serial = gamma(a=serial_shape, scale = serial_scale) #a=shape
+    return read_only(serial.pdf(np.arange(1,horizon+1)))
+
+def death_kernels(cfrs, horizon, mean=itd_mean, cv=itd_cv):
+    '''Get f = s*h (horizon x M) for the fatality rates of all M countries at once
+    h = the hazard of dying on day i given survival up to i
+    s = the survival fraction
+    '''
+    cfrs = np.asarray(cfrs, dtype=float)[np.newaxis,:]
+    F = cumulative_itd(mean, cv, horizon)
+    #For each day t, the death prob is the area btw [t-0.5, t+0.5]
+    #divided by the survival fraction (1-the previous death fraction)
+    h = np.zeros((horizon, cfrs.shape[1]))
+    h[1:] = (cfrs*(F[3::2]-F[1:-1:2])[:,np.newaxis])/(1-cfrs*F[1:-1:2][:,np.newaxis])
+    #The cumulative survival fraction is the previous times the survival probability
+    s = np.ones((horizon, cfrs.shape[1]))
+    s[1:] = np.cumprod(1-h[:-1], axis=0)
+    #Multiplying s and h yields fraction dead of fraction survived
+    return s*h
@@ -12,6 +12,11 @@ import matplotlib.pyplot as plt
 from scipy.stats import gamma
 import numpy as np
 import seaborn as sns
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mobility_data import model_columns, read_mobility_slice
+from delay_kernels import serial_interval_distribution, death_kernels
+from draw_store import write_draws
+from stan_models import compiled_model, sampling_profiles, sampling_settings, write_sampling_settings, output_pars, warm_start, write_adaptation
 import pystan
 
 import pdb
@@ -30,36 +35,13 @@ parser.add_argument('--stan_model', nargs=1, type= str, default=sys.stdin, help
 parser.add_argument('--days_to_simulate', nargs=1, type= int, default=sys.stdin, help = 'Number of days to simulate.')
 parser.add_argument('--end_date', nargs=1, type= str, default=sys.stdin, help = 'Up to which date to include data.')
 parser.add_argument('--outdir', nargs=1, type= str, default=sys.stdin, help = 'Path to outdir.')
+parser.add_argument('--profile', nargs=1, type= str, default=['production'], choices=[*sampling_profiles], help = 'Sampling profile (iterations, chains, thinning and control settings).')
+parser.add_argument('--n_jobs', nargs=1, type= int, default=[None], help = 'Max number of cores to use (one per chain). Default all available.')
+parser.add_argument('--outputs', nargs=1, type= str, default=[None], help = 'Variables to keep in the fit, summary and saved draws (csv), e.g. alpha,mu,phi,prediction,E_deaths,Rt. Default all.')
+parser.add_argument('--warm_start', nargs=1, type= str, default=[None], help = 'Outdir of an earlier fit of the same countries to initialize the chains from, with a shorter warmup.')
 
 ###FUNCTIONS###
 
-###DISTRIBUTIONS###
-def conv_gamma_params(mean,std):
-        '''Returns converted shape and scale params
-        shape (α) = 1/std^2
-        scale (β) = mean/shape
-        '''
-        shape = 1/(std*std)
-        scale = mean/shape
-
-        return shape,scale
-
-def infection_to_death():
-        '''Simulate the time from infection to death: Infection --> Onset --> Death'''
-        #Infection to death: sum of ito and otd
-        itd_shape, itd_scale = conv_gamma_params((5.1+18.8), (0.45))
-        itd = gamma(a=itd_shape, scale = itd_scale) #a=shape
-        return itd
-
-def serial_interval_distribution(N2):
-        '''Models the the time between when a person gets infected and when
-        they subsequently infect another other people
-        '''
-        serial_shape, serial_scale = conv_gamma_params(6.5,0.62)
-        serial = gamma(a=serial_shape, scale = serial_scale) #a=shape
-
-        return serial.pdf(np.arange(1,N2+1))
-
 def se_transl(mobility_data, epidemic_data, population_data):
     '''Ensure the county names are the same across dfs
     '''
@@ -102,11 +84,10 @@ def read_and_format_data(datadir, countries, subregions, population_data, epidem
         #Select all data up to end_date
         epidemic_data = epidemic_data[epidemic_data['dateRep']<=end_date]
         #Mobility data
-        mobility_data = pd.read_csv(datadir+'Global_Mobility_Report.csv')
-        #Convert to datetime
-        mobility_data['date']=pd.to_datetime(mobility_data['date'], format='%Y/%m/%d')
-        #Get per country
-        mobility_data = mobility_data[mobility_data['country_region']==countries[0]]
+        #Get per country, only the subregions (sub_region_1)
+        mobility_data = read_mobility_slice(datadir+'Global_Mobility_Report.csv', [countries[0]], 'sub_region_1', columns=model_columns)
+        #Plain strings for translating the names
+        mobility_data = mobility_data.astype({'country_region':object, 'sub_region_1':object, 'sub_region_2':object})
         #Fix varying names
         mobility_data, epidemic_data, population_data = se_transl(mobility_data, epidemic_data, population_data)
         # get CFR
@@ -131,8 +112,6 @@ def read_and_format_data(datadir, countries, subregions, population_data, epidem
                     'y':[], #index cases
                     'population_size':[] #Size of population
                     }
-        #Infection to death distribution
-        itd = infection_to_death()
 
         #Diamond princess fatality rates per age group
         #dp_cfr = [0,0.002,0.002,0.002,0.004,0.013,0.036,0.08,0.148] #age groups: 0-9,10-19,20-29,30-39,40-49,50-59,60-69,70-79,80+
@@ -147,6 +126,8 @@ def read_and_format_data(datadir, countries, subregions, population_data, epidem
         country = countries[0]
         #Get fatality rate
         cfr = cfr_by_country[cfr_by_country['Region, subregion, country or area *']==country]['weighted_fatality'].values[0]
+        #Infection to death kernel f = s*h, the same for all subregions
+        f = death_kernels([cfr], N2)[:,0]
 
 
         #Get data by country
@@ -196,30 +177,6 @@ def read_and_format_data(datadir, countries, subregions, population_data, epidem
                     pdb.set_trace()
 
 
-                #Get hazard rates for all days in country data
-                h = np.zeros(N2) #N2 = N+forecast
-                f = np.cumsum(itd.pdf(np.arange(1,len(h)+1,0.5))) #Cumulative probability to die for each day
-                for i in range(1,len(h)):
-                    #for each day t, the death prob is the area btw [t-0.5, t+0.5]
-                    #divided by the survival fraction (1-the previous death fraction), (fatality ratio*death prob at t-0.5)
-                    #This will be the percent increase compared to the previous end interval
-                    h[i] = (cfr*(f[i*2+1]-f[i*2-1]))/(1-cfr*f[i*2-1])
-
-                #The number of deaths today is the sum of the past infections weighted by their probability of death,
-                #where the probability of death depends on the number of days since infection.
-                s = np.zeros(N2)
-                s[0] = 1
-                for i in range(1,len(s)):
-                    #h is the percent increase in death
-                    #s is thus the relative survival fraction
-                    #The cumulative survival fraction will be the previous
-                    #times the survival probability
-                    #These will be used to track how large a fraction is left after each day
-                    #In the end all of this will amount to the adjusted death fraction
-                    s[i] = s[i-1]*(1-h[i-1]) #Survival fraction
-
-                #Multiplying s and h yields fraction dead of fraction survived
-                f = s*h #This will be fed to the Stan Model
                 stan_data['f'][:,c]=f
                 #Number of deaths
                 deaths = np.zeros(N2)
@@ -281,24 +238,30 @@ def read_and_format_data(datadir, countries, subregions, population_data, epidem
 
 
 
-def simulate(stan_data, stan_model, outdir):
+def simulate(stan_data, stan_model, outdir, profile, n_jobs, outputs, warm_start_dir=None):
         '''Simulate using stan: Efficient MCMC exploration according to Bayesian posterior distribution
         for parameter estimation.
+        profile = name of the sampling profile
+        n_jobs = max number of cores to use
+        outputs = the variables to keep, all if None
+        warm_start_dir = outdir of an earlier fit to warm start from, None for random inits
         '''
 
-        sm =  pystan.StanModel(file=stan_model)
-        fit = sm.sampling(data=stan_data,iter=4000,warmup=2000,chains=8,thin=4, control={'adapt_delta': 0.92, 'max_treedepth': 20})
+        sm = compiled_model(stan_model)
+        settings = sampling_settings(profile, {'adapt_delta': 0.92, 'max_treedepth': 20}, n_jobs, outputs)
+        if warm_start_dir is not None:
+            settings = warm_start(settings, profile, warm_start_dir, stan_model, stan_data['M'])
+        write_sampling_settings(profile, settings, outdir, warm_start_dir)
+        fit = sm.sampling(data=stan_data, **settings)
+        write_adaptation(fit, stan_model, outdir)
         #Save summary
-        s = fit.summary()
+        s = fit.summary(pars=settings['pars'])
         summary = pd.DataFrame(s['summary'], columns=s['summary_colnames'], index=s['summary_rownames'])
         summary.to_csv(outdir+'summary.csv')
 
-        #Save fit - each parameter as np array
-        out = fit.extract()
-        for key in [*out.keys()]:
-            fit_param = out[key]
-            np.save(outdir+key+'.npy', fit_param)
-        return out
+        #Save fit - each parameter as np array (draws x dims)
+        write_draws(fit, outdir, settings['pars'])
+        return fit
 
 #####MAIN#####
 args = parser.parse_args()
@@ -317,4 +280,4 @@ outdir = args.outdir[0]
 stan_data = read_and_format_data(datadir, countries, subregions, population_data, epidemic_data, days_to_simulate, end_date)
 pdb.set_trace()
 #Simulate
-out = simulate(stan_data, stan_model, outdir)
+fit = simulate(stan_data, stan_model, outdir, args.profile[0], args.n_jobs[0], output_pars(args.outputs[0]), args.warm_start[0])
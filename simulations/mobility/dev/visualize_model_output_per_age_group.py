@@ -13,6 +13,10 @@ from matplotlib.patches import Rectangle
 from scipy.stats import gamma
 import numpy as np
 import seaborn as sns
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mobility_data import model_columns, read_mobility_data
+from summary_table import read_summary, summary_column
+from figure_render import figure_job, render_figures
 
 
 import pdb
@@ -28,6 +32,8 @@ parser.add_argument('--days_to_simulate', nargs=1, type= int, default=sys.stdin,
 parser.add_argument('--end_date', nargs=1, type= str, default=sys.stdin, help = 'Up to which date to include data.')
 parser.add_argument('--short_dates', nargs=1, type= str, default=sys.stdin, help = 'Short date format for plotting (csv).')
 parser.add_argument('--outdir', nargs=1, type= str, default=sys.stdin, help = 'Path to outdir.')
+parser.add_argument('--n_jobs', nargs=1, type= int, default=[None], help = 'Number of processes rendering the figures. Default all cores.')
+parser.add_argument('--force', action='store_true', help = 'Redraw all figures, also those with unchanged inputs.')
 
 def read_and_format_data(datadir, countries, days_to_simulate, covariate_names, end_date):
         '''Read in and format all data needed for the model
@@ -40,9 +46,7 @@ def read_and_format_data(datadir, countries, days_to_simulate, covariate_names,
         #Select all data up to end_date
         epidemic_data = epidemic_data[epidemic_data['dateRep']<=end_date]
         #Mobility data
-        mobility_data = pd.read_csv(datadir+'Global_Mobility_Report.csv')
-        #Convert to datetime
-        mobility_data['date']=pd.to_datetime(mobility_data['date'], format='%Y/%m/%d')
+        mobility_data = read_mobility_data(datadir+'Global_Mobility_Report.csv', columns=model_columns)
         #Get death distribution
         deaths_per_age = pd.read_csv(datadir+'Sweden/deaths_age.csv')
         deaths_per_age = deaths_per_age['Totalt_antal_avlidna'].values
@@ -138,8 +142,10 @@ def read_and_format_data(datadir, countries, days_to_simulate, covariate_names,
 
         return stan_data
 
-def visualize_results(outdir, countries, stan_data, days_to_simulate, short_dates):
+def visualize_results(outdir, countries, stan_data, days_to_simulate, short_dates, n_jobs=None, force=False):
     '''Visualize results
+    The figures are collected as jobs with the arrays they need and rendered in parallel (n_jobs processes),
+    only those with changed inputs unless force
     '''
     #params = ['mu', 'alpha', 'kappa', 'y', 'phi', 'tau', 'convolution', 'prediction',
     #'E_deaths', 'Rt', 'lp0', 'lp1', 'convolution0', 'prediction0', 'E_deaths0', 'lp__']
@@ -151,45 +157,23 @@ def visualize_results(outdir, countries, stan_data, days_to_simulate, short_date
     #For models fit using MCMC, also included in the summary are the
     #Monte Carlo standard error (se_mean), the effective sample size (n_eff),
     #and the R-hat statistic (Rhat).
-    summary = pd.read_csv(outdir+'summary.csv')
+    summary = read_summary(outdir)
     #cases = np.load(outdir+'prediction.npy', allow_pickle=True)
     #deaths = np.load(outdir+'E_deaths.npy', allow_pickle=True)
     #Rt =  np.load(outdir+'Rt.npy', allow_pickle=True)
     alphas = np.load(outdir+'alpha.npy', allow_pickle=True)
     phi = np.load(outdir+'phi.npy', allow_pickle=True)
     days = np.arange(0,days_to_simulate) #Days to simulate
+    jobs = [] #Figures to render
     #Plot rhat
-    fig, ax = plt.subplots(figsize=(6, 4))
-    ax.hist(summary['Rhat'])
-    ax.set_ylabel('Count')
-    ax.set_xlabel("Rhat")
-    fig.savefig(outdir+'plots/rhat.png', format='png', dpi=300)
-    plt.close()
+    jobs.append(figure_job(outdir+'plots/rhat.png', plot_rhat, summary_column(summary, 'Rhat'), outdir+'plots/rhat.png'))
 
     #Plot values from each iteration as r function mcmc_parcoord
-    mcmc_parcoord(np.concatenate([alphas,np.expand_dims(phi,axis=1)], axis=1), covariate_names+['phi'], outdir)
+    jobs.append(figure_job(outdir+'plots/mcmc_parcoord.png', mcmc_parcoord, np.concatenate([alphas,np.expand_dims(phi,axis=1)], axis=1),
+                covariate_names+['phi'], outdir+'plots/mcmc_parcoord.png'))
 
     #Plot alpha (Rt = R0*-exp(sum{mob_change*alpha1-6}))
-    fig, ax = plt.subplots(figsize=(9/2.54, 9/2.54))
-    alpha_colors = {0:'tab:red',1:'tab:purple',2:'tab:pink', 3:'tab:olive', 4:'tab:cyan'}
-    for i in range(1,6):
-        alpha = summary[summary['Unnamed: 0']=='alpha['+str(i)+']']
-        alpha_m = 1-np.exp(-alpha['mean'].values[0])
-        alpha_2_5 = 1-np.exp(-alpha['2.5%'].values[0])
-        alpha_25 = 1-np.exp(-alpha['25%'].values[0])
-        alpha_75 = 1-np.exp(-alpha['75%'].values[0])
-        alpha_97_5 = 1-np.exp(-alpha['97.5%'].values[0])
-        ax.plot([i-0.25,i+0.25],[alpha_m,alpha_m],color = alpha_colors[i-1])
-        ax.plot([i]*2,[alpha_2_5,alpha_97_5],  marker = '_',color = alpha_colors[i-1])
-        rect = Rectangle((i-0.25,alpha_25),0.5,alpha_75-alpha_25,linewidth=1, color = alpha_colors[i-1], alpha = 0.3)
-        ax.add_patch(rect)
-    ax.set_ylim([0,1])
-    ax.set_ylabel('Fractional reduction in R0')
-    ax.set_xticks([1,2,3,4,5])
-    ax.set_xticklabels(['retail and recreation', 'grocery and pharmacy', 'transit stations','workplace', 'residential'],rotation='vertical')
-    plt.tight_layout()
-    fig.savefig(outdir+'plots/alphas.png', format='png', dpi=300)
-    plt.close()
+    jobs.append(figure_job(outdir+'plots/alphas.png', plot_alphas, summary['alpha'], outdir+'plots/alphas.png'))
 
 
     #Get population fractions
@@ -224,44 +208,36 @@ def visualize_results(outdir, countries, stan_data, days_to_simulate, short_date
         lower_bound25 = {'prediction':np.zeros((9,days_to_simulate)),'E_deaths':np.zeros((1,days_to_simulate)), 'Rt':np.zeros((1,days_to_simulate))} #Estimated 25%
         higher_bound75 = {'prediction':np.zeros((9,days_to_simulate)),'E_deaths':np.zeros((1,days_to_simulate)), 'Rt':np.zeros((1,days_to_simulate))} #Estimated 55 % - together 75 % CI
         #Get means and 95 % CI for cases (prediction), deaths and Rt for all time steps
-        for j in range(1,days_to_simulate+1):
-            for var in ['prediction', 'E_deaths','Rt']:
-                for p in range(1,means[var].shape[0]+1):
-                    if var == 'prediction':
-                        var_pij = summary[summary['Unnamed: 0']==var+'['+str(p)+','+str(j)+','+str(i)+']']
-                    else:
-                        var_pij = summary[summary['Unnamed: 0']==var+'['+str(j)+','+str(i)+']']
-                    means[var][p-1,j-1]=var_pij['mean'].values[0]
-                    lower_bound[var][p-1,j-1]=var_pij['2.5%'].values[0]
-                    higher_bound[var][p-1,j-1]=var_pij['97.5%'].values[0]
-                    lower_bound25[var][p-1,j-1]=var_pij['25%'].values[0]
-                    higher_bound75[var][p-1,j-1]=var_pij['75%'].values[0]
+        #prediction is per age group (9 x N2 x M), E_deaths and Rt are N2 x M
+        for var in ['prediction', 'E_deaths','Rt']:
+            for bound, stat in [(means,'mean'), (lower_bound,'2.5%'), (higher_bound,'97.5%'), (lower_bound25,'25%'), (higher_bound75,'75%')]:
+                bound[var][:,:]=summary[var][stat][...,:days_to_simulate,i-1]
 
 
         #Plot cases
         #Per day
-        plot_shade_ci(days, end, dates[0], np.sum(means['prediction'], axis = 0), observed_country_cases,np.sum(lower_bound['prediction'],axis=0),
+        jobs.append(figure_job(outdir+'plots/'+country+'_cases.png', plot_shade_ci, days, end, dates[0], np.sum(means['prediction'], axis = 0), observed_country_cases,np.sum(lower_bound['prediction'],axis=0),
         np.sum(higher_bound['prediction'], axis = 0), np.sum(lower_bound25['prediction'], axis = 0), np.sum(higher_bound75['prediction'], axis = 0), 'Cases per day',
         outdir+'plots/'+country+'_cases.png',country_npi, country_retail, country_grocery, country_transit,
-        country_work, country_residential, short_dates)
+        country_work, country_residential, short_dates))
 
         #Cumulative
-        plot_shade_ci(days, end, dates[0], np.cumsum(np.sum(means['prediction'], axis = 0)), np.cumsum(observed_country_cases),np.cumsum(np.sum(lower_bound['prediction'], axis = 0)),
+        jobs.append(figure_job(outdir+'plots/'+country+'_cumulative_cases.png', plot_shade_ci, days, end, dates[0], np.cumsum(np.sum(means['prediction'], axis = 0)), np.cumsum(observed_country_cases),np.cumsum(np.sum(lower_bound['prediction'], axis = 0)),
         np.cumsum(np.sum(higher_bound['prediction'], axis = 0)), np.cumsum(np.sum(lower_bound25['prediction'], axis = 0)), np.cumsum(np.sum(higher_bound75['prediction'], axis = 0)),
-        'Cumulative cases',outdir+'plots/'+country+'_cumulative_cases.png',country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates)
+        'Cumulative cases',outdir+'plots/'+country+'_cumulative_cases.png',country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates))
         #Plot Deaths
         #Per day
-        plot_shade_ci(days, end,dates[0],means['E_deaths'][0,:],observed_country_deaths, lower_bound['E_deaths'][0,:], higher_bound['E_deaths'][0,:],
+        jobs.append(figure_job(outdir+'plots/'+country+'_deaths.png', plot_shade_ci, days, end,dates[0],means['E_deaths'][0,:],observed_country_deaths, lower_bound['E_deaths'][0,:], higher_bound['E_deaths'][0,:],
         lower_bound25['E_deaths'][0,:], higher_bound75['E_deaths'][0,:], 'Deaths per day',
-        outdir+'plots/'+country+'_deaths.png',country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates)
+        outdir+'plots/'+country+'_deaths.png',country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates))
         #Cumulative
-        plot_shade_ci(days, end,dates[0],np.cumsum(means['E_deaths']),np.cumsum(observed_country_deaths), np.cumsum(lower_bound['E_deaths']), np.cumsum(higher_bound['E_deaths']),
+        jobs.append(figure_job(outdir+'plots/'+country+'_cumulative_deaths.png', plot_shade_ci, days, end,dates[0],np.cumsum(means['E_deaths']),np.cumsum(observed_country_deaths), np.cumsum(lower_bound['E_deaths']), np.cumsum(higher_bound['E_deaths']),
         np.cumsum(lower_bound25['E_deaths']), np.cumsum(higher_bound75['E_deaths']), 'Cumulative deaths',
-        outdir+'plots/'+country+'_cumulative_deaths.png',country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates)
+        outdir+'plots/'+country+'_cumulative_deaths.png',country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates))
         #Plot R
-        plot_shade_ci(days,end,dates[0],means['Rt'][0,:],'', lower_bound['Rt'][0,:], higher_bound['Rt'][0,:], lower_bound25['Rt'][0,:],
+        jobs.append(figure_job(outdir+'plots/'+country+'_Rt.png', plot_shade_ci, days,end,dates[0],means['Rt'][0,:],'', lower_bound['Rt'][0,:], higher_bound['Rt'][0,:], lower_bound25['Rt'][0,:],
         higher_bound75['Rt'][0,:],'Rt',outdir+'plots/'+country+'_Rt.png',country_npi,
-        country_retail, country_grocery, country_transit, country_work, country_residential, short_dates)
+        country_retail, country_grocery, country_transit, country_work, country_residential, short_dates))
 
         #Print R mean at beginning and end of model
         try:
@@ -270,21 +246,57 @@ def visualize_results(outdir, countries, stan_data, days_to_simulate, short_date
             continue
     #Close outfile
     result_file.close()
+    #Render the figures that changed, with the time per figure
+    render_figures(jobs, n_jobs, outdir+'plots/render_timings.csv', force)
 
     return None
 
-def mcmc_parcoord(cat_array, xtick_labels, outdir):
+def plot_rhat(rhat, outname):
+    '''Plot a histogram of the Rhat of all variables
+    '''
+    fig, ax = plt.subplots(figsize=(6, 4))
+    ax.hist(rhat)
+    ax.set_ylabel('Count')
+    ax.set_xlabel("Rhat")
+    fig.savefig(outname, format='png', dpi=300)
+    plt.close()
+
+def plot_alphas(alpha, outname):
+    '''Plot the fractional reduction in R0 per mobility covariate (mean, 50 % and 95 % CI)
+    alpha = the summary statistics of alpha
+    '''
+    fig, ax = plt.subplots(figsize=(9/2.54, 9/2.54))
+    alpha_colors = {0:'tab:red',1:'tab:purple',2:'tab:pink', 3:'tab:olive', 4:'tab:cyan'}
+    for i in range(1,6):
+        alpha_m = 1-np.exp(-alpha['mean'][i-1])
+        alpha_2_5 = 1-np.exp(-alpha['2.5%'][i-1])
+        alpha_25 = 1-np.exp(-alpha['25%'][i-1])
+        alpha_75 = 1-np.exp(-alpha['75%'][i-1])
+        alpha_97_5 = 1-np.exp(-alpha['97.5%'][i-1])
+        ax.plot([i-0.25,i+0.25],[alpha_m,alpha_m],color = alpha_colors[i-1])
+        ax.plot([i]*2,[alpha_2_5,alpha_97_5],  marker = '_',color = alpha_colors[i-1])
+        rect = Rectangle((i-0.25,alpha_25),0.5,alpha_75-alpha_25,linewidth=1, color = alpha_colors[i-1], alpha = 0.3)
+        ax.add_patch(rect)
+    ax.set_ylim([0,1])
+    ax.set_ylabel('Fractional reduction in R0')
+    ax.set_xticks([1,2,3,4,5])
+    ax.set_xticklabels(['retail and recreation', 'grocery and pharmacy', 'transit stations','workplace', 'residential'],rotation='vertical')
+    plt.tight_layout()
+    fig.savefig(outname, format='png', dpi=300)
+    plt.close()
+
+def mcmc_parcoord(cat_array, xtick_labels, outname):
     '''Plot parameters for each iteration next to each other as in the R fucntion mcmc_parcoord
     '''
-    xtick_labels.insert(0,'')
+    xtick_labels = ['']+list(xtick_labels)
     fig, ax = plt.subplots(figsize=(8, 8))
-    for i in range(2000,cat_array.shape[0]): #loop through all iterations
+    for i in range(cat_array.shape[0]): #loop through all post-warmup draws of all chains
             ax.plot(np.arange(cat_array.shape[1]), cat_array[i,:], color = 'k', alpha = 0.1)
     ax.plot(np.arange(cat_array.shape[1]), np.median(cat_array, axis = 0), color = 'r', alpha = 1)
     ax.set_xticklabels(xtick_labels,rotation='vertical')
     ax.set_ylim([-5,20])
     plt.tight_layout()
-    fig.savefig(outdir+'plots/mcmc_parcoord.png', format = 'png')
+    fig.savefig(outname, format = 'png')
     plt.close()
 
 def plot_shade_ci(x,end,start_date,y, observed_y, lower_bound, higher_bound,lower_bound25, higher_bound75,ylabel,outname,country_npi, country_retail, country_grocery, country_transit, country_work, country_residential, short_dates):
@@ -388,4 +400,4 @@ covariate_names = ['retail_and_recreation_percent_change_from_baseline',
 stan_data = read_and_format_data(datadir, countries, days_to_simulate, covariate_names,end_date)
 
 #Visualize
-visualize_results(outdir, countries, stan_data, days_to_simulate, short_dates)
+visualize_results(outdir, countries, stan_data, days_to_simulate, short_dates, args.n_jobs[0], args.force)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+'''Posterior statistics computed from the saved draws (draw_store) along the draw axis:
+means, any quantiles, highest density intervals (HDI) and exceedance probabilities P(value > threshold),
+and the exceedance probabilities of the observed deaths under the posterior predictive (predictive_exceedance).
+Variables of draws x N2 x M are processed one country and chunk_days days at a time,
+and the results are cached per run in outdir/.draws.cache/
+'''
+
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+from scipy.stats import nbinom
+from draw_store import read_draws
+from renewal import read_phi
+
+#Version of the cached statistics, increase when the layout changes
+statistics_version = 1
+#Days read at a time per country
+chunk_days = 50
+#Central credible intervals of the dashboard
+credible_levels = [0.5, 0.8, 0.9, 0.95]
+
+def interval_quantiles(levels):
+    '''Get the sorted quantiles bounding the central intervals of the credible levels, e.g. 0.95 -> 0.025, 0.975
+    '''
+    return sorted(set([round((1-level)/2, 6) for level in levels]+[round((1+level)/2, 6) for level in levels]))
+
+def quantile_name(quantile):
+    '''Name of a quantile as in summary.csv, e.g. 0.025 -> 2.5%
+    '''
+    return '{:g}%'.format(quantile*100)
+
+def hdi_names(level):
+    '''Names of the bounds of the HDI of a credible level, e.g. 0.95 -> hdi 95% lower, hdi 95% upper
+    '''
+    return 'hdi {:g}% lower'.format(level*100), 'hdi {:g}% upper'.format(level*100)
+
+def exceedance_name(threshold):
+    '''Name of an exceedance probability, e.g. 100 -> P(>100)
+    '''
+    return 'P(>{:g})'.format(threshold)
+
+def hdi(values, level):
+    '''Get the lower and upper bounds of the narrowest interval holding level of the draws (axis 0)
+    '''
+    sorted_values = np.sort(values, axis=0)
+    n = len(sorted_values)
+    width = int(np.floor(level*n))
+    widths = sorted_values[width:]-sorted_values[:n-width]
+    start = np.argmin(widths, axis=0)[np.newaxis]
+    lower = np.take_along_axis(sorted_values, start, axis=0)[0]
+    upper = np.take_along_axis(sorted_values, start+width, axis=0)[0]
+    return lower, upper
+
+def chunk_statistics(values, quantiles=(), hdi_levels=(), thresholds=()):
+    '''Get the statistics of draws x dims values along the draw axis
+    Returns {name: array of dims}: mean, the quantiles (e.g. 2.5%), the HDI bounds and P(>threshold)
+    '''
+    values = np.asarray(values, dtype=float)
+    statistics = {'mean':values.mean(axis=0)}
+    if len(quantiles):
+        for quantile, value in zip(quantiles, np.quantile(values, quantiles, axis=0)):
+            statistics[quantile_name(quantile)] = value
+    for level in hdi_levels:
+        lower_name, upper_name = hdi_names(level)
+        statistics[lower_name], statistics[upper_name] = hdi(values, level)
+    for threshold in thresholds:
+        statistics[exceedance_name(threshold)] = (values > threshold).mean(axis=0)
+    return statistics
+
+def statistics_key(outdir, name, quantiles, hdi_levels, thresholds):
+    '''Get the cache key of the statistics of one variable: the sha1 of the request
+    and of the size and modification time of the draws
+    '''
+    info = os.stat(os.path.join(outdir, name+'.npy'))
+    request = {'version':statistics_version, 'name':name, 'quantiles':[float(q) for q in quantiles],
+               'hdi_levels':[float(level) for level in hdi_levels], 'thresholds':[float(t) for t in thresholds],
+               'size':info.st_size, 'mtime':info.st_mtime_ns}
+    return hashlib.sha1(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+def draw_statistics(outdir, name, quantiles=(), hdi_levels=(), thresholds=(), chunk_days=chunk_days, cache=True):
+    '''Get the statistics of the draws of one variable (see chunk_statistics), e.g. E_deaths -> N2 x M arrays.
+    Draws x N2 x M variables (and draws x ... x N2 x M, e.g. the ages of prediction) are read one country
+    and chunk_days days at a time.
+    cache = read and write the statistics in outdir/.draws.cache/
+    '''
+    cache_dir = os.path.join(outdir, '.draws.cache')
+    cache_file = os.path.join(cache_dir, name+'-'+statistics_key(outdir, name, quantiles, hdi_levels, thresholds)+'.npz')
+    if cache and os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            return {key:cached[key] for key in cached.files}
+
+    draws = read_draws(outdir, name)
+    if draws.ndim < 3:
+        statistics = chunk_statistics(draws, quantiles, hdi_levels, thresholds)
+    else:
+        #Leading axes (e.g. the ages) are kept
+        leading, (N2, M) = draws.shape[1:-2], draws.shape[-2:]
+        statistics = {}
+        for m in range(M):
+            for start in range(0, N2, chunk_days):
+                days = slice(start, min(start+chunk_days, N2))
+                chunk = chunk_statistics(read_draws(outdir, name, country=m, days=days), quantiles, hdi_levels, thresholds)
+                for key in chunk:
+                    if key not in statistics:
+                        statistics[key] = np.zeros(leading+(N2, M))
+                    statistics[key][..., days, m] = chunk[key]
+
+    if cache:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            np.savez(fh, **statistics)
+        os.replace(tmp_file, cache_file)
+    return statistics
+
+def credible_intervals(outdir, name, levels=credible_levels, thresholds=(), chunk_days=chunk_days):
+    '''Get the mean, the central intervals of the credible levels (e.g. 5% and 95% for 0.9)
+    and the exceedance probabilities of one variable
+    '''
+    return draw_statistics(outdir, name, interval_quantiles(levels), thresholds=thresholds, chunk_days=chunk_days)
+
+def predictive_exceedance(outdir, thresholds, name='E_deaths', chunk_days=chunk_days):
+    '''Get P(deaths > threshold) under the posterior predictive deaths ~ neg_binomial_2(name, phi):
+    the mean over the draws of the negative binomial survival function, including the observation noise
+    that (E_deaths > threshold) leaves out. Returns {exceedance_name(threshold): N2 x M array}
+    '''
+    phi = read_phi(outdir)[:,np.newaxis]
+    N2, M = read_draws(outdir, name).shape[-2:]
+    exceedance = {exceedance_name(threshold):np.zeros((N2, M)) for threshold in thresholds}
+    for m in range(M):
+        for start in range(0, N2, chunk_days):
+            days = slice(start, min(start+chunk_days, N2))
+            expected = np.asarray(read_draws(outdir, name, country=m, days=days), dtype=float)
+            p = phi/(phi+np.maximum(expected, 1e-12))
+            for threshold in thresholds:
+                exceedance[exceedance_name(threshold)][days, m] = nbinom.sf(np.floor(threshold), phi, p).mean(axis=0)
+    return exceedance
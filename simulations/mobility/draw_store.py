@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+'''Posterior draws of a pystan fit stored as one .npy per variable
+(draws x dims, e.g. draws x N2 x M for E_deaths), written one chain at a time
+and readable in slices through memory-mapping
+'''
+
+import os
+import json
+import numpy as np
+
+def open_variable(outdir, name, shape, dtype=float):
+    '''Open a memory map of the draws of one variable in a temporary file, moved in place by close_variable
+    '''
+    return np.lib.format.open_memmap(os.path.join(outdir, '.'+name+'.npy.tmp'), mode='w+', dtype=dtype, shape=tuple(shape))
+
+def close_variable(outdir, name, draws):
+    '''Flush the draws opened with open_variable and move them in place as outdir/<name>.npy
+    '''
+    draws.flush()
+    del draws
+    os.replace(os.path.join(outdir, '.'+name+'.npy.tmp'), os.path.join(outdir, name+'.npy'))
+
+def write_variable(outdir, name, values, chunk_draws=1000):
+    '''Write the draws of one variable through a memory map to a temporary file,
+    then move it in place as outdir/<name>.npy
+    '''
+    draws = open_variable(outdir, name, values.shape, values.dtype)
+    for start in range(0, len(values), chunk_draws):
+        draws[start:start+chunk_draws] = values[start:start+chunk_draws]
+    close_variable(outdir, name, draws)
+
+def write_layout(outdir, shapes):
+    '''Write the names and shapes of the variables to outdir/draws.json
+    '''
+    with open(os.path.join(outdir, 'draws.json'), 'w') as fh:
+        json.dump({'names':[*shapes], 'shapes':shapes}, fh, indent=1)
+
+def write_draws(fit, outdir, pars=None):
+    '''Write the draws of each variable to outdir/<name>.npy, one variable and one chain at a time:
+    the kept draws of a chain are copied from fit.sim into a preallocated memory map,
+    so at most one chain of one variable is held in memory (fit.extract() copies all draws of a variable).
+    The draws are in chain order (chain 1, chain 2, ...), not permuted as fit.extract().
+    The names and shapes are written to outdir/draws.json.
+    pars = the variables to write, all if None (lp__ is always written)
+    '''
+    sim = fit.sim
+    pars = [*fit.model_pars] if pars is None else [*pars]
+    if 'lp__' not in pars:
+        pars.append('lp__')
+    #Position of each variable in the flat names of the chains (stan column-major order)
+    offsets = np.cumsum([0]+[int(np.prod(dims)) for dims in sim['dims_oi']])
+    shapes = {}
+    for name in pars:
+        p = sim['pars_oi'].index(name)
+        dims = tuple(sim['dims_oi'][p])
+        flatnames = sim['fnames_oi'][offsets[p]:offsets[p+1]]
+        #Draws after warmup per chain
+        kept = [len(chain['chains'][flatnames[0]])-warmup for chain, warmup in zip(sim['samples'], sim['warmup2'])]
+        draws = open_variable(outdir, name, (sum(kept),)+dims)
+        start = 0
+        for chain, warmup, n in zip(sim['samples'], sim['warmup2'], kept):
+            values = np.column_stack([np.asarray(chain['chains'][flatname])[warmup:] for flatname in flatnames])
+            draws[start:start+n] = values.reshape((n,)+dims, order='F')
+            start += n
+            del values
+        close_variable(outdir, name, draws)
+        shapes[name] = [sum(kept)]+list(dims)
+    write_layout(outdir, shapes)
+
+def write_draw_arrays(draws, outdir):
+    '''Write draws already held as arrays (name -> draws x dims) in the same layout as write_draws
+    '''
+    for name in draws:
+        write_variable(outdir, name, draws[name])
+    write_layout(outdir, {name:list(draws[name].shape) for name in draws})
+
+def read_layout(outdir):
+    '''Read the shapes of the variables in outdir/draws.json (name -> shape), empty if there are none
+    '''
+    try:
+        with open(os.path.join(outdir, 'draws.json')) as fh:
+            return json.load(fh)['shapes']
+    except FileNotFoundError:
+        return {}
+
+def add_draw_arrays(draws, outdir):
+    '''Add draws held as arrays (name -> draws x dims) to the variables already written to outdir
+    '''
+    shapes = read_layout(outdir)
+    for name in draws:
+        write_variable(outdir, name, draws[name])
+        shapes[name] = list(draws[name].shape)
+    write_layout(outdir, shapes)
+
+def has_draws(outdir, name):
+    '''Check if the draws of a variable are written to outdir
+    '''
+    return os.path.exists(os.path.join(outdir, name+'.npy'))
+
+def read_draws(outdir, name, country=None, days=None, draws=None):
+    '''Read the draws of one variable (memory-mapped), only the wanted part.
+    country = index of the country (last axis), all if None
+    days = index or slice of the days (N2 axis, second to last of draws x N2 x M
+    and e.g. draws x ages x N2 x M variables), all if None
+    draws = index or slice of the draws, all if None
+    '''
+    values = np.load(os.path.join(outdir, name+'.npy'), mmap_mode='r')
+    index = [slice(None) if draws is None else draws]
+    #Axes between the draws and the days, e.g. the ages
+    index += [slice(None)]*(values.ndim-3)
+    if values.ndim >= 3:
+        index.append(slice(None) if days is None else days)
+    if values.ndim > 1:
+        index.append(slice(None) if country is None else country)
+    return values[tuple(index)]
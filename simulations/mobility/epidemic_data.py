@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+'''ECDC epidemic data (ecdc_YYYYMMDD.csv) grouped and sorted per country once
+'''
+
+import os
+import numpy as np
+import pandas as pd
+from mobility_data import source_hash
+
+#Increase if the layout of the persisted index changes
+index_version = 1
+
+def build_index(epidemic_data):
+    '''Sort on country and date and get the row offsets of each country
+    '''
+    dates = pd.to_datetime(epidemic_data['dateRep'], format='%d/%m/%Y').values.astype('datetime64[D]')
+    country_names = epidemic_data['countriesAndTerritories'].values.astype(str)
+    #Stable sort on country, then date
+    order = np.lexsort((dates, country_names))
+    countries, offsets = np.unique(country_names[order], return_index=True)
+    offsets = np.append(offsets, len(order))
+    return {'order':order, 'countries':countries, 'offsets':offsets, 'dates':dates[order]}
+
+def read_epidemic_data(ecdc_csv):
+    '''Read an ECDC snapshot with all countries as contiguous, date sorted slices.
+    The sort index is persisted next to the csv and reused as long as the content is unchanged.
+    '''
+    csv_dir, csv_name = os.path.split(os.path.abspath(ecdc_csv))
+    cache_root = os.path.join(csv_dir, '.'+csv_name+'.cache')
+    os.makedirs(cache_root, exist_ok=True)
+    index_file = os.path.join(cache_root, source_hash(ecdc_csv, cache_root)+'_index_v'+str(index_version)+'.npz')
+    epidemic_data = pd.read_csv(ecdc_csv)
+    try:
+        with np.load(index_file) as npz:
+            index = {key:npz[key] for key in npz.files}
+    except (OSError, ValueError):
+        index = build_index(epidemic_data)
+        tmp_file = index_file+'.'+str(os.getpid())+'.npz'
+        np.savez(tmp_file, **index)
+        os.replace(tmp_file, index_file)
+
+    epidemic_data = epidemic_data.iloc[index['order']].reset_index(drop=True)
+    epidemic_data['dateRep'] = pd.to_datetime(index['dates'])
+    store = {'data':epidemic_data,
+            'countries':index['countries'],
+            'offsets':index['offsets'],
+            'dates':index['dates'],
+            'country_index':{country:i for i, country in enumerate(index['countries'])}}
+    return store
+
+def country_rows(store, country, end_date=None):
+    '''Get the first and last (exclusive) row of a country, up to and including end_date
+    '''
+    i = store['country_index'][country]
+    begin, end = store['offsets'][i], store['offsets'][i+1]
+    if end_date is not None:
+        end = begin+np.searchsorted(store['dates'][begin:end], np.datetime64(end_date, 'D'), side='right')
+    return begin, end
+
+def country_data(store, country, end_date=None, start=0):
+    '''Get the date sorted data of a country from row start (relative to the first date) to end_date
+    '''
+    begin, end = country_rows(store, country, end_date)
+    return store['data'].iloc[begin+start:end].reset_index(drop=True)
+
+def epidemic_starts(store, countries, end_date=None, min_deaths=10, days_before=30):
+    '''Get the day (row) with at least min_deaths cumulative deaths and the start
+    of the modeled period (days_before days earlier, not before the first row)
+    for all countries in one pass. Raises ValueError if a country never reaches min_deaths.
+    '''
+    deaths = store['data']['deaths'].values
+    offsets = store['offsets']
+    ends = offsets[1:].copy()
+    if end_date is not None:
+        #Only count deaths up to end_date (the dates are sorted within each country)
+        ends = offsets[:-1]+np.add.reduceat(store['dates']<=np.datetime64(end_date, 'D'), offsets[:-1])
+    #Cumulative deaths within each country
+    cum_deaths = np.cumsum(deaths)
+    cum_deaths = cum_deaths-np.repeat(np.append(0, cum_deaths[offsets[1:-1]-1]), np.diff(offsets))
+    rows = np.arange(len(deaths))
+    above = (cum_deaths>=min_deaths) & (rows<np.repeat(ends, np.diff(offsets)))
+    first_row = np.minimum.reduceat(np.where(above, rows, len(rows)), offsets[:-1])
+    death_index = np.where(first_row<ends, first_row-offsets[:-1], -1)
+    start = np.maximum(death_index-days_before, 0)
+
+    selected = np.array([store['country_index'][country] for country in countries], dtype=int)
+    missing = [country for country, index in zip(countries, death_index[selected]) if index < 0]
+    if missing:
+        raise ValueError('No day with at least '+str(min_deaths)+' cumulative deaths for: '+', '.join(missing))
+    return death_index[selected], start[selected]
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+'''Render stage for figures: each job is a plotting function with the arguments of one figure
+(only the arrays that figure needs), rendered on a process pool with the Agg backend.
+Figures are only redrawn if the hash of their inputs changed: the hashes of the figures
+in a plots directory are kept in its manifest (.figures.json).
+'''
+
+import os
+import json
+import time
+import inspect
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib.pyplot as plt
+import pandas as pd
+from mobility_data import write_json_atomic
+
+#Version of the figure hashes, increase when the hashing changes
+figure_cache_version = 1
+#Manifest of the figure hashes in each plots directory
+manifest_name = '.figures.json'
+
+def figure_job(outname, function, *args, inputs=()):
+    '''Get the job rendering one figure: function(*args) writes outname
+    inputs = files the figure is made from (e.g. composed svgs), hashed by content
+    '''
+    return {'outname':outname, 'function':function, 'args':args, 'inputs':list(inputs)}
+
+def hash_value(hasher, value):
+    '''Add a figure input to the hash: arrays and data frames by content, containers item by item, others by repr
+    '''
+    if isinstance(value, np.ndarray):
+        hasher.update(str((value.dtype.str, value.shape)).encode())
+        if value.dtype == object:
+            hasher.update(repr(value.tolist()).encode())
+        else:
+            hasher.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (pd.DataFrame, pd.Series)):
+        hasher.update(repr(list(value.columns) if isinstance(value, pd.DataFrame) else value.name).encode())
+        hasher.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+    elif isinstance(value, (list, tuple)):
+        hasher.update(b'[')
+        for item in value:
+            hash_value(hasher, item)
+        hasher.update(b']')
+    elif isinstance(value, dict):
+        hash_value(hasher, sorted((str(key), item) for key, item in value.items()))
+    else:
+        hasher.update(repr(value).encode())
+    hasher.update(b'\0')
+
+def job_hash(job):
+    '''Get the hash of everything a figure depends on: the source of the plotting function,
+    its arguments, the matplotlib settings and the content of the input files
+    '''
+    hasher = hashlib.sha1(str(figure_cache_version).encode())
+    try:
+        hasher.update(inspect.getsource(job['function']).encode())
+    except (OSError, TypeError):
+        hasher.update(job['function'].__qualname__.encode())
+    hash_value(hasher, job['args'])
+    hash_value(hasher, {key:repr(value) for key, value in plt.rcParams.items() if key != 'backend'})
+    for path in job['inputs']:
+        with open(path, 'rb') as fh:
+            hasher.update(hashlib.sha1(fh.read()).digest())
+    return hasher.hexdigest()
+
+def read_manifest(plots_dir):
+    '''Read the figure hashes of a plots directory (figure file name -> hash), empty if there are none
+    '''
+    try:
+        with open(os.path.join(plots_dir, manifest_name)) as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != figure_cache_version:
+        return {}
+    return manifest['figures']
+
+def use_agg():
+    '''Render without a display
+    '''
+    plt.switch_backend('Agg')
+
+def render_job(job):
+    '''Render one figure, returns the figure and the seconds it took
+    '''
+    start = time.perf_counter()
+    job['function'](*job['args'])
+    plt.close('all')
+    return job['outname'], time.perf_counter()-start
+
+def render_figures(jobs, n_jobs=None, timings_file=None, force=False):
+    '''Render the figure jobs on n_jobs processes (default all cores, 1 renders in this process).
+    The workers are forked, so that plotting functions defined in the calling script
+    and the matplotlib settings are inherited.
+    Figures that exist with the same hash in the manifest of their directory are skipped, unless force.
+    Returns the seconds per rendered figure, also written to timings_file if given.
+    '''
+    n_jobs = n_jobs or os.cpu_count()
+    start = time.perf_counter()
+    #Skip the figures that are up to date
+    manifests = {}
+    hashes = {}
+    outdated = []
+    for job in jobs:
+        plots_dir = os.path.dirname(os.path.abspath(job['outname']))
+        if plots_dir not in manifests:
+            manifests[plots_dir] = read_manifest(plots_dir)
+        hashes[job['outname']] = job_hash(job)
+        if force or not os.path.exists(job['outname']) or manifests[plots_dir].get(os.path.basename(job['outname'])) != hashes[job['outname']]:
+            outdated.append(job)
+    skipped = len(jobs)-len(outdated)
+    jobs = outdated
+
+    if n_jobs == 1 or len(jobs) < 2:
+        use_agg()
+        timings = [render_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(jobs)), mp_context=multiprocessing.get_context('fork'), initializer=use_agg) as executor:
+            timings = list(executor.map(render_job, jobs))
+    #Record the hashes of the rendered figures
+    for outname, seconds in timings:
+        plots_dir = os.path.dirname(os.path.abspath(outname))
+        manifests[plots_dir][os.path.basename(outname)] = hashes[outname]
+    for plots_dir in manifests:
+        write_json_atomic({'version':figure_cache_version, 'figures':manifests[plots_dir]}, os.path.join(plots_dir, manifest_name))
+
+    timings = pd.DataFrame(timings, columns=['figure', 'seconds'])
+    if timings_file is not None:
+        timings.to_csv(timings_file, index=False)
+    print('Skipped', skipped, 'up to date figures, rendered', len(timings), 'figures in', round(time.perf_counter()-start, 2), 's on', n_jobs, 'processes,',
+          round(timings['seconds'].sum(), 2), 's in total, slowest', timings.loc[timings['seconds'].idxmax(), 'figure'] if len(timings) else '')
+    return timings
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+'''Forecast skill from forecast.csv (forecast_analysis.py) of one or several forecast origins (End date).
+The last horizon days of each country and origin are pivoted into country x origin x horizon arrays,
+on which the error, absolute and percent error, interval coverage and the weighted interval score (WIS, around Predicted 50)
+are computed at once, and returned as a tidy table with one row per country, origin and horizon.
+'''
+
+import re
+import numpy as np
+import pandas as pd
+
+#Columns of the forecast that are pivoted besides the intervals
+point_columns = ['Predicted mean', 'Observed deaths']
+
+def interval_columns(columns):
+    '''Get the central intervals in the forecast columns (e.g. Predicted 2.5 and Predicted 97.5)
+    Returns {level: (lower column, upper column)}, e.g. {0.95: ('Predicted 2.5', 'Predicted 97.5')}
+    '''
+    quantiles = {}
+    for column in columns:
+        match = re.fullmatch(r'Predicted (\d+(?:\.\d+)?)', column)
+        if match:
+            quantiles[round(float(match.group(1)), 6)] = column
+    intervals = {}
+    for quantile in sorted(quantiles):
+        if quantile < 50 and round(100-quantile, 6) in quantiles:
+            intervals[round((100-2*quantile)/100, 6)] = (quantiles[quantile], quantiles[round(100-quantile, 6)])
+    return intervals
+
+def forecast_cube(forecast_df, horizon):
+    '''Pivot the last horizon days of each country and origin (End date) into country x origin x horizon arrays
+    Returns {column: array}, the countries and the origins. Missing days are NaN.
+    '''
+    forecast_df = forecast_df.sort_values(['Country', 'End date', 'Date'])
+    #Days from the end of each country and origin, 0 = last
+    from_end = forecast_df.groupby(['Country', 'End date']).cumcount(ascending=False).values
+    forecast_df = forecast_df[from_end < horizon]
+    h = horizon-1-from_end[from_end < horizon]
+    c, countries = pd.factorize(forecast_df['Country'], sort=True)
+    o, origins = pd.factorize(forecast_df['End date'], sort=True)
+    intervals = interval_columns(forecast_df.columns)
+    columns = point_columns+[column for level in intervals for column in intervals[level]]
+    if 'Predicted 50' in forecast_df.columns:
+        columns.append('Predicted 50')
+    cube = {}
+    for column in columns:
+        cube[column] = np.full((len(countries), len(origins), horizon), np.nan)
+        cube[column][c, o, h] = forecast_df[column].values.astype(float)
+    return cube, list(countries), list(origins)
+
+def interval_score(lower, upper, observed, level):
+    '''Get the interval score of the central interval of a credible level
+    '''
+    alpha = 1-level
+    return (upper-lower)+2/alpha*np.maximum(lower-observed, 0)+2/alpha*np.maximum(observed-upper, 0)
+
+def weighted_interval_score(cube, intervals):
+    '''Get the weighted interval score of the intervals and the median (Predicted 50), NaN without the median
+    '''
+    observed = cube['Observed deaths']
+    if 'Predicted 50' not in cube:
+        return np.full(observed.shape, np.nan)
+    median = cube['Predicted 50']
+    score = 0.5*np.abs(observed-median)
+    for level in intervals:
+        lower, upper = intervals[level]
+        score = score+(1-level)/2*interval_score(cube[lower], cube[upper], observed, level)
+    return score/(len(intervals)+0.5)
+
+def forecast_skill(forecast_df, horizon):
+    '''Get the skill of the forecasts of horizon days, one row per country, origin and horizon (day from 1):
+    the error (mean - observed), the absolute and absolute percent error, whether each interval
+    covers the observed deaths (coverage 95 % etc.) and the WIS
+    '''
+    cube, countries, origins = forecast_cube(forecast_df, horizon)
+    intervals = interval_columns(cube.keys())
+    observed = cube['Observed deaths']
+    error = cube['Predicted mean']-observed
+    metrics = {'Error':error, 'Absolute error':np.abs(error)}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        metrics['Absolute percent error'] = np.where(observed > 0, 100*np.abs(error)/observed, np.nan)
+    for level in intervals:
+        lower, upper = intervals[level]
+        covered = (cube[lower] <= observed) & (observed <= cube[upper])
+        metrics['Coverage {:g}'.format(level*100)] = np.where(np.isnan(observed), np.nan, covered)
+    metrics['WIS'] = weighted_interval_score(cube, intervals)
+
+    index = pd.MultiIndex.from_product([countries, origins, np.arange(1, horizon+1)], names=['Country', 'End date', 'Horizon'])
+    table = pd.DataFrame({name:metrics[name].ravel() for name in metrics}, index=index).reset_index()
+    table.insert(3, 'Week', (table['Horizon']-1)//7+1)
+    return table[~np.isnan(observed.ravel())].reset_index(drop=True)
+
+def summarize_skill(table, by=['Country', 'Week']):
+    '''Average the skill per group: the bias (mean error), MAE, MAPE, the coverage of each interval and the mean WIS
+    '''
+    summary = table.groupby(by).mean(numeric_only=True).drop(columns=['Horizon', 'Week'], errors='ignore')
+    return summary.rename(columns={'Error':'Bias', 'Absolute error':'MAE', 'Absolute percent error':'MAPE'})
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+'''Proper scores of the observed deaths under the posterior predictive distribution of a fit,
+computed from the saved draws of E_deaths and phi (draw_store):
+CRPS from predictive samples deaths ~ neg_binomial_2(E_deaths, phi), one per draw, with the
+sorted-sample formulation (O(draws log draws) per day and country instead of O(draws^2)), and
+the log score log(mean over draws of neg_binomial_2(deaths | E_deaths, phi)).
+The draws are read one country and chunk_days days at a time.
+'''
+
+import os
+import numpy as np
+import pandas as pd
+from scipy.special import logsumexp
+from draw_store import read_draws
+from renewal import neg_binomial_2_log_lpmf, read_phi
+
+#Days read at a time per country
+chunk_days = 50
+
+def crps_samples(samples, observed):
+    '''Get the CRPS of the observed values (dims) given samples (samples x dims):
+    mean|X-y| - 1/2 mean|X-X'|, where sum|Xi-Xj| over all pairs of the sorted samples
+    x(1) <= ... <= x(n) is 2*sum((2i-n-1)*x(i))
+    '''
+    samples = np.asarray(samples, dtype=float)
+    n = len(samples)
+    weights = (2*np.arange(1, n+1)-n-1).reshape((n,)+(1,)*(samples.ndim-1))
+    spread = np.sum(weights*np.sort(samples, axis=0), axis=0)/n**2
+    return np.mean(np.abs(samples-observed), axis=0)-spread
+
+def log_score(observed, expected, phi):
+    '''Get the log predictive density of the observed deaths (dims) given draws x dims expected deaths
+    and the phi of each draw, averaging the negative binomial over the draws
+    '''
+    phi = phi.reshape((len(phi),)+(1,)*(expected.ndim-1))
+    eta = np.log(np.maximum(expected, 1e-12))
+    return logsumexp(neg_binomial_2_log_lpmf(observed, eta, phi), axis=0)-np.log(len(phi))
+
+def predictive_samples(expected, phi, rng):
+    '''Draw one neg_binomial_2(expected, phi) sample per draw of the expected deaths (draws x dims)
+    '''
+    phi = phi.reshape((len(phi),)+(1,)*(expected.ndim-1))
+    return rng.negative_binomial(phi, phi/(phi+np.maximum(expected, 1e-12)))
+
+def score_draws(outdir, deaths, days_by_country, chunk_days=chunk_days, seed=0):
+    '''Get the CRPS and the log score of the observed deaths (days x countries)
+    for the first days_by_country days of each country, NaN after.
+    Returns {'CRPS': array, 'Log score': array} of days x countries
+    '''
+    phi = read_phi(outdir)
+    rng = np.random.default_rng(seed)
+    deaths = np.asarray(deaths, dtype=float)
+    scores = {'CRPS':np.full(deaths.shape, np.nan), 'Log score':np.full(deaths.shape, np.nan)}
+    for m in range(deaths.shape[1]):
+        end = int(days_by_country[m])
+        for start in range(0, end, chunk_days):
+            days = slice(start, min(start+chunk_days, end))
+            expected = np.asarray(read_draws(outdir, 'E_deaths', country=m, days=days), dtype=float)
+            observed = deaths[days, m]
+            scores['CRPS'][days, m] = crps_samples(predictive_samples(expected, phi, rng), observed)
+            scores['Log score'][days, m] = log_score(observed, expected, phi)
+    return scores
+
+def write_scores(outdir, countries, dates, deaths, days_by_country, forecast_start, chunk_days=chunk_days, seed=0):
+    '''Score the observed deaths of a run (score_draws) and write them to outdir/scores.csv,
+    one row per country and day, Forecast = the day is on or after forecast_start (not fitted)
+    '''
+    scores = score_draws(outdir, deaths, days_by_country, chunk_days, seed)
+    days = np.arange(len(dates))[:,np.newaxis]
+    rows = days < np.asarray(days_by_country, dtype=int)[np.newaxis,:]
+    day, country = np.nonzero(rows.T)[::-1]
+    dates = np.asarray(dates)
+    table = pd.DataFrame({'Country':np.asarray(countries)[country], 'Date':dates[day, country],
+                          'Observed deaths':np.asarray(deaths)[day, country],
+                          'Forecast':dates[day, country] >= np.datetime64(forecast_start, 'D'),
+                          'CRPS':scores['CRPS'][day, country], 'Log score':scores['Log score'][day, country]})
+    table.to_csv(os.path.join(outdir, 'scores.csv'), index=False)
+    return table
@@ -0,0 +1,120 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import sys
+import os
+import json
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+from mobility_data import write_json_atomic
+from stan_models import sampling_profiles, available_cores
+
+import pdb
+
+
+
+#Arguments for argparse module:
+parser = argparse.ArgumentParser(description = '''Fit the mobility model for all leave one out country combinations
+as parallel processes within a core budget. The fit of combination n is written to outdir/COMBOn/,
+the combinations to outdir/country_combos.csv and the state of each fit to outdir/manifest.json.
+Rerunning resumes the combinations that were not finished.''')
+
+parser.add_argument('--datadir', nargs=1, type= str, default=sys.stdin, help = 'Path to datadir.')
+parser.add_argument('--countries', nargs=1, type= str, default=sys.stdin, help = 'Countries to leave out one at a time (csv).')
+parser.add_argument('--stan_model', nargs=1, type= str, default=sys.stdin, help = 'Stan model.')
+parser.add_argument('--days_to_simulate', nargs=1, type= int, default=sys.stdin, help = 'Number of days to simulate.')
+parser.add_argument('--end_date', nargs=1, type= str, default=sys.stdin, help = 'Up to which date to include data.')
+parser.add_argument('--outdir', nargs=1, type= str, default=sys.stdin, help = 'Path to outdir.')
+parser.add_argument('--profile', nargs=1, type= str, default=['production'], choices=[*sampling_profiles], help = 'Sampling profile of each fit.')
+parser.add_argument('--outputs', nargs=1, type= str, default=[None], help = 'Variables to keep in each fit (csv), see mobility_model.py. Default all.')
+parser.add_argument('--cores', nargs=1, type= int, default=[None], help = 'Core budget for all fits together. Default all available.')
+
+###FUNCTIONS###
+
+def leave_one_out_combos(countries):
+        '''Get all combinations of the countries with one country left out, in the order of the countries
+        '''
+        return [[country for country in countries if country != left_out] for left_out in countries]
+
+def read_manifest(manifest_file, combos):
+        '''Read the manifest of an earlier sweep, or start a new one if there is none
+        or it was made for other combinations
+        '''
+        try:
+            with open(manifest_file) as fh:
+                manifest = json.load(fh)
+            if manifest['combos'] == combos:
+                return manifest
+        except (OSError, ValueError, KeyError):
+            pass
+        return {'combos':combos, 'status':['pending']*len(combos), 'seconds':[None]*len(combos)}
+
+def fit_combo(combo_outdir, countries, args, n_jobs):
+        '''Fit one combination with mobility_model.py, logging to combo_outdir/fit.log
+        '''
+        os.makedirs(combo_outdir, exist_ok=True)
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mobility_model.py'),
+                  '--datadir', args.datadir[0], '--countries', ','.join(countries),
+                  '--stan_model', args.stan_model[0], '--days_to_simulate', str(args.days_to_simulate[0]),
+                  '--end_date', args.end_date[0], '--outdir', combo_outdir,
+                  '--profile', args.profile[0], '--n_jobs', str(n_jobs)]
+        if args.outputs[0]:
+            command += ['--outputs', args.outputs[0]]
+        start = time.time()
+        with open(os.path.join(combo_outdir, 'fit.log'), 'w') as log:
+            returncode = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT).returncode
+        return returncode, time.time()-start
+
+def run_sweep(args):
+        '''Run all unfinished combinations with at most cores // chains fits at the same time.
+        Each fit is a separate mobility_model.py process, the threads here only wait for them.
+        '''
+        outdir = args.outdir[0]
+        os.makedirs(outdir, exist_ok=True)
+        combos = leave_one_out_combos(args.countries[0].split(','))
+        #Read by leave_one_out_analysis.py, row n = COMBOn+1
+        pd.DataFrame(combos).to_csv(os.path.join(outdir, 'country_combos.csv'), header=False, index=False)
+        manifest_file = os.path.join(outdir, 'manifest.json')
+        manifest = read_manifest(manifest_file, combos)
+
+        #Each fit runs one chain per core
+        chains = sampling_profiles[args.profile[0]]['chains']
+        cores = args.cores[0] or available_cores()
+        n_jobs = min(chains, cores)
+        workers = max(1, cores//n_jobs)
+        todo = [i for i in range(len(combos)) if manifest['status'][i] != 'done'
+                or not os.path.exists(os.path.join(outdir, 'COMBO'+str(i+1), 'summary.csv'))]
+        print('Fitting', len(todo), 'of', len(combos), 'combinations,', workers, 'at a time with', n_jobs, 'cores each')
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for i in todo:
+                manifest['status'][i] = 'running'
+                futures[pool.submit(fit_combo, os.path.join(outdir, 'COMBO'+str(i+1))+'/', combos[i], args, n_jobs)] = i
+            write_json_atomic(manifest, manifest_file)
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    returncode, seconds = future.result()
+                    manifest['status'][i] = 'done' if returncode == 0 else 'failed'
+                    manifest['seconds'][i] = seconds
+                except Exception as error: #Keep running the other combinations
+                    print('COMBO'+str(i+1), error)
+                    manifest['status'][i] = 'failed'
+                print('COMBO'+str(i+1), manifest['status'][i])
+                #Record after each fit so that an interrupted sweep can be resumed
+                write_json_atomic(manifest, manifest_file)
+
+        return manifest
+
+#####MAIN#####
+args = parser.parse_args()
+manifest = run_sweep(args)
+failed = [i+1 for i in range(len(manifest['status'])) if manifest['status'][i] != 'done']
+if failed:
+    print('Failed combinations:', ','.join(['COMBO'+str(i) for i in failed]))
+    sys.exit(1)
@@ -0,0 +1,12 @@
+#!/bin/bash -l
+
+DATADIR=/home/patrick/COVID19.github.io/simulations/mobility/data/
+COUNTRIES="Austria,Belgium,Denmark,France,Germany,Italy,Norway,Spain,Sweden,Switzerland,United_Kingdom"
+STAN_MODEL=/home/patrick/COVID19.github.io/simulations/mobility/mobility.stan
+DTS=84 #Days to simulate
+ED=2020-04-19 #End date, up to which to include data
+OUTDIR=/home/patrick/COVID19.github.io/simulations/mobility/model_output/R0_2_79/LOO/
+#Fit all leave one out combinations (COMBO1..COMBO11) within the core budget, rerun to resume
+/home/patrick/COVID19.github.io/simulations/mobility/leave_one_out.py --datadir $DATADIR --countries $COUNTRIES --stan_model $STAN_MODEL --days_to_simulate $DTS --end_date $ED --outdir $OUTDIR
+#Compare the countries over all combinations
+/home/patrick/COVID19.github.io/simulations/mobility/analysis/leave_one_out_analysis.py --datadir $DATADIR --country_combos $OUTDIR'country_combos.csv' --days_to_simulate $DTS --outdir $OUTDIR
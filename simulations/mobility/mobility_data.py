@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+'''Shared handling of the Google mobility report (Global_Mobility_Report.csv)
+'''
+
+import os
+import json
+import hashlib
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+
+#Covariate names in the Google mobility report, in the order used by the stan models (covariate1-5)
+covariate_names = ['retail_and_recreation_percent_change_from_baseline',
+                   'grocery_and_pharmacy_percent_change_from_baseline',
+                   'transit_stations_percent_change_from_baseline',
+                   'workplaces_percent_change_from_baseline',
+                   'residential_percent_change_from_baseline']
+
+#Columns used by the model builders and visualizations
+model_columns = ['country_region', 'sub_region_1', 'sub_region_2', 'date']+covariate_names
+#Columns stored as categories in the columnar cache
+categorical_columns = ['country_region_code', 'country_region', 'sub_region_1', 'sub_region_2']
+#Increase if the layout of the columnar cache changes
+cache_version = 1
+
+#ECDC country names that differ from the Google country_region names
+region_translations = {'United_Kingdom':'United Kingdom'}
+
+def mobility_region_name(country):
+    '''Get the Google country_region name for an ECDC country name
+    '''
+    if country in region_translations:
+        return region_translations[country]
+    return ' '.join(country.split('_'))
+
+def join_covariates(mobility_data, regions, dates_by_region, covariate_names=covariate_names, region_column='country_region'):
+    '''Join the mobility covariates to the dates of each region in one join.
+    mobility_data = mobility rows at the wanted level (e.g. sub_region_1 missing for whole countries)
+    regions = names in region_column, one per modeled region (column in the output)
+    dates_by_region = the dates of each region, from its first modeled day
+    Returns a dict with a days x M matrix per covariate (the change /100 rounded to 2 decimals, NaN where missing)
+    and the days x M matrix of the days with a mobility row
+    '''
+    M = len(regions)
+    N = np.array([len(dates) for dates in dates_by_region])
+    #All (region, date) pairs to model
+    days = pd.DataFrame({region_column:np.repeat(np.array(regions, dtype=object), N),
+                        'date':pd.to_datetime(np.concatenate([np.asarray(dates, dtype='datetime64[D]') for dates in dates_by_region])),
+                        'region_index':np.repeat(np.arange(M), N),
+                        'day':np.concatenate([np.arange(n) for n in N])})
+    #One row per (region, date) - keep the first as the old per-date lookup did
+    region_data = mobility_data[mobility_data[region_column].isin(regions)]
+    region_data = region_data.drop_duplicates(subset=[region_column,'date'])[[region_column,'date']+covariate_names]
+    region_data['observed'] = True
+    days['date'] = days['date'].astype(region_data['date'].dtype)
+    days = days.merge(region_data, on=[region_column,'date'], how='left', sort=False)
+    index = (days['day'].values, days['region_index'].values)
+
+    observed = np.zeros((N.max(initial=0), M), dtype=bool)
+    observed[index] = days['observed'].eq(True).values
+    joined = {}
+    for name in covariate_names:
+        joined[name] = np.full(observed.shape, np.nan)
+        joined[name][index] = np.round(days[name].values.astype(float)/100, 2)
+    return joined, observed
+
+def fill_covariates(joined, observed, N, N2):
+    '''Fill the joined covariates (join_covariates) over the first N[m] days of each region and the forecast (N:N2).
+    Returns a dict with an N2xM matrix per covariate: missing values are 0,
+    the last observed mobility value (before N[m]) is used for all later dates and the forecast.
+    The same join can be filled for several N, e.g. forecast origins with the same start dates.
+    '''
+    M = observed.shape[1]
+    rows = min(len(observed), N2)
+    days = np.arange(N2)[:,np.newaxis]
+    in_range = np.zeros((N2, M), dtype=bool)
+    in_range[:rows] = observed[:rows]
+    in_range &= days < np.asarray(N)[np.newaxis,:]
+    #Last day with mobility data per region, -1 if there is none
+    last_observed = np.where(in_range.any(axis=0), N2-1-np.argmax(in_range[::-1], axis=0), -1)
+
+    covariates = {}
+    for name in joined:
+        change = np.zeros((N2, M))
+        change[:rows] = np.nan_to_num(joined[name][:rows])
+        #Carry the latest available mobility data to all remaining days
+        last_change = np.where(last_observed >= 0, change[np.maximum(last_observed, 0), np.arange(M)], 0)
+        covariates[name] = np.where(days > last_observed[np.newaxis,:], last_change[np.newaxis,:], change)
+    return covariates
+
+def align_covariates(mobility_data, regions, dates_by_region, N2, covariate_names=covariate_names, region_column='country_region'):
+    '''Align the mobility covariates to the modeled days of each region in one join (join_covariates, fill_covariates).
+    dates_by_region = the observed dates (N[m]) for each region
+    Returns a dict with an N2xM matrix per covariate:
+    the change is /100 and rounded to 2 decimals, missing values are 0,
+    the last observed mobility value is used for all later dates and the forecast (N:N2).
+    '''
+    joined, observed = join_covariates(mobility_data, regions, dates_by_region, covariate_names, region_column)
+    return fill_covariates(joined, observed, [len(dates) for dates in dates_by_region], N2)
+
+def file_hash(path):
+    '''Get the sha1 of the content of a file
+    '''
+    hasher = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1<<20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def write_json_atomic(obj, path):
+    '''Write json so that concurrent readers never see a partial file
+    '''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as fh:
+        json.dump(obj, fh)
+    os.replace(tmp_path, path)
+
+def source_hash(mobility_csv, cache_root):
+    '''Get the content hash of the mobility csv.
+    The hash is only recomputed when the size or modification time of the file changes.
+    '''
+    stat = os.stat(mobility_csv)
+    source_file = os.path.join(cache_root, 'source.json')
+    try:
+        with open(source_file) as fh:
+            source = json.load(fh)
+        if source['size'] == stat.st_size and source['mtime_ns'] == stat.st_mtime_ns:
+            return source['sha1']
+    except (OSError, ValueError, KeyError):
+        pass
+    digest = file_hash(mobility_csv)
+    write_json_atomic({'size':stat.st_size, 'mtime_ns':stat.st_mtime_ns, 'sha1':digest}, source_file)
+    return digest
+
+def write_columnar_cache(mobility_data, cache_dir):
+    '''Write one .npy per column (categorical codes + categories, datetime64[D] dates, float32 changes)
+    '''
+    cache_root = os.path.dirname(cache_dir)
+    tmp_dir = tempfile.mkdtemp(dir=cache_root)
+    columns = []
+    for name in mobility_data.columns:
+        column = mobility_data[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp_dir, name+'.npy'), column.cat.codes.values.astype(np.int32))
+            np.save(os.path.join(tmp_dir, name+'.categories.npy'), np.array(column.cat.categories, dtype=str))
+            columns.append({'name':name, 'kind':'categorical'})
+        elif name == 'date':
+            np.save(os.path.join(tmp_dir, name+'.npy'), column.values.astype('datetime64[D]'))
+            columns.append({'name':name, 'kind':'date'})
+        else:
+            np.save(os.path.join(tmp_dir, name+'.npy'), column.values)
+            columns.append({'name':name, 'kind':'numeric'})
+    with open(os.path.join(tmp_dir, 'columns.json'), 'w') as fh:
+        json.dump({'version':cache_version, 'columns':columns, 'rows':len(mobility_data)}, fh)
+    try:
+        os.rename(tmp_dir, cache_dir)
+    except OSError: #Written by a concurrent process
+        shutil.rmtree(tmp_dir)
+
+def read_columnar_cache(cache_dir, columns=None, rows=None):
+    '''Read the wanted columns from the columnar cache (memory-mapped)
+    rows = indices of the rows to read, all if None
+    '''
+    with open(os.path.join(cache_dir, 'columns.json')) as fh:
+        layout = json.load(fh)
+    mobility_data = {}
+    for column in layout['columns']:
+        name = column['name']
+        if columns is not None and name not in columns:
+            continue
+        values = np.load(os.path.join(cache_dir, name+'.npy'), mmap_mode='r')
+        if rows is not None:
+            values = values[rows]
+        if column['kind'] == 'categorical':
+            categories = np.load(os.path.join(cache_dir, name+'.categories.npy'))
+            values = pd.Categorical.from_codes(values, categories=categories)
+        mobility_data[name] = values
+    return pd.DataFrame(mobility_data)
+
+def read_mobility_data(mobility_csv, columns=None):
+    '''Read the Google mobility report through a columnar cache next to the csv.
+    On first use (per file content) the csv is parsed once and written as
+    one .npy per column, later reads only memory-map the wanted columns.
+    columns = the columns to read, all if None
+    '''
+    csv_dir, csv_name = os.path.split(os.path.abspath(mobility_csv))
+    cache_root = os.path.join(csv_dir, '.'+csv_name+'.cache')
+    os.makedirs(cache_root, exist_ok=True)
+    cache_dir = os.path.join(cache_root, source_hash(mobility_csv, cache_root)+'_v'+str(cache_version))
+    if not os.path.exists(os.path.join(cache_dir, 'columns.json')):
+        mobility_data = pd.read_csv(mobility_csv, dtype={name:'category' for name in categorical_columns}, low_memory=False)
+        #Convert to datetime
+        mobility_data['date'] = pd.to_datetime(mobility_data['date'])
+        for name in mobility_data.columns:
+            if name.endswith('_percent_change_from_baseline'):
+                mobility_data[name] = mobility_data[name].astype(np.float32)
+        write_columnar_cache(mobility_data, cache_dir)
+    return read_columnar_cache(cache_dir, columns)
+
+#Mobility rows per level of the report
+mobility_levels = ['country', 'sub_region_1', 'sub_region_2']
+#Rows parsed at a time when streaming the csv
+chunk_rows = 200000
+
+def select_rows(mobility_data, countries=None, level=None, start_date=None, end_date=None):
+    '''Get a mask of the rows in the wanted countries (country_region),
+    at the wanted level (whole country, sub_region_1 or sub_region_2)
+    and within start_date-end_date (inclusive). None = no filter.
+    '''
+    mask = np.ones(len(mobility_data), dtype=bool)
+    if countries is not None:
+        mask &= mobility_data['country_region'].isin(countries).values
+    if level is not None:
+        if level not in mobility_levels:
+            raise ValueError('Unknown mobility level '+str(level)+', use one of '+', '.join(mobility_levels))
+        sub_region_1 = mobility_data['sub_region_1'].isna().values
+        sub_region_2 = mobility_data['sub_region_2'].isna().values
+        if level == 'country':
+            mask &= sub_region_1
+        elif level == 'sub_region_1':
+            mask &= ~sub_region_1 & sub_region_2
+        else:
+            mask &= ~sub_region_2
+    if start_date is not None:
+        mask &= (mobility_data['date'] >= pd.Timestamp(start_date)).values
+    if end_date is not None:
+        mask &= (mobility_data['date'] <= pd.Timestamp(end_date)).values
+    return mask
+
+def read_mobility_slice(mobility_csv, countries=None, level=None, start_date=None, end_date=None, columns=None):
+    '''Read only the rows of the mobility report selected as in select_rows.
+    If the columnar cache exists only the filter columns are scanned (memory-mapped),
+    otherwise the csv is streamed in chunks of chunk_rows and filtered while parsing,
+    so that the memory used is bounded by the selected rows, not the file.
+    columns = the columns to read, all if None
+    '''
+    filter_columns = ['country_region', 'sub_region_1', 'sub_region_2', 'date']
+    csv_dir, csv_name = os.path.split(os.path.abspath(mobility_csv))
+    cache_root = os.path.join(csv_dir, '.'+csv_name+'.cache')
+    os.makedirs(cache_root, exist_ok=True)
+    cache_dir = os.path.join(cache_root, source_hash(mobility_csv, cache_root)+'_v'+str(cache_version))
+    if os.path.exists(os.path.join(cache_dir, 'columns.json')):
+        rows = np.flatnonzero(select_rows(read_columnar_cache(cache_dir, filter_columns), countries, level, start_date, end_date))
+        return read_columnar_cache(cache_dir, columns, rows)
+
+    chunks = []
+    for chunk in pd.read_csv(mobility_csv, dtype={name:str for name in categorical_columns}, chunksize=chunk_rows,
+                            usecols=None if columns is None else lambda name: name in columns or name in filter_columns):
+        #Convert to datetime
+        chunk['date'] = pd.to_datetime(chunk['date'])
+        chunk = chunk[select_rows(chunk, countries, level, start_date, end_date)]
+        if columns is not None:
+            chunk = chunk[[name for name in chunk.columns if name in columns]]
+        chunks.append(chunk)
+    mobility_data = pd.concat(chunks, ignore_index=True)
+    for name in mobility_data.columns:
+        if name in categorical_columns:
+            mobility_data[name] = mobility_data[name].astype('category')
+        elif name.endswith('_percent_change_from_baseline'):
+            mobility_data[name] = mobility_data[name].astype(np.float32)
+    return mobility_data
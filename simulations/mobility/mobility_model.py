@@ -13,6 +13,14 @@ from scipy.stats import gamma
 import numpy as np
 import seaborn as sns
 import pystan
+from epidemic_data import read_epidemic_data, country_data, epidemic_starts
+from delay_kernels import serial_interval_distribution, death_kernels
+from draw_store import write_draws
+from approximate import vb_algorithms, fit_vb
+from stan_models import compiled_model, sampling_profiles, sampling_settings, write_sampling_settings, output_pars, warm_start, write_adaptation
+from mobility_data import model_columns, read_mobility_slice, covariate_names, mobility_region_name, join_covariates, fill_covariates
+from stan_data_bundle import model_dates, write_stan_data, read_stan_data
+from renewal import write_counterfactual
 
 import pdb
 
@@ -25,55 +33,48 @@ parser.add_argument('--datadir', nargs=1, type= str, default=sys.stdin, help = '
 parser.add_argument('--countries', nargs=1, type= str, default=sys.stdin, help = 'Countries to model (csv).')
 parser.add_argument('--stan_model', nargs=1, type= str, default=sys.stdin, help = 'Stan model.')
 parser.add_argument('--days_to_simulate', nargs=1, type= int, default=sys.stdin, help = 'Number of days to simulate.')
-parser.add_argument('--end_date', nargs=1, type= str, default=sys.stdin, help = 'Up to which date to include data.')
+parser.add_argument('--end_date', nargs=1, type= str, default=sys.stdin, help = 'Up to which date to include data. Several end dates (csv) are written to one outdir per end date (outdir/YYYY-MM-DD/).')
 parser.add_argument('--outdir', nargs=1, type= str, default=sys.stdin, help = 'Path to outdir.')
+parser.add_argument('--profile', nargs=1, type= str, default=['production'], choices=[*sampling_profiles], help = 'Sampling profile (iterations, chains, thinning and control settings).')
+parser.add_argument('--n_jobs', nargs=1, type= int, default=[None], help = 'Max number of cores to use (one per chain, or shared out as threads per chain with --backend cmdstan). Default all available.')
+parser.add_argument('--outputs', nargs=1, type= str, default=[None], help = 'Variables to keep in the fit, summary and saved draws (csv), e.g. alpha,mu,phi,prediction,E_deaths,Rt. Default all.')
+parser.add_argument('--warm_start', nargs=1, type= str, default=[None], help = 'Outdir of an earlier fit of the same countries to initialize the chains from, with a shorter warmup. With several end dates, each later end date starts from the fit of the previous one.')
+parser.add_argument('--backend', nargs=1, type= str, default=['nuts'], choices=['nuts', 'cmdstan']+vb_algorithms, help = 'Inference: nuts (MCMC), cmdstan (MCMC with CmdStan, several threads per chain for reduce_sum models, e.g. mobility_reduce_sum.stan) or approximate ADVI (meanfield or fullrank) with as many draws as the sampling profile.')
+parser.add_argument('--counterfactual', action='store_true', help = 'Also compute the counterfactual without mobility changes (prediction0, E_deaths0, lp0, lp1) from the draws after the fit (needs mu, alpha, y and phi in --outputs).')
+parser.add_argument('--prepare_only', action='store_true', help = 'Only write the stan_data for each end date, do not fit.')
+parser.add_argument('--from_bundle', action='store_true', help = 'Fit the stan_data written to the outdir of each end date (e.g. with --prepare_only) instead of reading the data.')
 
 ###FUNCTIONS###
 
-###DISTRIBUTIONS###
-def conv_gamma_params(mean,std):
-        '''Returns converted shape and scale params
-        shape (α) = 1/std^2
-        scale (β) = mean/shape
+def read_data(datadir, countries, end_dates):
+        '''Read in the data shared by all forecast origins (end_dates) once
         '''
-        shape = 1/(std*std)
-        scale = mean/shape
 
-        return shape,scale
-
-def infection_to_death():
-        '''Simulate the time from infection to death: Infection --> Onset --> Death'''
-        #Infection to death: sum of ito and otd
-        itd_shape, itd_scale = conv_gamma_params((5.1+18.8), (0.45))
-        itd = gamma(a=itd_shape, scale = itd_scale) #a=shape
-        return itd
-
-def serial_interval_distribution(N2):
-        '''Models the the time between when a person gets infected and when
-        they subsequently infect another other people
-        '''
-        serial_shape, serial_scale = conv_gamma_params(6.5,0.62)
-        serial = gamma(a=serial_shape, scale = serial_scale) #a=shape
-
-        return serial.pdf(np.arange(1,N2+1))
-
-def read_and_format_data(datadir, countries, N2, end_date):
-        '''Read in and format all data needed for the model
+        #Get epidemic data, grouped and sorted per country
+        epidemic_data = read_epidemic_data(datadir+'ecdc_20200429.csv')
+        #Mobility data from Google, whole country - no subregion, up to the last end_date
+        country_mobility_data = read_mobility_slice(datadir+'Global_Mobility_Report.csv', [mobility_region_name(country) for country in countries],
+                                                    'country', end_date=max(end_dates), columns=model_columns)
+        # get CFR
+        cfr_by_country = pd.read_csv(datadir+"weighted_fatality.csv")
+        #Join the covariates once to the dates up to the last end_date. The modeled days of an
+        #earlier end_date start on the same date (the first day with 10 deaths), so they are a prefix of these
+        death_indices, start_rows = epidemic_starts(epidemic_data, countries, max(end_dates))
+        dates_by_country = [country_data(epidemic_data, countries[c], max(end_dates), start_rows[c])['dateRep'] for c in range(len(countries))]
+        covariates, observed = join_covariates(country_mobility_data, [mobility_region_name(country) for country in countries],
+                                            dates_by_country, covariate_names)
+        return {'epidemic_data':epidemic_data, 'cfr_by_country':cfr_by_country, 'covariates':covariates, 'covariate_observed':observed}
+
+def format_data(data, countries, N2, end_date):
+        '''Format all data needed for the model with data up to end_date
+        data = the data read by read_data
         N2 = number of days to model
         '''
 
-        #Get epidemic data
-        epidemic_data = pd.read_csv(datadir+'ecdc_20200429.csv')
-
-        epidemic_data['dateRep'] = pd.to_datetime(epidemic_data['dateRep'], format='%d/%m/%Y')
-        #Select all data up to end_date
-        epidemic_data = epidemic_data[epidemic_data['dateRep']<=end_date]
-        #Mobility data
-        mobility_data = pd.read_csv(datadir+'Global_Mobility_Report.csv')
-        #Convert to datetime
-        mobility_data['date']=pd.to_datetime(mobility_data['date'], format='%Y/%m/%d')
-        # get CFR
-        cfr_by_country = pd.read_csv(datadir+"weighted_fatality.csv")
+        epidemic_data = data['epidemic_data']
+        cfr_by_country = data['cfr_by_country']
+        #Get the days with at least 10 deaths and 30 days before, using all data up to end_date
+        death_indices, start_rows = epidemic_starts(epidemic_data, countries, end_date)
         #SI
         serial_interval = serial_interval_distribution(N2) #pd.read_csv(datadir+"serial_interval.csv")
 
@@ -99,37 +100,22 @@ def read_and_format_data(datadir, countries, N2, end_date):
                     'SI':serial_interval[0:N2],
                     'y':[] #index cases
                     }
-        #Infection to death distribution
-        itd = infection_to_death()
-        #Covariate names
-        covariate_names = ['retail_and_recreation_percent_change_from_baseline',
-       'grocery_and_pharmacy_percent_change_from_baseline',
-       'transit_stations_percent_change_from_baseline',
-       'workplaces_percent_change_from_baseline',
-       'residential_percent_change_from_baseline']
+        #Fatality rate per country, for the infection to death kernel
+        cfrs = []
         #Get data by country
         for c in range(len(countries)):
                 country = countries[c]
                 #Get fatality rate
                 cfr = cfr_by_country[cfr_by_country['Region, subregion, country or area *']==country]['weighted_fatality'].values[0]
-
-                #Get country epidemic data
-                country_epidemic_data = epidemic_data[epidemic_data['countriesAndTerritories']==country]
-                #Sort on date
-                country_epidemic_data = country_epidemic_data.sort_values(by='dateRep')
-                #Reset index
-                country_epidemic_data = country_epidemic_data.reset_index()
+                cfrs.append(cfr)
 
                 #Get all dates with at least 10 deaths
-                cum_deaths = country_epidemic_data['deaths'].cumsum()
-                death_index = cum_deaths[cum_deaths>=10].index[0]
+                death_index = death_indices[c]
                 di30 = death_index-30
                 #Add epidemic start to stan data
                 stan_data['EpidemicStart'].append(death_index+1-di30) #30 days before 10 deaths
-                #Get part of country_epidemic_data 30 days before day with at least 10 deaths
-                country_epidemic_data = country_epidemic_data.loc[di30:]
-                #Reset index
-                country_epidemic_data = country_epidemic_data.reset_index()
+                #Get country epidemic data from 30 days before day with at least 10 deaths, sorted on date
+                country_epidemic_data = country_data(epidemic_data, country, end_date, start_rows[c])
 
                 print(country, len(country_epidemic_data))
                 #Save dates
@@ -150,31 +136,6 @@ def read_and_format_data(datadir, countries, N2, end_date):
                     pdb.set_trace()
 
 
-                #Get hazard rates for all days in country data
-                h = np.zeros(N2) #N2 = N+forecast
-                f = np.cumsum(itd.pdf(np.arange(1,len(h)+1,0.5))) #Cumulative probability to die for each day
-                for i in range(1,len(h)):
-                    #for each day t, the death prob is the area btw [t-0.5, t+0.5]
-                    #divided by the survival fraction (1-the previous death fraction), (fatality ratio*death prob at t-0.5)
-                    #This will be the percent increase compared to the previous end interval
-                    h[i] = (cfr*(f[i*2+1]-f[i*2-1]))/(1-cfr*f[i*2-1])
-
-                #The number of deaths today is the sum of the past infections weighted by their probability of death,
-                #where the probability of death depends on the number of days since infection.
-                s = np.zeros(N2)
-                s[0] = 1
-                for i in range(1,len(s)):
-                    #h is the percent increase in death
-                    #s is thus the relative survival fraction
-                    #The cumulative survival fraction will be the previous
-                    #times the survival probability
-                    #These will be used to track how large a fraction is left after each day
-                    #In the end all of this will amount to the adjusted death fraction
-                    s[i] = s[i-1]*(1-h[i-1]) #Survival fraction
-
-                #Multiplying s and h yields fraction dead of fraction survived
-                f = s*h #This will be fed to the Stan Model
-                stan_data['f'][:,c]=f
 
                 #Number of cases
                 cases = np.zeros(N2)
@@ -188,62 +149,56 @@ def read_and_format_data(datadir, countries, N2, end_date):
                 deaths[:N]=np.array(country_epidemic_data['deaths'])
                 stan_data['deaths'][:,c]=deaths
 
-                #Covariates - assign the same shape as others (N2)
-                #Mobility data from Google
-                country_cov_data = mobility_data[mobility_data['country_region']==country]
-                if country == 'United_Kingdom': #Different assignments for UK
-                    country_cov_data = mobility_data[mobility_data['country_region']=='United Kingdom']
-                #Get whole country - no subregion
-                country_cov_data =  country_cov_data[country_cov_data['sub_region_1'].isna()]
-                #Get matching dates
-                country_cov_data = country_cov_data[country_cov_data['date'].isin(country_epidemic_data['dateRep'])]
-                end_date = max(country_cov_data['date']) #Last date for mobility data
-                for name in covariate_names:
-                    country_epidemic_data.loc[country_epidemic_data.index,name] = 0 #Set all to 0
-                    for d in range(len(country_epidemic_data)): #loop through all country data
-                        row_d = country_epidemic_data.loc[d]
-                        date_d = row_d['dateRep'] #Extract date
-                        try:
-                            change_d = np.round(float(country_cov_data[country_cov_data['date']==date_d][name].values[0])/100, 2) #Match mobility change on date
-                            if not np.isnan(change_d):
-                                country_epidemic_data.loc[d,name] = change_d #Add to right date in country data
-                        except:
-                            continue #Date too far ahead
-
+        #Infection to death kernel f = s*h for all countries at once
+        stan_data['f'] = death_kernels(cfrs, N2)
 
-                    #Add the latest available mobility data to all remaining days (including the forecast days)
-                    country_epidemic_data.loc[country_epidemic_data['dateRep']>=end_date, name]=change_d
-                    cov_i = np.zeros(N2)
-                    cov_i[:N] = np.array(country_epidemic_data[name])
-                    #Add covariate info to forecast
-                    cov_i[N:N2]=cov_i[N-1]
-                    stan_data[name][:,c] = cov_i
+        #Covariates - assign the same shape as others (N2), from the join shared by all end dates
+        covariates = fill_covariates(data['covariates'], data['covariate_observed'], stan_data['N'], N2)
+        for name in covariate_names:
+            stan_data[name] = covariates[name]
 
         #Rename covariates to match stan model
         for i in range(len(covariate_names)):
             stan_data['covariate'+str(i+1)] = stan_data.pop(covariate_names[i])
-        return stan_data
+        return stan_data, dates_by_country
 
 
 
-def simulate(stan_data, stan_model, outdir):
+def simulate(stan_data, stan_model, outdir, profile, n_jobs, outputs, warm_start_dir=None, backend='nuts'):
         '''Simulate using stan: Efficient MCMC exploration according to Bayesian posterior distribution
         for parameter estimation.
+        profile = name of the sampling profile
+        n_jobs = max number of cores to use
+        outputs = the variables to keep, all if None
+        warm_start_dir = outdir of an earlier fit to warm start from, None for random inits
+        backend = nuts, cmdstan (nuts with threads per chain, for reduce_sum models) or an approximate vb algorithm (same output layout)
         '''
 
-        sm =  pystan.StanModel(file=stan_model)
-        fit = sm.sampling(data=stan_data,iter=4000,warmup=2000,chains=8,thin=4, control={'adapt_delta': 0.98, 'max_treedepth': 10})
+        settings = sampling_settings(profile, {'adapt_delta': 0.98, 'max_treedepth': 10}, n_jobs, outputs)
+        if warm_start_dir is not None:
+            settings = warm_start(settings, profile, warm_start_dir, stan_model, stan_data['M'])
+        if backend == 'cmdstan':
+            #Optional dependency, only needed for this backend
+            from cmdstan_runner import chain_threads, simulate_cmdstan
+            settings['n_jobs'], settings['threads_per_chain'] = chain_threads(settings['chains'], n_jobs)
+        write_sampling_settings(profile, settings, outdir, warm_start_dir, backend)
+        if backend == 'cmdstan':
+            return simulate_cmdstan(stan_data, stan_model, outdir, settings)
+        sm = compiled_model(stan_model)
+        if backend != 'nuts':
+            #Approximate posterior with as many draws as the sampling profile
+            draws = settings['chains']*(settings['iter']-settings['warmup'])//settings['thin']
+            return fit_vb(sm, stan_data, outdir, backend, draws, settings['pars'])
+        fit = sm.sampling(data=stan_data, **settings)
+        write_adaptation(fit, stan_model, outdir)
         #Save summary
-        s = fit.summary()
+        s = fit.summary(pars=settings['pars'])
         summary = pd.DataFrame(s['summary'], columns=s['summary_colnames'], index=s['summary_rownames'])
         summary.to_csv(outdir+'summary.csv')
 
-        #Save fit - each parameter as np array
-        out = fit.extract()
-        for key in [*out.keys()]:
-            fit_param = out[key]
-            np.save(outdir+key+'.npy', fit_param)
-        return out
+        #Save fit - each parameter as np array (draws x dims)
+        write_draws(fit, outdir, settings['pars'])
+        return fit
 
 #####MAIN#####
 args = parser.parse_args()
@@ -251,10 +206,31 @@ datadir = args.datadir[0]
 countries = args.countries[0].split(',')
 stan_model = args.stan_model[0]
 days_to_simulate = args.days_to_simulate[0]
-end_date = np.datetime64(args.end_date[0])
+end_dates = [np.datetime64(end_date) for end_date in args.end_date[0].split(',')]
 outdir = args.outdir[0]
 
-#Read data
-stan_data = read_and_format_data(datadir, countries, days_to_simulate, end_date)
-#Simulate
-out = simulate(stan_data, stan_model, outdir)
+#Read data once for all end dates, unless fitting the saved stan_data
+if not args.from_bundle:
+    data = read_data(datadir, countries, end_dates)
+warm_start_dir = args.warm_start[0]
+for end_date in end_dates:
+    #One outdir per forecast origin if several
+    origin_outdir = outdir if len(end_dates)==1 else os.path.join(outdir, str(end_date))+'/'
+    if args.from_bundle:
+        stan_data, info = read_stan_data(origin_outdir, mmap_mode=None)
+        if info['countries'] != countries:
+            raise ValueError('The stan_data in '+origin_outdir+' is for other countries: '+','.join(info['countries']))
+    else:
+        stan_data, dates_by_country = format_data(data, countries, days_to_simulate, end_date)
+        #Save the data fed to stan for the forecast and visualization steps
+        write_stan_data(stan_data, origin_outdir, countries, model_dates([dates_by_country[country].values for country in countries], stan_data['N2']),
+                        end_date, covariate_names)
+        if args.prepare_only:
+            continue
+    #Simulate
+    fit = simulate(stan_data, stan_model, origin_outdir, args.profile[0], args.n_jobs[0], output_pars(args.outputs[0]), warm_start_dir, args.backend[0])
+    if args.counterfactual:
+        write_counterfactual(origin_outdir)
+    if warm_start_dir is not None:
+        #Start the next end date from this fit
+        warm_start_dir = origin_outdir
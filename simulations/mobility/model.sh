@@ -7,3 +7,5 @@ DTS=94 #Days to simulate
 OUTDIR=/home/patrick/COVID19.github.io/simulations/mobility/model_output/R0_2_79/3_week_forecast/
 ED=2020-04-08 #End date, up to which to include data (different depending on forecast)
 /home/patrick/COVID19.github.io/simulations/mobility/mobility_model.py --datadir $DATADIR --countries $COUNTRIES --stan_model $STAN_MODEL --days_to_simulate $DTS --end_date $ED --outdir $OUTDIR
+#Within-chain parallelism: the reduce_sum model with CmdStan, the cores shared out as threads per chain
+#/home/patrick/COVID19.github.io/simulations/mobility/mobility_model.py --datadir $DATADIR --countries $COUNTRIES --stan_model /home/patrick/COVID19.github.io/simulations/mobility/mobility_reduce_sum.stan --days_to_simulate $DTS --end_date $ED --outdir $OUTDIR --backend cmdstan --n_jobs 32
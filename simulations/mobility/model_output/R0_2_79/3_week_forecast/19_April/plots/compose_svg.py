@@ -8,133 +8,109 @@ import os
 import glob
 import pdb
 from svgutils.compose import *
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../../..'))
+from figure_render import figure_job, render_figures
 
 """Compose svg figures
+Each figure is a job with the svgs it is composed of as inputs, so that it is only
+composed again if one of them changed (see figure_render). The stages are rendered in order,
+as the country figures and markers are inputs to the publication figures.
 """
+#Arguments for argparse module:
+parser = argparse.ArgumentParser(description = '''Compose the publication figures from the svgs of the model output.''')
+parser.add_argument('--force', action='store_true', help = 'Compose all figures, also those with unchanged inputs.')
+
 countries =  ["Denmark", "Italy", "Germany","Spain", "United_Kingdom",
 "France", "Norway", "Belgium", "Austria", "Sweden", "Switzerland"]
 outdir='/home/patrick/COVID19.github.io/simulations/mobility/publication_figures/'
-def ind_country_format(country):
-    '''Compose cum cases, deaths per day and Rt
+icl_forecast='/home/patrick/COVID19.github.io/simulations/icl_model/model_output/3_week_forecast/plots/forecast/'
+
+def compose_tiles(svgs, width, height, columns, rows, outname):
+    '''Compose the svgs in a grid of columns x rows
+    '''
+    Figure(width, height, *[SVG(svg) for svg in svgs]).tile(columns, rows).save(outname)
+
+def compose_figure1(italy, sweden, markers, outname):
+    '''Compose Figure 1: Italy and Sweden above the markers
+    '''
+    Figure("18cm", "16cm",
+            Panel(
+                SVG(italy),Text("Italy", 310,10, size=10,weight='bold', font='Times New Roman')
+                ),
+            Panel(
+                SVG(sweden),Text("Sweden", 310, 5, size=10,weight='bold', font='Times New Roman')
+                ).move(0,180),
+            Panel(
+              SVG(markers).move(0,360)
+                 )).save(outname)
+
+def compose_labeled(svgs, labels, text_ys, moves, outname):
+    '''Compose the country svgs below each other with the country name as label
+    '''
+    text_x=310
+    Figure("18cm", "29cm",
+            *[Panel(
+                SVG(svg),Text(label, text_x,text_y, size=10,weight='bold', font='Times New Roman')
+                ).move(0,move) for svg, label, text_y, move in zip(svgs, labels, text_ys, moves)]
+             ).tile(1, 6).save(outname)
+
+def compose_with_markers(markers, panels, outname):
+    '''Compose the markers above the panels
+    '''
+    Figure("18cm", "29cm",
+            Panel(
+                SVG(markers)
+                ),
+            Panel(
+                SVG(panels)
+                ).move(0,90)
+            ).save(outname)
+
+def svg_job(outname, function, inputs, *args):
+    '''Get the job composing outname from the input svgs
     '''
-    Figure("18cm", "6cm",
-              SVG(country+'_cumulative_cases.svg'),
-              SVG(country+'_deaths.svg'),
-              SVG(country+'_Rt.svg')
-             ).tile(3, 1).save(country+'.svg')
-#Compose each country
-for country in countries:
-    ind_country_format(country)
+    return figure_job(outname, function, inputs, *args, outname, inputs=inputs)
+
+#####MAIN#####
+args = parser.parse_args()
+
+#Compose each country - cum cases, deaths per day and Rt
+render_figures([svg_job(country+'.svg', compose_tiles, [country+'_cumulative_cases.svg', country+'_deaths.svg', country+'_Rt.svg'], "18cm", "6cm", 3, 1)
+                for country in countries], 1, force=args.force)
 
 #Markers
-Figure("18cm", "2.25cm",
-          SVG('NPI_markers.svg'),
-          SVG("mobility_markers.svg"),
-           SVG("foreacast_markers.svg"),
-         ).tile(3, 1).save('markers.svg')
+render_figures([svg_job('markers.svg', compose_tiles, ['NPI_markers.svg', 'mobility_markers.svg', 'foreacast_markers.svg'], "18cm", "2.25cm", 3, 1)], 1, force=args.force)
 
+y_move=0
+text_y=5
+jobs = []
 #Figure 1 Italy and Sweden
-Figure("18cm", "16cm",
-        Panel(
-            SVG('Italy.svg'),Text("Italy", 310,10, size=10,weight='bold', font='Times New Roman')
-            ),
-        Panel(
-            SVG('Sweden.svg'),Text("Sweden", 310, 5, size=10,weight='bold', font='Times New Roman')
-            ).move(0,180),
-        Panel(
-          SVG('markers.svg').move(0,360)
-             )).save(outdir+'Figure1.svg')
+jobs.append(figure_job(outdir+'Figure1.svg', compose_figure1, 'Italy.svg', 'Sweden.svg', 'markers.svg', outdir+'Figure1.svg',
+                       inputs=['Italy.svg', 'Sweden.svg', 'markers.svg']))
 
 #Figure 2 - forecast
-Figure("14cm", "14cm",
-          SVG('./forecast/Austria_forecast.svg'),
-          SVG('./forecast/Belgium_forecast.svg'),
-          SVG('./forecast/Denmark_forecast.svg'),
-          SVG('./forecast/France_forecast.svg'),
-          SVG('./forecast/Germany_forecast.svg'),
-          SVG('./forecast/Italy_forecast.svg'),
-          SVG('./forecast/Norway_forecast.svg'),
-          SVG('./forecast/Spain_forecast.svg'),
-          SVG('./forecast/Sweden_forecast.svg'),
-          SVG('./forecast/Switzerland_forecast.svg'),
-          SVG('./forecast/United_Kingdom_forecast.svg'),
-         ).tile(3, 4).save(outdir+'Figure2.svg')
-
+jobs.append(svg_job(outdir+'Figure2.svg', compose_tiles, ['./forecast/'+country+'_forecast.svg' for country in sorted(countries)], "14cm", "14cm", 3, 4))
 
 #Supplementary material
 #Figure S1 - cum cases/deaths per day/Rt
-#Part 1
-y_move=0
-text_x=310
-text_y=5
-Figure("18cm", "29cm",
-        Panel(
-             SVG('Austria.svg'),Text("Austria", text_x,text_y, size=10,weight='bold', font='Times New Roman')
-            ).move(0,y_move),
-         Panel(
-              SVG('Belgium.svg'),Text("Belgium", text_x,text_y, size=10,weight='bold', font='Times New Roman')
-             ).move(0,y_move*2),
-         Panel(
-              SVG('Denmark.svg'),Text("Denmark", text_x,text_y, size=10,weight='bold', font='Times New Roman')
-             ).move(0,y_move*3),
-         Panel(
-              SVG('France.svg'),Text("France", text_x,text_y, size=10,weight='bold', font='Times New Roman')
-             ).move(0,y_move*4),
-        Panel(
-             SVG('Germany.svg'),Text("Germany", text_x,text_y, size=10,weight='bold', font='Times New Roman')
-            ).move(0,y_move*5)
-         ).tile(1, 6).save(outdir+'FigureS1_part1.svg')
-Figure("18cm", "29cm",
-        Panel(
-            SVG('markers.svg')
-            ),
-        Panel(
-            SVG(outdir+'FigureS1_part1.svg')
-            ).move(0,90)
-        ).save(outdir+'FigureS1_part1.svg')
+#Part 1 - the panels are composed first, then the markers are added above
+part1 = ['Austria', 'Belgium', 'Denmark', 'France', 'Germany']
+jobs.append(svg_job(outdir+'FigureS1_part1_panels.svg', compose_labeled, [country+'.svg' for country in part1], part1,
+                    [text_y]*5, [y_move*k for k in range(1,6)]))
 
 #Part 2
-Figure("18cm", "29cm",
-        Panel(
-             SVG('Italy.svg'),Text("Italy", text_x,10, size=10,weight='bold', font='Times New Roman')
-            ),
-         Panel(
-              SVG('Norway.svg'),Text("Norway", text_x,text_y, size=10,weight='bold', font='Times New Roman')
-             ).move(0,y_move),
-         Panel(
-              SVG('Spain.svg'),Text("Spain", text_x,text_y, size=10,weight='bold', font='Times New Roman')
-             ).move(0,y_move*2),
-         Panel(
-              SVG('Sweden.svg'),Text("Sweden", text_x,text_y, size=10,weight='bold', font='Times New Roman')
-             ).move(0,y_move*3),
-        Panel(
-             SVG('Switzerland.svg'),Text("Switzerland", text_x,text_y, size=10,weight='bold', font='Times New Roman')
-            ).move(0,y_move*4),
-        Panel(
-             SVG('United_Kingdom.svg'),Text("United Kingdom", text_x,text_y, size=10,weight='bold', font='Times New Roman')
-            ).move(0,y_move*5)
-         ).tile(1, 6).save(outdir+'FigureS1_part2.svg')
+part2 = ['Italy', 'Norway', 'Spain', 'Sweden', 'Switzerland', 'United_Kingdom']
+jobs.append(svg_job(outdir+'FigureS1_part2.svg', compose_labeled, [country+'.svg' for country in part2], [country.replace('_',' ') for country in part2],
+                    [10]+[text_y]*5, [y_move*k for k in range(6)]))
 
 #Figure S2 - forecast for ICL model
-Figure("14cm", "14cm",
-          SVG('/home/patrick/COVID19.github.io/simulations/icl_model/model_output/3_week_forecast/plots/forecast/Austria_forecast.svg'),
-          SVG('/home/patrick/COVID19.github.io/simulations/icl_model/model_output/3_week_forecast/plots/forecast/Belgium_forecast.svg'),
-          SVG('/home/patrick/COVID19.github.io/simulations/icl_model/model_output/3_week_forecast/plots/forecast/Denmark_forecast.svg'),
-          SVG('/home/patrick/COVID19.github.io/simulations/icl_model/model_output/3_week_forecast/plots/forecast/France_forecast.svg'),
-          SVG('/home/patrick/COVID19.github.io/simulations/icl_model/model_output/3_week_forecast/plots/forecast/Germany_forecast.svg'),
-          SVG('/home/patrick/COVID19.github.io/simulations/icl_model/model_output/3_week_forecast/plots/forecast/Italy_forecast.svg'),
-          SVG('/home/patrick/COVID19.github.io/simulations/icl_model/model_output/3_week_forecast/plots/forecast/Norway_forecast.svg'),
-          SVG('/home/patrick/COVID19.github.io/simulations/icl_model/model_output/3_week_forecast/plots/forecast/Spain_forecast.svg'),
-          SVG('/home/patrick/COVID19.github.io/simulations/icl_model/model_output/3_week_forecast/plots/forecast/Sweden_forecast.svg'),
-          SVG('/home/patrick/COVID19.github.io/simulations/icl_model/model_output/3_week_forecast/plots/forecast/Switzerland_forecast.svg'),
-          SVG('/home/patrick/COVID19.github.io/simulations/icl_model/model_output/3_week_forecast/plots/forecast/United_Kingdom_forecast.svg'),
-         ).tile(3, 4).save(outdir+'FigureS2.svg')
+jobs.append(svg_job(outdir+'FigureS2.svg', compose_tiles, [icl_forecast+country+'_forecast.svg' for country in sorted(countries)], "14cm", "14cm", 3, 4))
 
 #Figure S3 - LOO alphas
-Figure("18cm", "26cm",
-          SVG('./LOO/retail and recreation.svg'),
-          SVG('./LOO/grocery and pharmacy.svg'),
-          SVG('./LOO/transit stations.svg'),
-          SVG('./LOO/workplace.svg'),
-          SVG('./LOO/residential.svg'),
-         ).tile(2, 3).save(outdir+'FigureS4.svg')
+jobs.append(svg_job(outdir+'FigureS4.svg', compose_tiles, ['./LOO/retail and recreation.svg', './LOO/grocery and pharmacy.svg', './LOO/transit stations.svg',
+                    './LOO/workplace.svg', './LOO/residential.svg'], "18cm", "26cm", 2, 3))
+render_figures(jobs, 1, force=args.force)
+
+#Figure S1 part 1 with the markers
+render_figures([figure_job(outdir+'FigureS1_part1.svg', compose_with_markers, 'markers.svg', outdir+'FigureS1_part1_panels.svg', outdir+'FigureS1_part1.svg',
+                           inputs=['markers.svg', outdir+'FigureS1_part1_panels.svg'])], 1, force=args.force)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+'''NumPy version of the renewal model in mobility.stan, evaluated for
+all posterior draws x days x countries with batched array operations:
+Rt = mu*exp(covariate1*alpha[1]+...+covariate4*alpha[4]-covariate5*alpha[5])
+prediction[i] = Rt[i]*sum(prediction[j]*SI[i-j], j<i) after the N0 seeded days (y)
+E_deaths[i] = sum(prediction[j]*f[i-j], j<i)
+and the counterfactual without mobility changes (Rt = mu) computed from the saved draws of a fit
+'''
+
+import os
+import numpy as np
+import pandas as pd
+from scipy.special import gammaln
+from draw_store import read_draws, has_draws, add_draw_arrays
+from stan_data_bundle import read_stan_data
+from approximate import draws_summary
+
+#Sign of each covariate in Rt (residential reduces the spread)
+covariate_signs = np.array([1, 1, 1, 1, -1])
+#Draws simulated at a time
+chunk_draws = 500
+#Variables of the counterfactual, formerly generated quantities of mobility.stan
+counterfactual_names = ['prediction0', 'E_deaths0', 'lp0', 'lp1']
+
+def stan_covariates(stan_data):
+    '''Get the covariates of the stan data as one K x N2 x M tensor
+    '''
+    K = len([key for key in stan_data if key.startswith('covariate')])
+    return np.stack([np.asarray(stan_data['covariate'+str(k+1)], dtype=float) for k in range(K)])
+
+def death_kernel_matrix(f):
+    '''Get K[i,j,m] = f[i-j,m] (1-based f) for j<i, 0 otherwise, so that E_deaths = K.prediction
+    '''
+    N2 = f.shape[0]
+    lag = np.arange(N2)[:,np.newaxis]-np.arange(N2)[np.newaxis,:]
+    kernel = np.where((lag>0)[:,:,np.newaxis], f[np.clip(lag-1, 0, None)], 0)
+    return kernel
+
+def forward_simulate(mu, alpha, y, covariates, SI, f, N0=6, signs=covariate_signs):
+    '''Get the prediction (cases), E_deaths and Rt (draws x N2 x M) for draws of
+    mu (draws x M), alpha (draws x K) and y (draws x M)
+    covariates = K x N2 x M mobility changes
+    SI = serial interval (N2), f = infection to death kernel (N2 x M)
+    '''
+    mu, alpha, y = np.asarray(mu, dtype=float), np.asarray(alpha, dtype=float), np.asarray(y, dtype=float)
+    SI, f = np.asarray(SI, dtype=float), np.asarray(f, dtype=float)
+    N2 = covariates.shape[1]
+    Rt = mu[:,np.newaxis,:]*np.exp(np.einsum('kim,dk->dim', covariates, alpha*signs[np.newaxis,:alpha.shape[1]]))
+
+    prediction = np.zeros(Rt.shape)
+    prediction[:,:N0,:] = y[:,np.newaxis,:]
+    for i in range(N0, N2):
+        #Cases today due to all earlier cases, weighted by the serial interval SI[i-j]
+        convolution = np.einsum('djm,j->dm', prediction[:,:i,:], SI[i-1::-1])
+        prediction[:,i,:] = Rt[:,i,:]*convolution
+
+    E_deaths = np.einsum('ijm,djm->dim', death_kernel_matrix(f), prediction)
+    E_deaths[:,0,:] = 1e-9
+    return {'prediction':prediction, 'E_deaths':E_deaths, 'Rt':Rt}
+
+def simulate_fit(outdir, covariates=None, draws=None, chunk_draws=chunk_draws):
+    '''Re-run the renewal model of a fit (outdir with draws and a stan_data bundle)
+    in chunks of chunk_draws draws, e.g. under other mobility assumptions.
+    covariates = K x N2 x M tensor replacing the fitted covariates, the fitted ones if None
+    draws = index or slice of the draws to use, all if None
+    Returns prediction, E_deaths and Rt (draws x N2 x M)
+    '''
+    stan_data, info = read_stan_data(outdir)
+    if covariates is None:
+        covariates = stan_covariates(stan_data)
+    mu = read_draws(outdir, 'mu', draws=draws)
+    alpha = read_draws(outdir, 'alpha', draws=draws)
+    y = read_draws(outdir, 'y', draws=draws)
+    out = {name:np.zeros((len(mu),)+covariates.shape[1:]) for name in ['prediction', 'E_deaths', 'Rt']}
+    for start in range(0, len(mu), chunk_draws):
+        chunk = slice(start, start+chunk_draws)
+        simulated = forward_simulate(mu[chunk], alpha[chunk], y[chunk], covariates,
+                                    stan_data['SI'], stan_data['f'], stan_data['N0'])
+        for name in out:
+            out[name][chunk] = simulated[name]
+    return out
+
+def neg_binomial_2_log_lpmf(n, eta, phi):
+    '''Log pmf of stan's neg_binomial_2_log(n | eta, phi): negative binomial with mean exp(eta)
+    and variance exp(eta)+exp(eta)^2/phi
+    '''
+    log_mean_phi = np.logaddexp(eta, np.log(phi))
+    return gammaln(n+phi)-gammaln(n+1)-gammaln(phi)+phi*(np.log(phi)-log_mean_phi)+n*(eta-log_mean_phi)
+
+def has_phi(outdir):
+    '''Check if the draws of phi, or of phi_mu, phi_tau and phi_eta to rebuild it from, are written to outdir
+    '''
+    return has_draws(outdir, 'phi') or all(has_draws(outdir, name) for name in ['phi_mu', 'phi_tau', 'phi_eta'])
+
+def read_phi(outdir, draws=None):
+    '''Read the draws of the overdispersion phi. phi (a transformed parameter of mobility.stan) is saved by default,
+    if --outputs left it out it is rebuilt as phi_mu+phi_tau*phi_eta
+    '''
+    if has_draws(outdir, 'phi'):
+        return np.asarray(read_draws(outdir, 'phi', draws=draws))
+    return np.asarray(read_draws(outdir, 'phi_mu', draws=draws))+np.asarray(read_draws(outdir, 'phi_tau', draws=draws))*np.asarray(read_draws(outdir, 'phi_eta', draws=draws))
+
+def counterfactual_fit(outdir, draws=None, chunk_draws=chunk_draws):
+    '''Get the counterfactual of a fit without mobility changes, as the generated quantities of mobility.stan:
+    prediction0, E_deaths0 = cases and expected deaths with Rt = mu (draws x N2 x M)
+    lp0, lp1 = neg_binomial_2_log_lpmf of the observed deaths given E_deaths and E_deaths0 (1000 after N[m])
+    The fitted E_deaths are simulated from the draws if they were not saved.
+    draws = index or slice of the draws to use, all if None
+    '''
+    stan_data, info = read_stan_data(outdir)
+    covariates = stan_covariates(stan_data)
+    counterfactual = simulate_fit(outdir, np.zeros(covariates.shape), draws, chunk_draws)
+    if has_draws(outdir, 'E_deaths'):
+        E_deaths = read_draws(outdir, 'E_deaths', draws=draws)
+    else:
+        E_deaths = simulate_fit(outdir, covariates, draws, chunk_draws)['E_deaths']
+    phi = read_phi(outdir, draws)
+
+    #Observed days of each country
+    deaths = np.asarray(stan_data['deaths'], dtype=float)
+    observed = np.arange(deaths.shape[0])[:,np.newaxis] < np.asarray(stan_data['N'])[np.newaxis,:]
+    out = {'prediction0':counterfactual['prediction'], 'E_deaths0':counterfactual['E_deaths']}
+    out['lp0'] = np.full(E_deaths.shape, 1000.0)
+    out['lp1'] = np.full(E_deaths.shape, 1000.0)
+    for start in range(0, len(phi), chunk_draws):
+        chunk = slice(start, start+chunk_draws)
+        chunk_phi = np.asarray(phi[chunk])[:,np.newaxis,np.newaxis]
+        for name, expected in [('lp0', E_deaths), ('lp1', out['E_deaths0'])]:
+            out[name][chunk] = np.where(observed, neg_binomial_2_log_lpmf(deaths, np.asarray(expected[chunk]), chunk_phi), 1000.0)
+    return out
+
+def write_counterfactual(outdir, chunk_draws=chunk_draws):
+    '''Compute the counterfactual of a fit and add it to the saved draws (prediction0.npy, ...)
+    and to the rows of summary.csv
+    '''
+    counterfactual = counterfactual_fit(outdir, chunk_draws=chunk_draws)
+    add_draw_arrays(counterfactual, outdir)
+    summary_file = os.path.join(outdir, 'summary.csv')
+    if os.path.exists(summary_file):
+        summary = pd.read_csv(summary_file, index_col=0)
+        summary = summary[~summary.index.str.split('[').str[0].isin(counterfactual_names)]
+        summary = pd.concat([summary, draws_summary(counterfactual)])
+        summary.to_csv(summary_file)
+    return counterfactual
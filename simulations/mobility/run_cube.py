@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+'''The summaries of several runs (e.g. the COMBOn/ fits of a leave one out sweep) read
+concurrently and aligned into one posterior cube of shape (run, variable, country, day),
+NaN where a run did not model a country, together with a table of which countries each run left out
+'''
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from summary_table import read_summary
+
+#Variables per country and day in the cube
+cube_variables = ['prediction', 'E_deaths', 'Rt']
+
+def combo_dirs(outdir, n_combos):
+    '''Get the run directories of a leave one out sweep, COMBOn/ for combination n (from 1)
+    '''
+    return [os.path.join(outdir, 'COMBO'+str(i+1))+'/' for i in range(n_combos)]
+
+def run_table(run_dirs, run_countries, countries=None):
+    '''Get the run metadata: the directory, the number of countries and the countries left out (csv)
+    of each run, compared to countries (default all countries of all runs, in order of appearance)
+    '''
+    if countries is None:
+        countries = list(dict.fromkeys(country for run in run_countries for country in run))
+    left_out = [','.join(country for country in countries if country not in set(run)) for run in run_countries]
+    return pd.DataFrame({'run':np.arange(len(run_dirs)), 'directory':run_dirs,
+                         'countries':[len(run) for run in run_countries], 'left_out':left_out})
+
+def read_runs(run_dirs, run_countries, variables=cube_variables, stat='mean', parameters=['alpha'], n_jobs=None):
+    '''Read the summary.csv of each run on n_jobs threads (default all cores) and align a statistic
+    of the variables into a runs x variables x countries x days array.
+    run_countries = the countries of each run, in the order they were modeled
+    parameters = other variables to keep from each run, stacked along a first run axis
+    Returns the cube, the countries of its country axis, the run table (run_table)
+    and the parameters as {name: {statistic: array}}
+    '''
+    countries = list(dict.fromkeys(country for run in run_countries for country in run))
+    country_index = {country:c for c, country in enumerate(countries)}
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as pool:
+        summaries = list(pool.map(lambda run_dir: read_summary(run_dir, list(variables)+list(parameters)), run_dirs))
+
+    days = max(summary[var][stat].shape[0] for summary in summaries for var in variables)
+    cube = np.full((len(run_dirs), len(variables), len(countries), days), np.nan)
+    for r, summary in enumerate(summaries):
+        #Country axis of this run -> country axis of the cube
+        columns = [country_index[country] for country in run_countries[r]]
+        for v, var in enumerate(variables):
+            values = summary[var][stat]
+            cube[r, v, :, :values.shape[0]][columns] = values.T
+    run_parameters = {name:{key:np.stack([summary[name][key] for summary in summaries])
+                      for key in summaries[0][name]} for name in parameters}
+    return cube, countries, run_table(run_dirs, run_countries, countries), run_parameters
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+'''The stan_data fed to a model, saved with the model output so that the
+forecast and visualization steps use exactly the fitted data without
+re-reading the ECDC and mobility csvs
+'''
+
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+
+#Increase if the layout of the bundle changes
+bundle_version = 2
+#Directory of the bundle in the model outdir
+bundle_name = 'stan_data'
+
+def bundle_path(outdir):
+    '''Get the path to the stan_data bundle of a model outdir
+    '''
+    return os.path.join(outdir, bundle_name)
+
+def model_dates(observed_dates, N2):
+    '''Get the date of each modeled day per country (N2 x M): the dates of the observed rows
+    (which may skip days missing in the ECDC data), then one day at a time after the last one
+    observed_dates = the dates of the observed rows of each country
+    '''
+    dates = np.zeros((N2, len(observed_dates)), dtype='datetime64[D]')
+    for c, country_dates in enumerate(observed_dates):
+        country_dates = np.array(country_dates, dtype='datetime64[D]')
+        N = len(country_dates)
+        dates[:N,c] = country_dates
+        dates[N:,c] = country_dates[-1]+np.arange(1, N2-N+1)
+    return dates
+
+def write_stan_data(stan_data, outdir, countries, dates, end_date=None, covariate_names=None):
+    '''Write every array in stan_data as one .npy (so it can be memory-mapped)
+    together with dates.npy, the date of each modeled day per country (N2 x M, model_dates),
+    and bundle.json holding the countries, the first modeled date per country,
+    the end date of the data and the names of the covariates.
+    '''
+    os.makedirs(outdir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=outdir)
+    for key in stan_data:
+        np.save(os.path.join(tmp_dir, key+'.npy'), np.asarray(stan_data[key]))
+    dates = np.array(dates, dtype='datetime64[D]')
+    np.save(os.path.join(tmp_dir, 'dates.npy'), dates)
+    info = {'version':bundle_version,
+            'keys':[*stan_data.keys()],
+            'countries':list(countries),
+            'start_dates':[str(date) for date in dates[0]],
+            'end_date':None if end_date is None else str(np.datetime64(end_date, 'D')),
+            'covariate_names':None if covariate_names is None else list(covariate_names)}
+    with open(os.path.join(tmp_dir, 'bundle.json'), 'w') as fh:
+        json.dump(info, fh, indent=1)
+    #Replace a bundle from an earlier run
+    path = bundle_path(outdir)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_dir, path)
+
+def has_stan_data(outdir):
+    '''Check if a model outdir has a stan_data bundle
+    '''
+    return os.path.exists(os.path.join(bundle_path(outdir), 'bundle.json'))
+
+def read_stan_data(outdir, mmap_mode='r'):
+    '''Read the stan_data bundle of a model outdir.
+    Returns the stan_data (arrays memory-mapped) and the bundle info,
+    with the date of each modeled day per country (N2 x M) as dates_by_country.
+    '''
+    path = bundle_path(outdir)
+    with open(os.path.join(path, 'bundle.json')) as fh:
+        info = json.load(fh)
+    if info['version'] != bundle_version:
+        raise ValueError('Unsupported stan_data bundle version '+str(info['version'])+' in '+path)
+    stan_data = {}
+    for key in info['keys']:
+        values = np.load(os.path.join(path, key+'.npy'), mmap_mode=mmap_mode)
+        stan_data[key] = values if values.ndim > 0 else values.item()
+    info['dates_by_country'] = np.load(os.path.join(path, 'dates.npy'), mmap_mode=mmap_mode)
+    return stan_data, info
+
+def plot_data(stan_data, info):
+    '''Format the bundle as the per country data used for plotting (N2 x M):
+    dates, observed deaths and cases (0 for the forecast), number of observed days
+    and the covariates by their mobility name
+    '''
+    N2 = stan_data['N2']
+    observed = np.arange(N2)[:,np.newaxis] < np.asarray(stan_data['N'])[np.newaxis,:]
+    data = {'dates_by_country':np.array(info['dates_by_country']),
+            'deaths_by_country':np.where(observed, stan_data['deaths'], 0).astype(float),
+            'cases_by_country':np.where(observed, stan_data['cases'], 0).astype(float),
+            'days_by_country':np.array(stan_data['N'], dtype=float)}
+    if info['covariate_names'] is not None:
+        for i, name in enumerate(info['covariate_names']):
+            data[name] = stan_data['covariate'+str(i+1)]
+    return data
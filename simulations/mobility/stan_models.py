@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+'''Compiled pystan models cached on disk, so that repeated fits of the same
+stan file skip the C++ compilation, the named sampling profiles and warm starts
+from an earlier fit
+'''
+
+import os
+import json
+import sys
+import fcntl
+import pickle
+import hashlib
+import platform
+import sysconfig
+import tempfile
+import numpy as np
+import pystan
+from draw_store import read_draws
+
+def model_hash(stan_file):
+    '''Get the sha1 of the stan source together with everything the compiled model depends on:
+    the pystan, python and compiler versions
+    '''
+    hasher = hashlib.sha1()
+    with open(stan_file, 'rb') as fh:
+        hasher.update(fh.read())
+    for part in [pystan.__version__, sys.version, platform.machine(), str(sysconfig.get_config_var('CC'))]:
+        hasher.update(b'\0'+part.encode())
+    return hasher.hexdigest()
+
+def compiled_model(stan_file, cache_root=None):
+    '''Get the pystan.StanModel of stan_file, compiled only if it is not in the cache.
+    The cache (default .<stan file>.cache next to the stan file) holds one pickled model
+    per model_hash. A lock file makes concurrent processes wait for a single compilation.
+    '''
+    stan_dir, stan_name = os.path.split(os.path.abspath(stan_file))
+    if cache_root is None:
+        cache_root = os.path.join(stan_dir, '.'+stan_name+'.cache')
+    os.makedirs(cache_root, exist_ok=True)
+    model_file = os.path.join(cache_root, model_hash(stan_file)+'.pkl')
+
+    with open(model_file+'.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(model_file, 'rb') as fh:
+                return pickle.load(fh)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+        sm = pystan.StanModel(file=stan_file)
+        fd, tmp_file = tempfile.mkstemp(dir=cache_root, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            pickle.dump(sm, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, model_file)
+    return sm
+
+#Named sampling profiles (arguments to StanModel.sampling)
+#control updates the control settings of the model script
+#warm_warmup = the shorter warmup used when warm starting from an earlier fit
+sampling_profiles = {'smoke':{'iter':200, 'warmup':100, 'chains':2, 'thin':1, 'control':{}, 'warm_warmup':50},
+                     'production':{'iter':4000, 'warmup':2000, 'chains':8, 'thin':4, 'control':{}, 'warm_warmup':500},
+                     'publication':{'iter':8000, 'warmup':4000, 'chains':8, 'thin':4, 'control':{'adapt_delta':0.99}, 'warm_warmup':1000}}
+#Parameters initialized from an earlier fit (and all phi*)
+warm_start_pars = ['mu', 'alpha', 'kappa', 'y', 'tau']
+
+def available_cores():
+    '''Get the number of cores this process may run on
+    '''
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError: #Not available on all platforms
+        return os.cpu_count()
+
+def sampling_settings(profile, control, n_jobs=None, pars=None):
+    '''Get the arguments to StanModel.sampling for a named profile
+    control = the control settings of the model (adapt_delta, max_treedepth)
+    n_jobs = max number of cores to use, default all available.
+    One core is used per chain, never more than the number of chains.
+    pars = the variables to keep in the fit, summary and saved draws, all if None
+    '''
+    if profile not in sampling_profiles:
+        raise ValueError('Unknown sampling profile '+str(profile)+', use one of '+', '.join(sampling_profiles))
+    settings = {key:value for key, value in sampling_profiles[profile].items() if key not in ['control', 'warm_warmup']}
+    settings['control'] = {**control, **sampling_profiles[profile]['control']}
+    settings['n_jobs'] = max(1, min(settings['chains'], n_jobs or available_cores()))
+    settings['pars'] = None if pars is None else list(pars)
+    return settings
+
+def write_sampling_settings(profile, settings, outdir, warm_start_dir=None, backend='nuts'):
+    '''Record the sampling profile and settings used with the model output
+    '''
+    recorded = {key:value for key, value in settings.items() if key != 'init'}
+    recorded['control'] = {key:value for key, value in settings['control'].items() if key != 'inv_metric'}
+    recorded['warm_start'] = warm_start_dir
+    recorded['backend'] = backend
+    with open(os.path.join(outdir, 'sampling_profile.json'), 'w') as fh:
+        json.dump({'profile':profile, **recorded}, fh, indent=1)
+
+def write_adaptation(fit, stan_file, outdir):
+    '''Record the adapted step size and inverse metric of each chain for warm starts,
+    if supported by the installed pystan (2.19+)
+    '''
+    try:
+        stepsize = [float(chain_stepsize) for chain_stepsize in fit.get_stepsize()]
+        inv_metric = [np.asarray(chain_metric).tolist() for chain_metric in fit.get_inv_metric()]
+    except (AttributeError, ValueError, TypeError):
+        return
+    with open(os.path.join(outdir, 'adaptation.json'), 'w') as fh:
+        json.dump({'model':model_hash(stan_file), 'stepsize':stepsize, 'inv_metric':inv_metric}, fh)
+
+def warm_start(settings, profile, previous_outdir, stan_file, M):
+    '''Update the sampling settings to start from the fit in previous_outdir:
+    each chain is initialized from a posterior draw of warm_start_pars and phi*,
+    the adapted step size and metric are reused if the model is the same,
+    and the warmup is shortened to the warm_warmup of the profile (keeping the number of draws).
+    M = number of countries, must be the same as in the earlier fit
+    '''
+    with open(os.path.join(previous_outdir, 'draws.json')) as fh:
+        names = json.load(fh)['names']
+    pars = [name for name in names if name in warm_start_pars or name.startswith('phi')]
+    if not pars:
+        raise ValueError('No draws of '+', '.join(warm_start_pars)+' or phi* in '+previous_outdir)
+    draws = {name:read_draws(previous_outdir, name) for name in pars}
+    for name in ['mu', 'y']:
+        if name in draws and draws[name].shape[1] != M:
+            raise ValueError('Can not warm start from '+previous_outdir+', it has '+str(draws[name].shape[1])+' countries, not '+str(M))
+    #Draws spread over the earlier posterior, one per chain
+    picks = np.linspace(0, len(draws[pars[0]])-1, settings['chains']).astype(int)
+    settings['init'] = [{name:draws[name][pick].tolist() for name in pars} for pick in picks]
+
+    try:
+        with open(os.path.join(previous_outdir, 'adaptation.json')) as fh:
+            adaptation = json.load(fh)
+        if adaptation['model'] == model_hash(stan_file):
+            settings['control']['stepsize'] = float(np.mean(adaptation['stepsize']))
+            settings['control']['inv_metric'] = np.mean(np.array(adaptation['inv_metric']), axis=0)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    warmup = sampling_profiles[profile]['warm_warmup']
+    settings['iter'] -= settings['warmup']-warmup
+    settings['warmup'] = warmup
+    return settings
+
+def output_pars(outputs):
+    '''Get the list of variables to output from a csv, None (all) if empty
+    '''
+    if not outputs:
+        return None
+    return [name.strip() for name in outputs.split(',') if name.strip()]
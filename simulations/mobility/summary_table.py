@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+'''summary.csv of a fit read into dense arrays: the row names (e.g. E_deaths[3,2])
+are parsed once, and each statistic of a variable is an array over its indices,
+e.g. summary['E_deaths']['mean'] with shape (N2, M), summary['alpha']['2.5%'] with shape (5,)
+'''
+
+import os
+import numpy as np
+import pandas as pd
+
+def parse_row_names(row_names):
+    '''Split the row names into the variable names and the indices (from 0, -1 where missing)
+    Returns the names and a rows x max number of indices array
+    '''
+    parts = pd.Series(row_names).str.extract(r'^([^\[]+)(?:\[([\d,]+)\])?$')
+    indices = parts[1].fillna('').str.split(',', expand=True)
+    indices = indices.apply(pd.to_numeric, errors='coerce').fillna(0).astype(int).values-1
+    return parts[0].values, indices
+
+def read_summary(outdir, variables=None):
+    '''Read outdir/summary.csv as {variable: {statistic: array}}
+    Arrays have the shape of the variable (e.g. N2 x M for E_deaths), 0-d for scalars
+    variables = the variables to read, all if None
+    '''
+    summary = pd.read_csv(os.path.join(outdir, 'summary.csv'), index_col=0)
+    names, indices = parse_row_names(summary.index)
+    stats = summary.columns
+    values = summary.values
+    arrays = {}
+    for name in pd.unique(names):
+        if variables is not None and name not in variables:
+            continue
+        rows = np.flatnonzero(names == name)
+        ndim = int((indices[rows] >= 0).sum(axis=1).max())
+        index = indices[rows, :ndim]
+        shape = tuple(index.max(axis=0)+1)
+        arrays[name] = {}
+        for s, stat in enumerate(stats):
+            if ndim == 0:
+                arrays[name][stat] = np.array(values[rows[0], s])
+                continue
+            dense = np.full(shape, np.nan)
+            dense[tuple(index.T)] = values[rows, s]
+            arrays[name][stat] = dense
+    return arrays
+
+def summary_column(summary, stat):
+    '''Get a statistic of all rows (all variables) as one flat array, e.g. for a histogram of Rhat
+    '''
+    return np.concatenate([np.ravel(summary[name][stat]) for name in summary])
@@ -13,6 +13,9 @@ import numpy as np
 import seaborn as sns
 from scipy.signal import savgol_filter
 from scipy.stats import pearsonr
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../mobility'))
+from mobility_data import read_mobility_data
+from epidemic_data import read_epidemic_data, country_data
 import pdb
 
 
@@ -30,10 +33,6 @@ def construct_signals(R_estimates, epidemic_data, mobility_data, outdir):
         '''Read in and format all data needed for the signal correlation analysis
         '''
 
-        #Convert epidemic data to datetime
-        epidemic_data['dateRep'] = pd.to_datetime(epidemic_data['dateRep'], format='%d/%m/%Y')
-        #Convert mobility data to datetime
-        mobility_data['date'] = pd.to_datetime(mobility_data['date'], format='%Y/%m/%d')
 
         #Mobility key conversions
         key_conversions = {'United_States_of_America':'United_States'}
@@ -51,7 +50,7 @@ def construct_signals(R_estimates, epidemic_data, mobility_data, outdir):
         C_mob_delay_all = []
         C_R_delay_all = []
         #Get unique countries
-        countries = epidemic_data['countriesAndTerritories'].unique()
+        countries = epidemic_data['countries']
         for country in countries:
             try:
                 country_R = pd.read_csv(R_estimates+country+'_R_estimate.csv')
@@ -59,12 +58,8 @@ def construct_signals(R_estimates, epidemic_data, mobility_data, outdir):
                 print('Cant read '+country+'_R_estimate.csv' )
             #Fix datetime
             country_R['date'] = pd.to_datetime(country_R['date'], format='%d/%m/%Y')
-            #Get country epidemic data
-            country_epidemic_data = epidemic_data[epidemic_data['countriesAndTerritories']==country]
-            #Sort on date
-            country_epidemic_data = country_epidemic_data.sort_values(by='dateRep')
-            #Reset index
-            country_epidemic_data = country_epidemic_data.reset_index()
+            #Get country epidemic data, sorted on date
+            country_epidemic_data = country_data(epidemic_data, country)
             #Get data for day >= t_c, where t_c is the day where 80 % of the max death count has been reached
             #death_t = max(country_epidemic_data['deaths'])
             #signal_start = min(country_epidemic_data[country_epidemic_data['deaths']>=death_t].index)
@@ -280,8 +275,8 @@ def compare_smoothing(country_signal_data, outdir):
 matplotlib.rcParams.update({'font.size': 9})
 args = parser.parse_args()
 R_estimates = args.R_estimates[0]
-epidemic_data = pd.read_csv(args.epidemic_data[0])
-mobility_data = pd.read_csv(args.mobility_data[0])
+epidemic_data = read_epidemic_data(args.epidemic_data[0]) #Grouped and sorted per country
+mobility_data = read_mobility_data(args.mobility_data[0]) #Dates are parsed by the loader
 outdir = args.outdir[0]
 
 #Construct signals
@@ -14,6 +14,10 @@ import json
 import shapely
 import matplotlib.pyplot as plt
 import argparse
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../simulations/mobility'))
+from mobility_data import read_mobility_data
 import pdb
 
 ###FUNCTIONS###
@@ -73,9 +77,7 @@ def read_data():
 
 
     #Mobility data
-    mobility_data = pd.read_csv('./Global_Mobility_Report.csv')
-    #Convert to datetime
-    mobility_data['date']=pd.to_datetime(mobility_data['date'], format='%Y/%m/%d')
+    mobility_data = read_mobility_data('./Global_Mobility_Report.csv')
     #Match mobility data by date and country
 
     return geosource, ecdc_capital, dates